@@ -0,0 +1,302 @@
+from asyncio import Semaphore, gather, get_running_loop, run
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from pymongo.encryption import Algorithm
+from pymongo.errors import EncryptionError, PyMongoError
+from random import randint
+from urllib.parse import quote_plus
+import names
+import os
+import sys
+
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import get_client_manager
+from csfle_common.keys import DEK_CACHE, lookup_dek_id, get_employee_key, DekPool
+from csfle_common.schema import load_schema_map
+
+# IN VALUES HERE!
+PETNAME = 
+MDB_PASSWORD = 
+APP_USER = "app_user"
+CA_PATH = "/etc/pki/tls/certs/ca.cert"
+
+class AsyncCSFLE:
+  """ asyncio front end to the encryption workflow used by these scripts
+
+  pymongo and libmongocrypt are blocking, so every call is run on a dedicated thread pool and
+  awaited, which keeps the event loop responsive and lets one process have up to `max_workers`
+  KMS calls, key vault lookups and queries in flight at once. Clients come from a shared
+  ClientManager. After `use_dek_pool` new employees claim a pre-provisioned DEK instead of
+  waiting on the KMS.
+
+  Parameters
+  -----------
+    manager: ClientManager
+      The ClientManager to take the clients and ClientEncryption from
+    max_workers: int
+      Maximum number of blocking calls running at once
+  """
+
+  def __init__(self, manager, max_workers=32):
+    self.manager = manager
+    self.client = None
+    self.client_encryption = None
+    self.secure_client = None
+    self.dek_pool = None
+    self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="csfle")
+
+  async def _run(self, fn, *args, **kwargs):
+    return await get_running_loop().run_in_executor(self._executor, partial(fn, *args, **kwargs))
+
+  async def connect(self, schema_map=None):
+    """ Creates the plain client, the ClientEncryption and, with a schema map, the auto-encrypting client
+
+    Parameters
+    -----------
+      schema_map: dict
+        Schema map for automatic encryption, or None if only explicit encryption is used
+    Return
+    -----------
+      err: error
+        Error message or None of successful
+    """
+
+    self.client, err = await self._run(self.manager.get_client)
+    if err is not None:
+      return err
+    self.client_encryption, err = await self._run(self.manager.get_client_encryption)
+    if err is not None:
+      return err
+    if schema_map is not None:
+      self.secure_client, err = await self._run(self.manager.get_secure_client, schema_map)
+    return err
+
+  def use_dek_pool(self, provider_name, master_key, refill=False, **options):
+    """ Makes `get_employee_key` claim from the pool of unassigned DEKs, see `DekPool`
+
+    The pool is normally kept filled by dek_pool/main.py. Refilling it here as well is only worth
+    it in a process that keeps running, as a short run leaves the DEKs it created unclaimed.
+
+    Parameters
+    -----------
+      provider_name: string
+        The name of the key provider. "aws", "gcp", "azure", "kmip", or "local"
+      master_key: dict
+        The Customer Master Key (CMK) to wrap the new DEKs with
+      refill: bool
+        Also refill the pool from a background thread
+      options: dict
+        low_water, target, refill_rate and check_interval passed on to `DekPool`
+    """
+
+    keyvault_db, keyvault_coll = self.manager.keyvault_namespace.split(".", 1)
+    self.dek_pool = DekPool(self.client_encryption, self.client[keyvault_db][keyvault_coll], provider_name, master_key, **options)
+    if refill:
+      self.dek_pool.start()
+
+  async def lookup_dek_id(self, altName):
+    """ Returns the UUID of the DEK with a KeyAltName, or None, see `lookup_dek_id` """
+
+    found, key_id = DEK_CACHE.get(altName)
+    if found:
+      return key_id
+    return await self._run(lookup_dek_id, self.client_encryption, altName)
+
+  async def load_schema_map(self, **options):
+    """ Returns (schema map, error) for the employee schema source, see `load_schema_map` """
+
+    return await self._run(load_schema_map, self.client_encryption, **options)
+
+  async def get_employee_key(self, altName, provider_name, master_key):
+    """ Returns (UUID, error) for an employee's DEK, creating it if needed, see `get_employee_key` """
+
+    found, key_id = DEK_CACHE.get(str(altName))
+    if found and key_id is not None:
+      return key_id, None
+    return await self._run(get_employee_key, self.client_encryption, altName, provider_name, master_key, self.dek_pool)
+
+  async def encrypt(self, value, algorithm, key_id=None, key_alt_name=None):
+    """ Explicitly encrypts a value, raises EncryptionError on failure """
+
+    return await self._run(self.client_encryption.encrypt, value, algorithm, key_id, key_alt_name)
+
+  async def decrypt(self, value):
+    """ Explicitly decrypts a BSON binary subtype 6 value, raises EncryptionError on failure """
+
+    return await self._run(self.client_encryption.decrypt, value)
+
+  async def insert_one(self, db_name, coll_name, document):
+    """ Inserts a document through the auto-encrypting client and returns the InsertOneResult """
+
+    return await self._run(self.secure_client[db_name][coll_name].insert_one, document)
+
+  async def find_one(self, db_name, coll_name, query):
+    """ Finds a document through the auto-encrypting client, returned decrypted """
+
+    return await self._run(self.secure_client[db_name][coll_name].find_one, query)
+
+  async def find(self, db_name, coll_name, query, limit=0):
+    """ Finds documents through the auto-encrypting client and returns them decrypted as a list """
+
+    return await self._run(lambda: list(self.secure_client[db_name][coll_name].find(query, limit=limit)))
+
+  def close(self):
+    """ Stops the DEK pool and the worker threads, the clients are closed by the ClientManager """
+
+    if self.dek_pool is not None:
+      self.dek_pool.stop()
+    self._executor.shutdown(wait=True)
+
+async def onboard_employee(csfle, slots, provider, master_key, encrypted_db_name, encrypted_coll_name):
+  """ Creates an employee's DEK, inserts the employee and reads them back, without blocking the event loop
+
+  Parameters
+  -----------
+    csfle: AsyncCSFLE
+      Connected AsyncCSFLE instance with an auto-encrypting client
+    slots: asyncio.Semaphore
+      Limits how many employees are onboarded at once
+    provider: string
+      The name of the key provider
+    master_key: dict
+      The Customer Master Key (CMK) new DEKs are wrapped with
+    encrypted_db_name: string
+      Database of the employee collection
+    encrypted_coll_name: string
+      Name of the employee collection
+  Return
+  -----------
+    employee: dict
+      The decrypted employee document, or None
+    err: error
+      Error message or None of successful
+  """
+
+  async with slots:
+    employee_id = str("%05d" % randint(0,99999))
+    try:
+      _, err = await csfle.get_employee_key(employee_id, provider, master_key)
+    except PyMongoError as e:
+      return None, f"Key vault error: {e}"
+    if err is not None:
+      return None, err
+
+    firstname = names.get_first_name()
+    lastname = names.get_last_name()
+    payload = {
+      "_id": employee_id,
+      "name": {
+        "firstName": firstname,
+        "lastName": lastname,
+      },
+      "address": {
+        "streetAddress": "4 Bson Street",
+        "suburbCounty": "Mongoville",
+        "stateProvince": "Victoria",
+        "zipPostcode": "3999",
+        "country": "Oz"
+      },
+      "dob": datetime(1985, 5, 5),
+      "phoneNumber": "1800MONGO",
+      "salary": 999999.99,
+      "taxIdentifier": "78SD20NN001",
+      "role": [
+        "DEV"
+      ]
+    }
+
+    try:
+      await csfle.insert_one(encrypted_db_name, encrypted_coll_name, payload)
+      employee = await csfle.find_one(encrypted_db_name, encrypted_coll_name, {"name.firstName": firstname, "name.lastName": lastname})
+    except EncryptionError as e:
+      return None, f"Encryption error: {e}"
+    except PyMongoError as e:
+      # e.g. a DuplicateKeyError when the random employee ID is already taken, which must not
+      # abort the other onboardings running in the same gather()
+      return None, f"Insert error: {e}"
+    return employee, None
+
+async def main():
+
+  # Obviously this should not be hardcoded
+  connection_string = "mongodb://%s:%s@csfle-mongodb-%s.mdbtraining.net/?serverSelectionTimeoutMS=5000&tls=true&tlsCAFile=%s" % (
+    quote_plus(APP_USER),
+    quote_plus(MDB_PASSWORD),
+    PETNAME,
+    quote_plus(CA_PATH)
+  )
+
+  # Declare or key vault namespce
+  keyvault_db = "__encryption"
+  keyvault_coll = "__keyVault"
+  keyvault_namespace = f"{keyvault_db}.{keyvault_coll}"
+
+  # declare our key provider type
+  provider = "kmip"
+
+  # declare our key provider attributes
+  kms_provider = {
+    provider: {
+      "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"
+    }
+  }
+
+  # the CMK that wraps the employees' new DEKs
+  master_key = {"keyId": "1", "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"}
+
+  # declare our database and collection
+  encrypted_db_name = "companyData"
+  encrypted_coll_name = "employee"
+
+  csfle = AsyncCSFLE(get_client_manager(connection_string, kms_provider, keyvault_namespace, {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  }))
+
+  err = await csfle.connect()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  try:
+    data_key_id_1 = await csfle.lookup_dek_id("dataKey1")
+  except (EncryptionError, PyMongoError) as e:
+    print(f"Key vault error: {e}")
+    sys.exit(1)
+  if data_key_id_1 is None:
+    print("Common DEK missing")
+    sys.exit(1)
+
+  # the employee schema from Schema_Maps/employee.json
+  schema_map, err = await csfle.load_schema_map()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  err = await csfle.connect(schema_map)
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  # explicit encryption and decryption work the same way
+  encrypted_name = await csfle.encrypt("Kuber", Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, data_key_id_1)
+  print(await csfle.decrypt(encrypted_name))
+
+  # claim the employees' DEKs from the pool dek_pool/main.py keeps filled, creating them when it is empty
+  csfle.use_dek_pool(provider, master_key)
+
+  # onboard several employees concurrently, at most 8 at a time
+  slots = Semaphore(8)
+  results = await gather(*[onboard_employee(csfle, slots, provider, master_key, encrypted_db_name, encrypted_coll_name) for _ in range(20)])
+  for employee, err in results:
+    print(err if err is not None else employee)
+
+  csfle.close()
+
+if __name__ == "__main__":
+  run(main())
\ No newline at end of file
@@ -1,13 +1,18 @@
-from bson.binary import STANDARD, Binary, UUID_SUBTYPE
-from bson.codec_options import CodecOptions
+from bson.binary import Binary, UUID_SUBTYPE
 from datetime import datetime
-from pymongo import MongoClient
-from pymongo.encryption_options import AutoEncryptionOpts
-from pymongo.errors import EncryptionError, ServerSelectionTimeoutError, ConnectionFailure
+from pymongo import monitoring
+from pymongo.errors import EncryptionError
 from urllib.parse import quote_plus
 import names
+import os
 import sys
 
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import get_client_manager
+from csfle_common.metrics import METRICS, CommandMetricsListener, InstrumentedCollection, dump_metrics
+
 
 # IN VALUES HERE!
 PETNAME = 
@@ -15,30 +20,6 @@ MDB_PASSWORD =
 APP_USER = "app_user"
 CA_PATH = "/etc/pki/tls/certs/ca.cert"
 
-def mdb_client(connection_string, auto_encryption_opts=None):
-  """ Returns a MongoDB client instance
-  
-  Creates a  MongoDB client instance and tests the client via a `hello` to the server
-  
-  Parameters
-  ------------
-    connection_string: string
-      MongoDB connection string URI containing username, password, host, port, tls, etc
-  Return
-  ------------
-    client: mongo.MongoClient
-      MongoDB client instance
-    err: error
-      Error message or None of successful
-  """
-
-  try:
-    client = MongoClient(connection_string, auto_encryption_opts=auto_encryption_opts)
-    client.admin.command('hello')
-    return client, None
-  except (ServerSelectionTimeoutError, ConnectionFailure) as e:
-    return None, f"Cannot connect to database, please check settings in config file: {e}"
-
 def main():
 
   # Obviously this should not be hardcoded
@@ -68,8 +49,19 @@ def main():
   encrypted_db_name = "companyData"
   encrypted_coll_name = "employee"
 
+  # record every command, split into key vault and data traffic, for all clients created below
+  monitoring.register(CommandMetricsListener(METRICS, keyvault_db))
+
+  # all clients for this configuration are created once and shared
+  clients = get_client_manager(connection_string, kms_provider, keyvault_namespace, {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  })
+
   # instantiate our MongoDB Client object
-  client, err = mdb_client(connection_string)
+  client, err = clients.get_client()
   if err is not None:
     print(err)
     sys.exit(1)
@@ -165,22 +157,7 @@ def main():
     }
   }
 
-  auto_encryption = AutoEncryptionOpts(
-    kms_provider,
-    keyvault_namespace,
-    schema_map = {schema_map},
-    kms_tls_options = {
-      "kmip": {
-        "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
-        "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
-      }
-    },
-    crypt_shared_lib_required = True,
-    mongocryptd_bypass_spawn = True,
-    crypt_shared_lib_path = '/lib/mongo_crypt_v1.so'
-  )
-
-  secure_client, err = mdb_client(connection_string, auto_encryption_opts=auto_encryption)
+  secure_client, err = clients.get_secure_client(schema_map)
   if err is not None:
     print(err)
     sys.exit(1)
@@ -188,15 +165,18 @@ def main():
   if payload["name"]["otherNames"] is None:
     del(payload["name"]["otherNames"])
 
+  employees = InstrumentedCollection(secure_client[encrypted_db_name][encrypted_coll_name])
   try:
-    result = secure_client[encrypted_db_name][encrypted_coll_name].insert_one(payload)
+    result = employees.insert_one(payload)
     print(result.inserted_id)
 
-    decrypted_doc = secure_client[encrypted_db_name][encrypted_coll_name].find_one({"name.firstName": firstname})
+    decrypted_doc = employees.find_one({"name.firstName": firstname})
 
     print(decrypted_doc)
   except EncryptionError as e:
     print(f"Encryption error: {e}")
 
+  dump_metrics()
+
 if __name__ == "__main__":
   main()
\ No newline at end of file
@@ -0,0 +1,253 @@
+from argparse import ArgumentParser
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pymongo.encryption import Algorithm
+from statistics import mean
+from time import perf_counter_ns
+from uuid import uuid4
+import json
+import os
+import platform
+import pymongo
+import sys
+
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import ClientManager
+from csfle_common.decryption import traverse_bson, compile_decryption_plan, decrypt_document
+from csfle_common.encryption import compile_encryption_plan, encrypt_fields, encrypt_query
+from csfle_common.keys import DEK_CACHE, get_employee_key
+from csfle_common.schema import load_schema_map
+
+
+# Everything runs locally: a local mongod and the "local" KMS provider
+DEFAULT_CONNECTION_STRING = "mongodb://localhost:27017/?serverSelectionTimeoutMS=5000"
+DEFAULT_CRYPT_SHARED_PATH = "/lib/mongo_crypt_v1.so"
+BENCH_KEYVAULT_DB = "__benchEncryption"
+BENCH_KEYVAULT_COLL = "__keyVault"
+BENCH_DB = "benchData"
+BENCH_COLL = "employee"
+# scenarios that look up the employees seeded before the run
+READ_SCENARIOS = ["auto_find_one", "bypass_find_one"]
+
+def load_local_master_key(path):
+  """ Returns the 96 byte master key for the "local" KMS provider, creating it on first use
+
+  Parameters
+  -----------
+    path: string
+      File holding the master key
+  Return
+  -----------
+    key: bytes
+      The master key
+  """
+
+  if not os.path.exists(path):
+    with open(path, "wb") as f:
+      f.write(os.urandom(96))
+  with open(path, "rb") as f:
+    return f.read()
+
+def measure(fn, iterations, warmup=10):
+  """ Runs a function repeatedly and returns its throughput and latency percentiles
+
+  Parameters
+  -----------
+    fn: function
+      The operation to measure, called with the iteration number
+    iterations: int
+      Number of measured calls
+    warmup: int
+      Number of calls made before measuring
+  Return
+  -----------
+    result: dict
+      Operations per second, and mean, p50, p90, p99 and max latency in milliseconds
+  """
+
+  for i in range(warmup):
+    fn(-1 - i)
+  latencies = []
+  for i in range(iterations):
+    start = perf_counter_ns()
+    fn(i)
+    latencies.append(perf_counter_ns() - start)
+  latencies.sort()
+  ms = [latency / 1e6 for latency in latencies]
+
+  def percentile(p):
+    return ms[min(len(ms) - 1, int(round(p / 100 * (len(ms) - 1))))]
+
+  return {
+    "iterations": iterations,
+    "ops_per_sec": iterations / (sum(latencies) / 1e9),
+    "mean_ms": mean(ms),
+    "p50_ms": percentile(50),
+    "p90_ms": percentile(90),
+    "p99_ms": percentile(99),
+    "max_ms": ms[-1]
+  }
+
+def employee_payload(i):
+  """ Returns an unencrypted employee document like the workshop payloads """
+
+  return {
+    "_id": f"bench-{i}",
+    "name": {
+      "firstName": f"First{i}",
+      "lastName": f"Last{i}",
+    },
+    "address": {
+      "streetAddress": "1 Bson Street",
+      "suburbCounty": "Mongoville",
+      "stateProvince": "Victoria",
+      "zipPostcode": "3999",
+      "country": "Oz"
+    },
+    "dob": datetime(1980, 10, 10),
+    "phoneNumber": "1800MONGO",
+    "salary": 999999.99,
+    "taxIdentifier": "78SD20NN001",
+    "role": [
+      "DEV"
+    ]
+  }
+
+def compare(results, baseline_path):
+  """ Prints the change in throughput and p99 latency against a previous results file """
+
+  with open(baseline_path) as f:
+    baseline = json.load(f)["results"]
+  for name, result in results.items():
+    if name in baseline:
+      before = baseline[name]
+      print(f"{name:32} ops/s {before['ops_per_sec']:10.0f} -> {result['ops_per_sec']:10.0f}"
+            f"   p99 {before['p99_ms']:8.3f} -> {result['p99_ms']:8.3f} ms")
+
+def main():
+
+  parser = ArgumentParser(description="Benchmark the encryption, decryption and auto-encryption paths locally")
+  parser.add_argument("--connection-string", default=DEFAULT_CONNECTION_STRING, help="local mongod to run against")
+  parser.add_argument("--master-key-file", default=os.path.join(os.path.expanduser("~"), ".csfle_bench_master_key"), help="local KMS master key, created if missing")
+  parser.add_argument("--crypt-shared", default=DEFAULT_CRYPT_SHARED_PATH, help="crypt_shared library, auto-encryption is skipped if missing")
+  parser.add_argument("--iterations", type=int, default=1000, help="measured calls per scenario")
+  parser.add_argument("--only", nargs="*", help="only run these scenarios")
+  parser.add_argument("--out", default=f"benchmark-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json", help="results file")
+  parser.add_argument("--compare", help="previous results file to compare against")
+  args = parser.parse_args()
+
+  keyvault_namespace = f"{BENCH_KEYVAULT_DB}.{BENCH_KEYVAULT_COLL}"
+  provider = "local"
+  kms_provider = {
+    provider: {
+      "key": load_local_master_key(args.master_key_file)
+    }
+  }
+
+  manager = ClientManager(args.connection_string, kms_provider, keyvault_namespace, crypt_shared_lib_path=args.crypt_shared)
+  client, err = manager.get_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  # start from an empty key vault and collection every run
+  client.drop_database(BENCH_KEYVAULT_DB)
+  client.drop_database(BENCH_DB)
+  client[BENCH_KEYVAULT_DB][BENCH_KEYVAULT_COLL].create_index(
+    "keyAltNames",
+    unique=True,
+    partialFilterExpression={"keyAltNames": {"$exists": True}}
+  )
+
+  client_encryption, err = manager.get_client_encryption()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  data_key_id_1 = client_encryption.create_data_key(provider, key_alt_names=["dataKey1"])
+
+  # the employee schema from Schema_Maps/employee.json, with every field under dataKey1
+  schema_map, err = load_schema_map(client_encryption, namespace=f"{BENCH_DB}.{BENCH_COLL}", key_alt_name="dataKey1")
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  decryption_plan = compile_decryption_plan(schema_map, f"{BENCH_DB}.{BENCH_COLL}")
+
+  deterministic = Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic
+  random = Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Random
+  encrypted_doc = employee_payload(0)
+  for field in ["address", "dob", "phoneNumber", "salary", "taxIdentifier"]:
+    encrypted_doc[field] = client_encryption.encrypt(encrypted_doc[field], random, data_key_id_1)
+  for field in ["firstName", "lastName"]:
+    encrypted_doc["name"][field] = client_encryption.encrypt(encrypted_doc["name"][field], deterministic, data_key_id_1)
+
+  get_employee_key(client_encryption, "bench-hit", provider, None)
+
+  def get_key_from_vault(i):
+    DEK_CACHE.clear()
+    get_employee_key(client_encryption, "bench-hit", provider, None)
+
+  scenarios = OrderedDict([
+    ("encrypt_deterministic", lambda i: client_encryption.encrypt(f"First{i}", deterministic, data_key_id_1)),
+    ("encrypt_random", lambda i: client_encryption.encrypt(f"First{i}", random, data_key_id_1)),
+    ("traverse_bson_decrypt", lambda i: traverse_bson(client_encryption, encrypted_doc)),
+    ("decrypt_document_plan", lambda i: decrypt_document(client_encryption, encrypted_doc, decryption_plan)),
+    ("get_employee_key_cache_hit", lambda i: get_employee_key(client_encryption, "bench-hit", provider, None)),
+    ("get_employee_key_vault_lookup", get_key_from_vault),
+    ("get_employee_key_create", lambda i: get_employee_key(client_encryption, f"bench-new-{uuid4().hex}", provider, None)),
+  ])
+
+  if os.path.exists(args.crypt_shared):
+    secure_client, err = manager.get_secure_client(schema_map)
+    if err is not None:
+      print(err)
+      sys.exit(1)
+    secure_coll = secure_client[BENCH_DB][BENCH_COLL]
+    scenarios["auto_insert_one"] = lambda i: secure_coll.insert_one(employee_payload(i))
+    scenarios["auto_find_one"] = lambda i: secure_coll.find_one({"name.firstName": f"First{max(i, 0)}"})
+  else:
+    print(f"{args.crypt_shared} not found, skipping the auto-encryption scenarios")
+
+  # the same read without query analysis: the filter is encrypted up front and only the result is auto-decrypted
+  decrypting_client, err = manager.get_decrypting_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  decrypting_coll = decrypting_client[BENCH_DB][BENCH_COLL]
+  encryption_plan = compile_encryption_plan(schema_map, f"{BENCH_DB}.{BENCH_COLL}")
+  scenarios["bypass_find_one"] = lambda i: decrypting_coll.find_one(encrypt_query(client_encryption, {"name.firstName": f"First{max(i, 0)}"}, encryption_plan))
+
+  if not args.only or set(args.only) & set(READ_SCENARIOS):
+    # seed the employees the reads look up, so they measure hits whichever scenarios run
+    seed = [employee_payload(i) for i in range(args.iterations)]
+    for doc in seed:
+      doc["_id"] = f"seed-{doc['_id']}"
+    client[BENCH_DB][BENCH_COLL].insert_many(encrypt_fields(client_encryption, encryption_plan, seed))
+
+  results = OrderedDict()
+  for name, fn in scenarios.items():
+    if args.only and name not in args.only:
+      continue
+    results[name] = measure(fn, args.iterations)
+    r = results[name]
+    print(f"{name:32} {r['ops_per_sec']:10.0f} ops/s   p50 {r['p50_ms']:8.3f}   p99 {r['p99_ms']:8.3f}   max {r['max_ms']:8.3f} ms")
+
+  with open(args.out, "w") as f:
+    json.dump({
+      "meta": {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "iterations": args.iterations,
+        "python": platform.python_version(),
+        "pymongo": pymongo.version,
+        "host": platform.node()
+      },
+      "results": results
+    }, f, indent=2)
+  print(f"Results written to {args.out}")
+
+  if args.compare:
+    compare(results, args.compare)
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
@@ -0,0 +1,136 @@
+from argparse import ArgumentParser
+from datetime import datetime
+from pymongo.errors import EncryptionError
+from urllib.parse import quote_plus
+import os
+import sys
+
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.blind_index import BlindIndex, get_index_key
+from csfle_common.clients import get_client_manager
+from csfle_common.schema import load_schema_map
+
+
+# IN VALUES HERE!
+PETNAME = 
+MDB_PASSWORD = 
+APP_USER = "app_user"
+CA_PATH = "/etc/pki/tls/certs/ca.cert"
+
+def main():
+
+  parser = ArgumentParser(description="Insert an employee with blind index tokens, then run prefix and range searches")
+  parser.add_argument("--prefix", default="Ku", help="first name prefix to search for")
+  parser.add_argument("--salary-min", type=float, default=90000, help="lower salary bound")
+  parser.add_argument("--salary-max", type=float, default=150000, help="upper salary bound")
+  args = parser.parse_args()
+
+  # Obviously this should not be hardcoded
+  connection_string = "mongodb://%s:%s@csfle-mongodb-%s.mdbtraining.net/?serverSelectionTimeoutMS=5000&tls=true&tlsCAFile=%s" % (
+    quote_plus(APP_USER),
+    quote_plus(MDB_PASSWORD),
+    PETNAME,
+    quote_plus(CA_PATH)
+  )
+
+  # Declare or key vault namespce
+  keyvault_db = "__encryption"
+  keyvault_coll = "__keyVault"
+  keyvault_namespace = f"{keyvault_db}.{keyvault_coll}"
+
+  # declare our key provider type
+  provider = "kmip"
+
+  # declare our key provider attributes
+  kms_provider = {
+    provider: {
+      "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"
+    }
+  }
+  kms_tls_options = {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  }
+
+  # declare our database and collection
+  encrypted_db_name = "companyData"
+  encrypted_coll_name = "employee"
+
+  # all clients for this configuration are created once and shared
+  clients = get_client_manager(connection_string, kms_provider, keyvault_namespace, kms_tls_options)
+  client, err = clients.get_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  client_encryption, err = clients.get_client_encryption()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  # the employee schema from Schema_Maps/employee.json, with every field under dataKey1
+  schema_map, err = load_schema_map(client_encryption, key_alt_name="dataKey1")
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  secure_client, err = clients.get_secure_client(schema_map)
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  employees = secure_client[encrypted_db_name][encrypted_coll_name]
+
+  try:
+    blind_index = BlindIndex(get_index_key(client_encryption, client[keyvault_db]["__blindIndexKeys"], f"{encrypted_db_name}.{encrypted_coll_name}"))
+  except EncryptionError as e:
+    print(f"Encryption error: {e}")
+    sys.exit(1)
+  blind_index.create_indexes(client[encrypted_db_name][encrypted_coll_name])
+
+  payload = {
+    "name": {
+      "firstName": "Kuber",
+      "lastName": "Engineer"
+    },
+    "address": {
+      "streetAddress": "12 Bson Street",
+      "suburbCounty": "Mongoville",
+      "stateProvince": "Victoria",
+      "zipPostcode": "3999",
+      "country": "Oz"
+    },
+    "dob": datetime(1981, 11, 11),
+    "phoneNumber": "1800MONGO",
+    "salary": 120000.0,
+    "taxIdentifier": "78SDSSNN001",
+    "role": [
+      "DEV"
+    ]
+  }
+
+  try:
+    # tokens are computed from the plaintext, the driver then encrypts the fields themselves
+    result = employees.insert_one(blind_index.add_tokens(payload))
+    print(result.inserted_id)
+
+    # a raise keeps the salary tokens in step
+    changes = {"salary": 125000.0}
+    update = blind_index.update_tokens(changes)
+    update.setdefault("$set", {}).update(changes)
+    employees.update_one({"_id": result.inserted_id}, update)
+
+    for doc in blind_index.search(employees, "name.firstName", prefix=args.prefix):
+      print(doc)
+    for doc in blind_index.search(employees, "salary", low=args.salary_min, high=args.salary_max):
+      print(doc)
+    for doc in blind_index.search(employees, "dob", low=datetime(1980, 1, 1), high=datetime(1985, 12, 31)):
+      print(doc)
+  except EncryptionError as e:
+    print(f"Encryption error: {e}")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
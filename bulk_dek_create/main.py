@@ -0,0 +1,188 @@
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pymongo.errors import EncryptionError
+from time import perf_counter
+from urllib.parse import quote_plus
+import os
+import sys
+
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import get_client_manager
+
+
+# IN VALUES HERE!
+PETNAME = 
+MDB_PASSWORD = 
+APP_USER = "app_user"
+CA_PATH = "/etc/pki/tls/certs/ca.cert"
+
+def read_alt_names(path):
+  """ Yields the keyAltNames listed in a file, one per line
+
+  Parameters
+  -----------
+    path: string
+      Path of the file, blank lines are ignored
+  Return
+  -----------
+    altName: string
+      A keyAltName
+  """
+
+  with open(path) as f:
+    for line in f:
+      if line.strip():
+        yield line.strip()
+
+def create_key(client_encryption, altName, provider_name, master_key):
+  """ Creates a DEK for a KeyAltName
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      An instantiated ClientEncryption instance that has access to the key vault
+    altName: string
+      The KeyAltName of the new DEK
+    provider_name: string
+      The name of the key provider. "aws", "gcp", "azure", "kmip", or "local"
+    master_key: dict
+      The Customer Master Key (CMK) to wrap the DEK with
+  Return
+  -----------
+    employee_key_id: UUID
+      The UUID of the DEK, or None if it could not be created
+    error: error
+      Error message or None of successful
+  """
+
+  try:
+    return client_encryption.create_data_key(kms_provider=provider_name, master_key=master_key, key_alt_names=[altName]), None
+  except EncryptionError as e:
+    return None, f"ClientEncryption error for {altName}: {e}"
+
+def bulk_create_keys(client_encryption, key_vault, alt_names, provider_name, master_key, batch_size=1000, concurrency=16, report=print):
+  """ Creates a DEK for every KeyAltName that does not have one yet
+
+  KeyAltNames are processed in batches: one `$in` query per batch finds the names that already
+  have a DEK, and the missing DEKs are created on `concurrency` threads so that many KMS
+  requests are in flight at once.
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      An instantiated ClientEncryption instance that has access to the key vault
+    key_vault: mongo.Collection
+      The key vault collection
+    alt_names: iterable
+      KeyAltNames to create DEKs for, e.g. employee IDs
+    provider_name: string
+      The name of the key provider. "aws", "gcp", "azure", "kmip", or "local"
+    master_key: dict
+      The Customer Master Key (CMK) to wrap the DEKs with
+    batch_size: int
+      Number of KeyAltNames checked and created per batch
+    concurrency: int
+      Maximum number of DEKs being created at once
+    report: function
+      Called with a progress message after every batch and for every failure
+  Return
+  -----------
+    summary: dict
+      Number of DEKs created, skipped and failed, and DEKs created per second
+  """
+
+  summary = {"created": 0, "skipped": 0, "failed": 0}
+  alt_names = iter(alt_names)
+  start = perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    while True:
+      batch = list(dict.fromkeys(islice(alt_names, batch_size)))
+      if not batch:
+        break
+      existing = set()
+      for key in key_vault.find({"keyAltNames": {"$in": batch}}, {"keyAltNames": 1}):
+        existing.update(key["keyAltNames"])
+      missing = [name for name in batch if name not in existing]
+      summary["skipped"] += len(batch) - len(missing)
+
+      for _, err in executor.map(lambda name: create_key(client_encryption, name, provider_name, master_key), missing):
+        if err is None:
+          summary["created"] += 1
+        else:
+          summary["failed"] += 1
+          report(err)
+
+      elapsed = perf_counter() - start
+      report(f"{summary['created']} created, {summary['skipped']} skipped, {summary['failed']} failed, "
+             f"{summary['created'] / elapsed:.1f} keys/s")
+
+  elapsed = perf_counter() - start
+  summary["keys_per_sec"] = summary["created"] / elapsed if elapsed > 0 else 0.0
+  return summary
+
+def main():
+
+  parser = ArgumentParser(description="Create a DEK for each of many keyAltNames, e.g. employee IDs")
+  source = parser.add_mutually_exclusive_group(required=True)
+  source.add_argument("--names-file", help="file with one keyAltName per line")
+  source.add_argument("--employee-range", nargs=2, type=int, metavar=("FIRST", "LAST"), help="create keys for employee IDs FIRST to LAST inclusive, formatted as in the use_case scripts")
+  parser.add_argument("--batch-size", type=int, default=1000, help="keyAltNames checked and created per batch")
+  parser.add_argument("--concurrency", type=int, default=16, help="maximum concurrent KMS requests")
+  args = parser.parse_args()
+
+  # Obviously this should not be hardcoded
+  connection_string = "mongodb://%s:%s@csfle-mongodb-%s.mdbtraining.net/?serverSelectionTimeoutMS=5000&tls=true&tlsCAFile=%s" % (
+    quote_plus(APP_USER),
+    quote_plus(MDB_PASSWORD),
+    PETNAME,
+    quote_plus(CA_PATH)
+  )
+
+  # Declare or key vault namespce
+  keyvault_db = "__encryption"
+  keyvault_coll = "__keyVault"
+  keyvault_namespace = f"{keyvault_db}.{keyvault_coll}"
+
+  # declare our key provider type
+  provider = "kmip"
+
+  # declare our key provider attributes
+  kms_provider = {
+    provider: {
+      "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"
+    }
+  }
+
+  # all clients for this configuration are created once and shared, with enough connections for every worker
+  clients = get_client_manager(f"{connection_string}&maxPoolSize={max(100, args.concurrency * 2)}", kms_provider, keyvault_namespace, {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  })
+  client, err = clients.get_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  client_encryption, err = clients.get_client_encryption()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  if args.names_file:
+    alt_names = read_alt_names(args.names_file)
+  else:
+    alt_names = ("%05d" % i for i in range(args.employee_range[0], args.employee_range[1] + 1))
+
+  master_key = {"keyId": "1", "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"}
+  summary = bulk_create_keys(client_encryption, client[keyvault_db][keyvault_coll], alt_names, provider, master_key, args.batch_size, args.concurrency)
+  print(f"Created {summary['created']} DEKs ({summary['skipped']} already existed, {summary['failed']} failed) "
+        f"at {summary['keys_per_sec']:.1f} keys/s")
+  if summary["failed"]:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
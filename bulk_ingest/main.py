@@ -0,0 +1,292 @@
+from argparse import ArgumentParser
+from bson import json_util
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+from pymongo.errors import BulkWriteError, EncryptionError, PyMongoError
+from random import randint
+from threading import BoundedSemaphore, Lock
+from time import perf_counter
+from urllib.parse import quote_plus
+import names
+import os
+import sys
+
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import get_client_manager
+from csfle_common.encryption import compile_encryption_plan, encrypt_fields
+from csfle_common.schema import load_schema_map
+
+
+# IN VALUES HERE!
+PETNAME = 
+MDB_PASSWORD = 
+APP_USER = "app_user"
+CA_PATH = "/etc/pki/tls/certs/ca.cert"
+
+def generate_employees(count):
+  """ Yields randomly generated employee records with the same shape as the workshop payloads
+
+  Parameters
+  -----------
+    count: int
+      Number of employee records to generate
+  Return
+  -----------
+    employee: dict
+      An unencrypted employee document
+  """
+
+  for _ in range(count):
+    yield {
+      "name": {
+        "firstName": names.get_first_name(),
+        "lastName": names.get_last_name(),
+        "otherNames": None,
+      },
+      "address": {
+        "streetAddress": f"{randint(1, 999)} Bson Street",
+        "suburbCounty": "Mongoville",
+        "stateProvince": "Victoria",
+        "zipPostcode": "3999",
+        "country": "Oz"
+      },
+      "dob": datetime(randint(1950, 2004), randint(1, 12), randint(1, 28)),
+      "phoneNumber": "1800MONGO",
+      "salary": float(randint(50000, 250000)),
+      "taxIdentifier": "78SD%05dNN001" % randint(0, 99999),
+      "role": [
+        "DEV"
+      ]
+    }
+
+def read_employees(path):
+  """ Yields employee records from a newline delimited (Extended) JSON file
+
+  Parameters
+  -----------
+    path: string
+      Path of the NDJSON file, one employee document per line
+  Return
+  -----------
+    employee: dict
+      An unencrypted employee document
+  """
+
+  with open(path) as f:
+    for line in f:
+      if line.strip():
+        yield json_util.loads(line)
+
+def remove_empty_other_names(records):
+  """ Yields the records with `name.otherNames` removed where it is None, because we cannot encrypt None
+
+  Parameters
+  -----------
+    records: iterable
+      Unencrypted employee documents
+  Return
+  -----------
+    employee: dict
+      The employee document, without a None `name.otherNames`
+  """
+
+  for record in records:
+    if record.get("name", {}).get("otherNames", "") is None:
+      del(record["name"]["otherNames"])
+    yield record
+
+def insert_batch(collection, batch, client_encryption=None, plan=None):
+  """ Encrypts a batch of employees if required and writes it with an unordered `insert_many`
+
+  When `client_encryption` is None the collection is expected to belong to an auto-encrypting
+  client, which encrypts the batch itself.
+
+  Parameters
+  -----------
+    collection: mongo.Collection
+      Collection to write to
+    batch: list
+      Employee documents to insert
+    client_encryption: mongo.ClientEncryption
+      Instantiated mongo.ClientEncryption instance for manual encryption, or None
+    plan: list
+      Encryption plan from `compile_encryption_plan`, required with `client_encryption`
+  Return
+  -----------
+    inserted: int
+      Number of documents inserted
+    err: error
+      Error message or None if successful
+  """
+
+  try:
+    if client_encryption is not None:
+      encrypt_fields(client_encryption, plan, batch)
+    result = collection.insert_many(batch, ordered=False)
+    return len(result.inserted_ids), None
+  except BulkWriteError as e:
+    write_errors = e.details.get("writeErrors", [])
+    first_error = write_errors[0]["errmsg"] if write_errors else e
+    return e.details.get("nInserted", 0), f"{len(write_errors)} write errors, first: {first_error}"
+  except EncryptionError as e:
+    return 0, f"Encryption error: {e}"
+  except PyMongoError as e:
+    return 0, f"Insert error: {e}"
+
+def bulk_ingest(collection, records, batch_size=1000, max_in_flight=4, client_encryption=None, plan=None, report=print):
+  """ Streams employee records into the collection as unordered `insert_many` batches
+
+  Batches are encrypted and written on a pool of `max_in_flight` threads. The producer blocks
+  once `max_in_flight` batches are outstanding, so memory stays bounded however large the
+  input stream is.
+
+  Parameters
+  -----------
+    collection: mongo.Collection
+      Collection to write to
+    records: iterable
+      Unencrypted employee documents
+    batch_size: int
+      Number of documents per `insert_many`
+    max_in_flight: int
+      Maximum number of batches being encrypted or written at once
+    client_encryption: mongo.ClientEncryption
+      Instantiated mongo.ClientEncryption instance for manual encryption, or None for an
+      auto-encrypting collection
+    plan: list
+      Encryption plan from `compile_encryption_plan`, required with `client_encryption`
+    report: function
+      Called with a message for every failed batch
+  Return
+  -----------
+    summary: dict
+      Number of documents inserted, batches written, batches failed and documents per second
+  """
+
+  summary = {"inserted": 0, "batches": 0, "failed_batches": 0}
+  lock = Lock()
+  slots = BoundedSemaphore(max_in_flight)
+  start = perf_counter()
+
+  def run(batch_no, batch):
+    try:
+      try:
+        inserted, err = insert_batch(collection, batch, client_encryption, plan)
+      except Exception as e:
+        # nothing waits on the future, so anything insert_batch does not handle itself, such as
+        # an InvalidDocument or a document without its "_id" key pointer, is counted here
+        inserted, err = 0, f"Unexpected error: {e!r}"
+      with lock:
+        summary["inserted"] += inserted
+        summary["batches"] += 1
+        if err is not None:
+          summary["failed_batches"] += 1
+          report(f"Batch {batch_no} ({len(batch)} documents, {inserted} inserted): {err}")
+    finally:
+      slots.release()
+
+  records = iter(records)
+  with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+    batch_no = 0
+    while True:
+      batch = list(islice(records, batch_size))
+      if not batch:
+        break
+      slots.acquire()
+      executor.submit(run, batch_no, batch)
+      batch_no += 1
+
+  elapsed = perf_counter() - start
+  summary["docs_per_sec"] = summary["inserted"] / elapsed if elapsed > 0 else 0.0
+  return summary
+
+def main():
+
+  parser = ArgumentParser(description="Bulk load employees into the encrypted employee collection")
+  parser.add_argument("--mode", choices=["manual", "auto"], default="manual", help="encrypt with ClientEncryption or with the auto-encrypting client")
+  parser.add_argument("--input", help="NDJSON file of employees, random employees are generated if not set")
+  parser.add_argument("--count", type=int, default=10000, help="number of employees to generate")
+  parser.add_argument("--batch-size", type=int, default=1000, help="documents per insert_many")
+  parser.add_argument("--max-in-flight", type=int, default=4, help="maximum concurrent batches")
+  args = parser.parse_args()
+
+  # Obviously this should not be hardcoded
+  connection_string = "mongodb://%s:%s@csfle-mongodb-%s.mdbtraining.net/?serverSelectionTimeoutMS=5000&tls=true&tlsCAFile=%s" % (
+    quote_plus(APP_USER),
+    quote_plus(MDB_PASSWORD),
+    PETNAME,
+    quote_plus(CA_PATH)
+  )
+
+  # Declare or key vault namespce
+  keyvault_db = "__encryption"
+  keyvault_coll = "__keyVault"
+  keyvault_namespace = f"{keyvault_db}.{keyvault_coll}"
+
+  # declare our key provider type
+  provider = "kmip"
+
+  # declare our key provider attributes
+  kms_provider = {
+    provider: {
+      "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"
+    }
+  }
+  kms_tls_options = {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  }
+
+  # declare our database and collection
+  encrypted_db_name = "companyData"
+  encrypted_coll_name = "employee"
+
+  # all clients for this configuration are created once and shared
+  clients = get_client_manager(connection_string, kms_provider, keyvault_namespace, kms_tls_options)
+
+  # instantiate our MongoDB Client object
+  client, err = clients.get_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  client_encryption, err = clients.get_client_encryption()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  # the employee schema from Schema_Maps/employee.json, with every field under dataKey1
+  schema_map, err = load_schema_map(client_encryption, key_alt_name="dataKey1")
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  if args.mode == "manual":
+    plan = compile_encryption_plan(schema_map, f"{encrypted_db_name}.{encrypted_coll_name}")
+    collection = client[encrypted_db_name][encrypted_coll_name]
+  else:
+    secure_client, err = clients.get_secure_client(schema_map)
+    if err is not None:
+      print(err)
+      sys.exit(1)
+    client_encryption = None
+    plan = None
+    collection = secure_client[encrypted_db_name][encrypted_coll_name]
+
+  records = read_employees(args.input) if args.input else generate_employees(args.count)
+  if args.mode == "auto":
+    records = remove_empty_other_names(records)
+
+  summary = bulk_ingest(collection, records, args.batch_size, args.max_in_flight, client_encryption, plan)
+  print(f"Inserted {summary['inserted']} employees in {summary['batches']} batches "
+        f"({summary['failed_batches']} failed), {summary['docs_per_sec']:.0f} docs/s")
+  if summary["failed_batches"]:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
@@ -0,0 +1,193 @@
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from time import perf_counter
+from urllib.parse import quote_plus
+import os
+import sys
+
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import get_client_manager
+from csfle_common.shred import shred_employees, confirm_shredded
+
+
+# IN VALUES HERE!
+PETNAME = 
+MDB_PASSWORD = 
+APP_USER = "app_user"
+CA_PATH = "/etc/pki/tls/certs/ca.cert"
+
+def read_employee_ids(path):
+  """ Yields the employee IDs listed in a file, one per line
+
+  Parameters
+  -----------
+    path: string
+      Path of the file, blank lines are ignored
+  Return
+  -----------
+    employee_id: string
+      An employee ID
+  """
+
+  with open(path) as f:
+    for line in f:
+      if line.strip():
+        yield line.strip()
+
+def bulk_shred(key_vault, collection, employee_ids, documents="keep", batch_size=1000, concurrency=4, caches=(), report=print):
+  """ Crypto-shreds many employees, several batches at a time
+
+  Parameters
+  -----------
+    key_vault: mongo.Collection
+      The key vault collection
+    collection: mongo.Collection
+      The employee collection, not auto-encrypting
+    employee_ids: iterable
+      The employee IDs to shred
+    documents: string
+      "keep", "delete" or "tombstone" the employee documents
+    batch_size: int
+      Number of employees per `$in` lookup and `delete_many`
+    concurrency: int
+      Maximum number of batches in flight at once
+    caches: list
+      Local DEK caches to drop the employees from
+    report: function
+      Called with a progress message after every batch and for every failure
+  Return
+  -----------
+    summary: dict
+      Totals of `shred_employees`, the number of failed batches and employees shredded per second
+    shredded: list
+      The employee IDs of the batches that succeeded
+  """
+
+  summary = {"keys_deleted": 0, "keys_missing": 0, "documents": 0, "failed_batches": 0}
+  shredded = []
+  employee_ids = iter(employee_ids)
+  batches = iter(lambda: list(dict.fromkeys(islice(employee_ids, batch_size))), [])
+  start = perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    # keep at most `concurrency` batches queued so a huge input is not read into memory at once
+    pending = []
+    for batch in batches:
+      pending.append((batch, executor.submit(shred_employees, key_vault, collection, batch, documents, caches)))
+      if len(pending) < concurrency:
+        continue
+      batch, future = pending.pop(0)
+      _collect(batch, future.result(), summary, shredded, start, report)
+    for batch, future in pending:
+      _collect(batch, future.result(), summary, shredded, start, report)
+
+  elapsed = perf_counter() - start
+  summary["employees_per_sec"] = len(shredded) / elapsed if elapsed > 0 else 0.0
+  return summary, shredded
+
+def _collect(batch, result, summary, shredded, start, report):
+  batch_summary, err = result
+  for k, v in batch_summary.items():
+    summary[k] += v
+  if err is not None:
+    summary["failed_batches"] += 1
+    report(err)
+  else:
+    shredded.extend(batch)
+  report(f"{len(shredded)} employees shredded, {summary['keys_deleted']} DEKs deleted, "
+         f"{summary['documents']} documents, {len(shredded) / (perf_counter() - start):.1f} employees/s")
+
+def main():
+
+  parser = ArgumentParser(description="Crypto-shred many employees by deleting their DEKs")
+  source = parser.add_mutually_exclusive_group(required=True)
+  source.add_argument("--ids-file", help="file with one employee ID per line")
+  source.add_argument("--employee-range", nargs=2, type=int, metavar=("FIRST", "LAST"), help="shred employee IDs FIRST to LAST inclusive, formatted as in the use_case scripts")
+  parser.add_argument("--documents", choices=["keep", "delete", "tombstone"], default="keep", help="what to do with the employee documents")
+  parser.add_argument("--batch-size", type=int, default=1000, help="employees per batch")
+  parser.add_argument("--concurrency", type=int, default=4, help="batches in flight at once")
+  parser.add_argument("--no-confirm", action="store_true", help="skip confirming that the data can no longer be decrypted")
+  args = parser.parse_args()
+
+  # Obviously this should not be hardcoded
+  connection_string = "mongodb://%s:%s@csfle-mongodb-%s.mdbtraining.net/?serverSelectionTimeoutMS=5000&tls=true&tlsCAFile=%s" % (
+    quote_plus(APP_USER),
+    quote_plus(MDB_PASSWORD),
+    PETNAME,
+    quote_plus(CA_PATH)
+  )
+
+  # Declare or key vault namespce
+  keyvault_db = "__encryption"
+  keyvault_coll = "__keyVault"
+  keyvault_namespace = f"{keyvault_db}.{keyvault_coll}"
+
+  # declare our key provider type
+  provider = "kmip"
+
+  # declare our key provider attributes
+  kms_provider = {
+    provider: {
+      "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"
+    }
+  }
+
+  # declare our database and collection
+  encrypted_db_name = "companyData"
+  encrypted_coll_name = "employee"
+
+  # all clients for this configuration are created once and shared, with enough connections for every worker
+  clients = get_client_manager(f"{connection_string}&maxPoolSize={max(100, args.concurrency * 4)}", kms_provider, keyvault_namespace, {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  })
+  client, err = clients.get_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  key_vault = client[keyvault_db][keyvault_coll]
+  collection = client[encrypted_db_name][encrypted_coll_name]
+
+  if args.ids_file:
+    employee_ids = read_employee_ids(args.ids_file)
+  else:
+    employee_ids = ("%05d" % i for i in range(args.employee_range[0], args.employee_range[1] + 1))
+
+  summary, shredded = bulk_shred(key_vault, collection, employee_ids, args.documents, args.batch_size, args.concurrency)
+  print(f"Shredded {len(shredded)} employees: {summary['keys_deleted']} DEKs deleted, {summary['keys_missing']} had no DEK, "
+        f"{summary['documents']} documents {args.documents if args.documents != 'keep' else 'kept'}, "
+        f"{summary['failed_batches']} batches failed, {summary['employees_per_sec']:.1f} employees/s")
+
+  if not args.no_confirm:
+    # The manager first creates its ClientEncryption here, after the DEKs are gone, so it has
+    # never decrypted them and no DEK cache can make the shredded documents look readable
+    client_encryption, err = clients.get_client_encryption()
+    if err is not None:
+      print(err)
+      sys.exit(1)
+    remaining = []
+    unconfirmed = 0
+    for i in range(0, len(shredded), args.batch_size):
+      still_readable, err = confirm_shredded(key_vault, shredded[i:i + args.batch_size], client_encryption, collection)
+      remaining.extend(still_readable)
+      if err is not None:
+        unconfirmed += 1
+        print(err)
+    if remaining:
+      print(f"{len(remaining)} employees can still be decrypted, e.g. {remaining[:10]}")
+      sys.exit(1)
+    if unconfirmed:
+      print(f"Shredding could not be confirmed for {unconfirmed} batches")
+      sys.exit(1)
+    print("Shredding confirmed, none of the employees can be decrypted")
+
+  if summary["failed_batches"]:
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
@@ -0,0 +1 @@
+# Helpers shared by the workshop scripts, each script adds the repository root to sys.path to import them
\ No newline at end of file
@@ -0,0 +1,226 @@
+from bson.binary import Binary
+from hashlib import sha256
+from pymongo.encryption import Algorithm
+from pymongo.errors import DuplicateKeyError
+import hmac
+import os
+
+# Document field holding the blind index tokens
+TOKEN_FIELD = "_bidx"
+
+# The plaintext fields that get tokens. "prefix" fields get one token for each prefix from 1 to
+# `max_length` characters, case-insensitively. "range" fields get one token for the bucket their
+# value falls in: a calendar month for dates, or `width` wide for numbers.
+#
+# Tokens are opt-in because they leak: anyone who can read them sees which documents share a
+# prefix or a bucket, though not the values. Keep `max_length` short and buckets wide.
+BLIND_INDEX_FIELDS = {
+  "name.firstName": {"type": "prefix", "max_length": 4},
+  "name.lastName": {"type": "prefix", "max_length": 4},
+  "dob": {"type": "range", "bucket": "month"},
+  "salary": {"type": "range", "width": 10000}
+}
+
+def get_index_key(client_encryption, key_store, name, key_alt_name="dataKey1"):
+  """ Returns the HMAC key for a blind index, creating it on first use
+
+  The key is stored encrypted with a DEK, so it is protected by the CMK like the data is.
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      Instantiated mongo.ClientEncryption instance
+    key_store: mongo.Collection
+      Collection holding the encrypted HMAC keys, e.g. next to the key vault
+    name: string
+      Name of the blind index, e.g. "companyData.employee"
+    key_alt_name: string
+      KeyAltName of the DEK that encrypts the HMAC key
+  Return
+  -----------
+    key: bytes
+      The 32 byte HMAC key
+  """
+
+  stored = key_store.find_one({"_id": name})
+  if stored is None:
+    encrypted_key = client_encryption.encrypt(Binary(os.urandom(32)), Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Random, key_alt_name=key_alt_name)
+    try:
+      key_store.insert_one({"_id": name, "key": encrypted_key})
+    except DuplicateKeyError:
+      # another process created it first, use theirs
+      pass
+    stored = key_store.find_one({"_id": name})
+  return bytes(client_encryption.decrypt(stored["key"]))
+
+class BlindIndex:
+  """ Keyed-HMAC tokens that make prefix and range predicates on encrypted fields indexable
+
+  The tokens for a document are kept in its `TOKEN_FIELD` sub-document, one field per indexed
+  path with the dots replaced by underscores, e.g. `_bidx.name_firstName`. A prefix or range
+  predicate becomes an indexed `$in` on those tokens. Tokens only narrow the search, so the
+  decrypted candidates are then filtered exactly with `matches`.
+
+  Parameters
+  -----------
+    key: bytes
+      The HMAC key from `get_index_key`
+    fields: dict
+      The indexed fields, see `BLIND_INDEX_FIELDS`
+  """
+
+  def __init__(self, key, fields=BLIND_INDEX_FIELDS):
+    self.key = key
+    self.fields = fields
+
+  @staticmethod
+  def token_path(path):
+    return f"{TOKEN_FIELD}.{path.replace('.', '_')}"
+
+  def token(self, path, value):
+    """ Returns the token for one prefix or bucket of a field """
+
+    return Binary(hmac.new(self.key, f"{path}\x00{value}".encode(), sha256).digest()[:16])
+
+  def buckets(self, path, low, high):
+    """ Returns the buckets a field's values from `low` to `high` inclusive fall in """
+
+    config = self.fields[path]
+    if config.get("bucket") == "month":
+      months = range(low.year * 12 + low.month - 1, high.year * 12 + high.month)
+      return [f"{m // 12:04d}-{m % 12 + 1:02d}" for m in months]
+    return list(range(int(low // config["width"]), int(high // config["width"]) + 1))
+
+  def tokens(self, document):
+    """ Returns the tokens for a plaintext document, keyed by their field under `TOKEN_FIELD`
+
+    Parameters
+    -----------
+      document: dict
+        The plaintext document, before it is encrypted
+    Return
+    -----------
+      tokens: dict
+        Token field name to a token, or to a list of tokens for prefix fields
+    """
+
+    tokens = {}
+    for path, config in self.fields.items():
+      value = document
+      for part in path.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+      if value is None:
+        continue
+      field = path.replace(".", "_")
+      if config["type"] == "prefix":
+        value = value.lower()
+        tokens[field] = [self.token(path, value[:n]) for n in range(1, min(len(value), config["max_length"]) + 1)]
+      else:
+        tokens[field] = self.token(path, self.buckets(path, value, value)[0])
+    return tokens
+
+  def add_tokens(self, document):
+    """ Adds the tokens to a plaintext document about to be inserted, and returns it """
+
+    document[TOKEN_FIELD] = self.tokens(document)
+    return document
+
+  def update_tokens(self, changes):
+    """ Returns the `$set` and `$unset` that keep the tokens in step with an update
+
+    A change to an indexed field, or to a document containing one, e.g. {"name": {...}} for
+    `name.firstName`, refreshes the field's tokens.
+
+    Parameters
+    -----------
+      changes: dict
+        The plaintext `$set` of the update, with dotted paths, e.g. {"salary": 120000.0}
+    Return
+    -----------
+      update: dict
+        Operators to merge into the update document
+    """
+
+    document = {}
+    for path, value in changes.items():
+      parent = document
+      parts = path.split(".")
+      for part in parts[:-1]:
+        parent = parent.setdefault(part, {})
+      parent[parts[-1]] = value
+
+    tokens = self.tokens(document)
+    update = {"$set": {}, "$unset": {}}
+    for path in self.fields:
+      if any(path == changed or path.startswith(f"{changed}.") for changed in changes):
+        field = path.replace(".", "_")
+        if field in tokens:
+          update["$set"][f"{TOKEN_FIELD}.{field}"] = tokens[field]
+        else:
+          update["$unset"][f"{TOKEN_FIELD}.{field}"] = ""
+    return {op: fields for op, fields in update.items() if fields}
+
+  def prefix_filter(self, path, prefix):
+    """ Returns the filter for documents whose field may start with `prefix` """
+
+    prefix = prefix.lower()[:self.fields[path]["max_length"]]
+    if not prefix:
+      raise ValueError(f"An empty prefix on {path} matches every document")
+    return {self.token_path(path): self.token(path, prefix)}
+
+  def range_filter(self, path, low, high):
+    """ Returns the filter for documents whose field may be between `low` and `high` inclusive """
+
+    if low is None or high is None:
+      raise ValueError(f"A range search on {path} needs both bounds, bucket tokens cannot express an open range")
+    return {self.token_path(path): {"$in": [self.token(path, bucket) for bucket in self.buckets(path, low, high)]}}
+
+  @staticmethod
+  def matches(document, path, prefix=None, low=None, high=None):
+    """ Checks a decrypted document against the exact predicate """
+
+    value = document
+    for part in path.split("."):
+      value = value.get(part) if isinstance(value, dict) else None
+    if value is None:
+      return False
+    if prefix is not None:
+      return value.lower().startswith(prefix.lower())
+    return (low is None or value >= low) and (high is None or value <= high)
+
+  def search(self, collection, path, prefix=None, low=None, high=None, decrypt=None):
+    """ Yields the decrypted documents matching a prefix or a range predicate
+
+    Parameters
+    -----------
+      collection: mongo.Collection
+        An auto-encrypting collection, or a plain one together with `decrypt`
+      path: string
+        The indexed field
+      prefix: string
+        The prefix to search for, for prefix fields
+      low, high: value
+        The inclusive bounds to search between, both required for range fields
+      decrypt: function
+        Decrypts a document read from a plain collection, or None
+    Return
+    -----------
+      document: dict
+        A decrypted document that matches the predicate exactly
+    """
+
+    if self.fields[path]["type"] == "prefix":
+      query = self.prefix_filter(path, prefix)
+    else:
+      query = self.range_filter(path, low, high)
+    for document in collection.find(query):
+      if decrypt is not None:
+        document = decrypt(document)
+      if self.matches(document, path, prefix, low, high):
+        yield document
+
+  def create_indexes(self, collection):
+    """ Creates one index per token field """
+
+    for path in self.fields:
+      collection.create_index(self.token_path(path))
\ No newline at end of file
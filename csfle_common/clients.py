@@ -0,0 +1,239 @@
+from bson import json_util
+from bson.binary import STANDARD
+from bson.codec_options import CodecOptions
+from os import getpid
+from pymongo import MongoClient
+from pymongo.encryption import ClientEncryption
+from pymongo.encryption_options import AutoEncryptionOpts
+from pymongo.errors import ServerSelectionTimeoutError, ConnectionFailure
+from threading import Lock, RLock
+import atexit
+
+def mdb_client(connection_string, auto_encryption_opts=None, **kwargs):
+  """ Returns a MongoDB client instance
+  
+  Creates a  MongoDB client instance and tests the client via a `hello` to the server
+  
+  Parameters
+  ------------
+    connection_string: string
+      MongoDB connection string URI containing username, password, host, port, tls, etc
+    auto_encryption_opts: AutoEncryptionOpts
+      Options for automatic encryption, or None for a plain client
+    kwargs: keyword arguments
+      Extra MongoClient options, e.g. `minPoolSize`
+  Return
+  ------------
+    client: mongo.MongoClient
+      MongoDB client instance
+    err: error
+      Error message or None of successful
+  """
+
+  try:
+    client = MongoClient(connection_string, auto_encryption_opts=auto_encryption_opts, **kwargs)
+    client.admin.command('hello')
+    return client, None
+  except (ServerSelectionTimeoutError, ConnectionFailure) as e:
+    return None, f"Cannot connect to database, please check settings in config file: {e}"
+
+class ClientManager:
+  """ Creates and reuses the MongoDB clients and ClientEncryption for one configuration
+
+  Holds one plain client, which is also used as the key vault client, one ClientEncryption
+  and one auto-encrypting client per schema map and options. Every client is created on first
+  use, so the TLS handshake, server selection and `hello` are paid once per process rather
+  than once per operation. The encrypted clients use the plain client for key vault access
+  instead of opening their own internal key vault client, so all key vault traffic shares one
+  connection pool. Use `get_client_manager` to share managers across a process.
+
+  Parameters
+  -----------
+    connection_string: string
+      MongoDB connection string URI containing username, password, host, port, tls, etc
+    kms_provider: dict
+      The KMS provider configuration
+    keyvault_namespace: string
+      The "db.collection" namespace of the key vault
+    kms_tls_options: dict
+      TLS options for the KMS provider, or None
+    crypt_shared_lib_path: string
+      Path to the crypt_shared library used by the auto-encrypting clients
+  """
+
+  def __init__(self, connection_string, kms_provider, keyvault_namespace, kms_tls_options=None, crypt_shared_lib_path='/lib/mongo_crypt_v1.so'):
+    self.connection_string = connection_string
+    self.kms_provider = kms_provider
+    self.keyvault_namespace = keyvault_namespace
+    self.kms_tls_options = kms_tls_options
+    self.crypt_shared_lib_path = crypt_shared_lib_path
+    self._client = None
+    self._client_encryption = None
+    self._secure_clients = {}
+    self._lock = RLock()
+
+  def get_client(self):
+    """ Returns the shared plain client, also used as the key vault client
+
+    Return
+    -----------
+      client: mongo.MongoClient
+        MongoDB client instance
+      err: error
+        Error message or None of successful
+    """
+
+    with self._lock:
+      if self._client is None:
+        client, err = mdb_client(self.connection_string)
+        if err is not None:
+          return None, err
+        self._client = client
+      return self._client, None
+
+  def get_key_vault_client(self):
+    """ Returns the client used for key vault access, which is the shared plain client """
+
+    return self.get_client()
+
+  def get_client_encryption(self):
+    """ Returns the shared ClientEncryption, built on the key vault client
+
+    Return
+    -----------
+      client_encryption: mongo.ClientEncryption
+        Instantiated mongo.ClientEncryption instance
+      err: error
+        Error message or None of successful
+    """
+
+    with self._lock:
+      if self._client_encryption is None:
+        key_vault_client, err = self.get_key_vault_client()
+        if err is not None:
+          return None, err
+        self._client_encryption = ClientEncryption(
+          self.kms_provider,
+          self.keyvault_namespace,
+          key_vault_client,
+          CodecOptions(uuid_representation=STANDARD),
+          kms_tls_options = self.kms_tls_options
+        )
+      return self._client_encryption, None
+
+  def get_secure_client(self, schema_map=None, **options):
+    """ Returns the auto-encrypting client for a schema map and AutoEncryptionOpts options
+
+    Parameters
+    -----------
+      schema_map: dict
+        Schema map for automatic encryption, or None
+      options: keyword arguments
+        Extra AutoEncryptionOpts arguments, e.g. `bypass_auto_encryption=True`
+    Return
+    -----------
+      client: mongo.MongoClient
+        Auto-encrypting MongoDB client instance
+      err: error
+        Error message or None of successful
+    """
+
+    config = json_util.dumps({"schema_map": schema_map, "options": options}, sort_keys=True)
+    with self._lock:
+      if config not in self._secure_clients:
+        key_vault_client, err = self.get_key_vault_client()
+        if err is not None:
+          return None, err
+        options = {
+          "crypt_shared_lib_required": True,
+          "mongocryptd_bypass_spawn": True,
+          "crypt_shared_lib_path": self.crypt_shared_lib_path,
+          **options
+        }
+        auto_encryption = AutoEncryptionOpts(
+          self.kms_provider,
+          self.keyvault_namespace,
+          key_vault_client = key_vault_client,
+          schema_map = schema_map,
+          kms_tls_options = self.kms_tls_options,
+          **options
+        )
+        secure_client, err = mdb_client(self.connection_string, auto_encryption_opts=auto_encryption)
+        if err is not None:
+          return None, err
+        self._secure_clients[config] = secure_client
+      return self._secure_clients[config], None
+
+  def get_decrypting_client(self):
+    """ Returns the client of the "explicit-encrypt, auto-decrypt" profile
+
+    Built with `bypass_auto_encryption`, so commands are sent as they are: there is no query
+    analysis and crypt_shared is not loaded, but encrypted fields in the results are still
+    decrypted automatically. Queries on encrypted fields must be encrypted beforehand, e.g.
+    with `encrypt_query`.
+
+    Return
+    -----------
+      client: mongo.MongoClient
+        Auto-decrypting MongoDB client instance
+      err: error
+        Error message or None of successful
+    """
+
+    return self.get_secure_client(None, bypass_auto_encryption=True, crypt_shared_lib_required=False, crypt_shared_lib_path=None)
+
+  def close(self):
+    """ Closes the encrypted clients, the ClientEncryption and then the plain client """
+
+    with self._lock:
+      for secure_client in self._secure_clients.values():
+        secure_client.close()
+      self._secure_clients.clear()
+      if self._client_encryption is not None:
+        self._client_encryption.close()
+        self._client_encryption = None
+      if self._client is not None:
+        self._client.close()
+        self._client = None
+
+_CLIENT_MANAGERS = {}
+_CLIENT_MANAGERS_LOCK = Lock()
+
+def get_client_manager(connection_string, kms_provider, keyvault_namespace, kms_tls_options=None):
+  """ Returns the process-wide ClientManager for a connection string, key vault and KMS configuration
+
+  Managers are kept per process, so a forked worker builds its own clients instead of reusing
+  the parent's sockets. A call with a different KMS provider or KMS TLS options gets a manager of
+  its own. Every manager is closed when the process exits.
+
+  Parameters
+  -----------
+    connection_string: string
+      MongoDB connection string URI containing username, password, host, port, tls, etc
+    kms_provider: dict
+      The KMS provider configuration
+    keyvault_namespace: string
+      The "db.collection" namespace of the key vault
+    kms_tls_options: dict
+      TLS options for the KMS provider, or None
+  Return
+  -----------
+    manager: ClientManager
+      The shared ClientManager
+  """
+
+  key = (getpid(), connection_string, keyvault_namespace, json_util.dumps(kms_provider, sort_keys=True), json_util.dumps(kms_tls_options, sort_keys=True))
+  with _CLIENT_MANAGERS_LOCK:
+    if key not in _CLIENT_MANAGERS:
+      _CLIENT_MANAGERS[key] = ClientManager(connection_string, kms_provider, keyvault_namespace, kms_tls_options)
+    return _CLIENT_MANAGERS[key]
+
+@atexit.register
+def close_client_managers():
+  """ Closes every ClientManager created by this process """
+
+  with _CLIENT_MANAGERS_LOCK:
+    for (pid, *_), manager in list(_CLIENT_MANAGERS.items()):
+      if pid == getpid():
+        manager.close()
+    _CLIENT_MANAGERS.clear()
\ No newline at end of file
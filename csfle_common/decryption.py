@@ -0,0 +1,253 @@
+from bson.binary import Binary
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pymongo.errors import EncryptionError
+
+def decrypt_data(client_encryption, data):
+  """ Returns a decrypted value if the input is encrypted, or returns the input value
+
+  Tests the input value to determine if it is a BSON binary subtype 6 (aka encrypted data).
+  If true, the value is decrypted. If false the input value is returned
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      Instantiated mongo.ClientEncryption instancesection
+    data: value
+      A value to be tested, and decrypted if required
+  Return
+  -----------
+    data/unencrypted_data: value
+      unencrypted or input value
+  """
+
+  try:
+    if type(data) == Binary and data.subtype == 6:
+
+      decrypted_data = client_encryption.decrypt(data)
+
+      return decrypted_data
+    else:
+      return data
+  except EncryptionError as e:
+    raise e
+
+def traverse_bson(client_encryption, data):
+  """ Iterates over a object/value and determines if the value is a scalar or document
+  
+  Tests the input value is a list or dictionary, if not calls the `decrypt_data` function, if
+  true it calls itself with the value as the input. 
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      Instantiated mongo.ClientEncryption instance
+    data: value
+      A value to be tested, and decrypted if required
+  Return
+  -----------
+    data/unencrypted_data: value
+      unencrypted or input value
+  """
+  
+  if isinstance(data, list):
+    return [traverse_bson(client_encryption, v) for v in data]
+  elif isinstance(data, dict):
+    return {k: traverse_bson(client_encryption, v) for k, v in data.items()}
+  else:
+    return decrypt_data(client_encryption, data)
+
+def compile_decryption_plan(schema_map, namespace):
+  """ Returns the paths of every field the schema map says can be encrypted
+
+  Parameters
+  -----------
+    schema_map: dict
+      Schema map in the form passed to AutoEncryptionOpts, e.g. {"companyData.employee": {...}}
+    namespace: string
+      The "db.collection" namespace to compile
+  Return
+  -----------
+    plan: list
+      One (parent keys, field name) tuple per encrypted field
+  """
+
+  plan = []
+  stack = [((), schema_map[namespace])]
+  while stack:
+    path, schema = stack.pop()
+    for name, field in schema.get("properties", {}).items():
+      if "encrypt" in field:
+        plan.append((path, name))
+      elif "properties" in field:
+        stack.append((path + (name,), field))
+  return plan
+
+def gather_encrypted(data, encrypted, plan=None):
+  """ Copies an object/value and records where each encrypted value sits in the copy
+
+  Builds the same structure as `traverse_bson` would, but leaves every BSON binary subtype 6
+  value in place and appends a (container, key, value) reference to `encrypted`, so the values
+  can be decrypted separately and written back into the copy. With a plan from
+  `compile_decryption_plan` only the planned paths of each document are visited, otherwise the
+  whole structure is scanned. Both walks use an explicit stack rather than recursion, so deeply
+  nested documents cannot hit the recursion limit.
+
+  Parameters
+  -----------
+    data: value
+      A document, or a list of documents, to copy
+    encrypted: list
+      List that the (container, key, value) references are appended to
+    plan: list
+      Decryption plan from `compile_decryption_plan`, or None to scan every value
+  Return
+  -----------
+    copy: value
+      Copy of the input with the encrypted values still in place
+  """
+
+  root = [data]
+  stack = [(root, 0)]
+  while stack:
+    container, key = stack.pop()
+    value = container[key]
+    if isinstance(value, list):
+      container[key] = value = list(value)
+      stack.extend((value, i) for i in range(len(value)))
+    elif isinstance(value, dict):
+      container[key] = value = dict(value)
+      if plan is None:
+        stack.extend((value, k) for k in value)
+        continue
+      copied = set()
+      for path, name in plan:
+        parent = value
+        for p in path:
+          child = parent.get(p)
+          if not isinstance(child, dict):
+            break
+          if id(child) not in copied:
+            parent[p] = child = dict(child)
+            copied.add(id(child))
+          parent = child
+        else:
+          v = parent.get(name)
+          if type(v) == Binary and v.subtype == 6:
+            encrypted.append((parent, name, v))
+    elif type(value) == Binary and value.subtype == 6:
+      encrypted.append((container, key, value))
+  return root[0]
+
+def decrypt_document(client_encryption, data, plan=None):
+  """ Decrypts a document, or a list of documents, without recursing
+
+  Visits only the paths in the plan when one is given, and falls back to a full iterative scan
+  for documents with no schema.
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      Instantiated mongo.ClientEncryption instance
+    data: value
+      A document, or a list of documents, to decrypt
+    plan: list
+      Decryption plan from `compile_decryption_plan`, or None to scan every value
+  Return
+  -----------
+    data/unencrypted_data: value
+      unencrypted or input value
+  """
+
+  if not isinstance(data, (list, dict)):
+    return decrypt_data(client_encryption, data)
+
+  encrypted = []
+  copy = gather_encrypted(data, encrypted, plan)
+  for container, k, v in encrypted:
+    container[k] = decrypt_data(client_encryption, v)
+  return copy
+
+def parallel_traverse_bson(client_encryption, data, executor=None, max_workers=8, plan=None):
+  """ Decrypts every encrypted value of a document, or a page of documents, concurrently
+
+  Gathers all encrypted values first, then decrypts them on a thread pool so a document with
+  many encrypted fields pays roughly the slowest decrypt instead of the sum of all of them.
+  The result has the same structure as the input, as with `traverse_bson`.
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      Instantiated mongo.ClientEncryption instance
+    data: value
+      A document, or a list of documents, to decrypt
+    executor: concurrent.futures.Executor
+      Worker pool to decrypt on. If None, a pool of `max_workers` threads is created for this call
+    max_workers: int
+      Size of the worker pool created when `executor` is None
+    plan: list
+      Decryption plan from `compile_decryption_plan`, or None to scan every value
+  Return
+  -----------
+    data/unencrypted_data: value
+      unencrypted or input value
+  """
+
+  if not isinstance(data, (list, dict)):
+    return decrypt_data(client_encryption, data)
+
+  encrypted = []
+  copy = gather_encrypted(data, encrypted, plan)
+  if not encrypted:
+    return copy
+
+  values = [v for _, _, v in encrypted]
+  if executor is None:
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(values))) as pool:
+      decrypted = list(pool.map(lambda v: decrypt_data(client_encryption, v), values))
+  else:
+    decrypted = list(executor.map(lambda v: decrypt_data(client_encryption, v), values))
+
+  for (container, k, _), value in zip(encrypted, decrypted):
+    container[k] = value
+  return copy
+
+def decrypt_cursor(client_encryption, cursor, batch_size=100, plan=None, max_workers=8):
+  """ Yields the documents of a cursor decrypted, without loading the whole result set
+
+  Documents are taken from the cursor in batches of `batch_size`. While one batch is decrypted
+  on the worker pool the next one is read from the cursor, so fetching and decrypting overlap.
+  Memory does not grow with the result set, but it is more than one batch: the decrypted batch
+  being yielded and the batch being decrypted are both held, with the raw documents and their
+  decrypted copies, plus one future per encrypted value of the batch in flight and whatever
+  the cursor has buffered from the server. Give the cursor the same `batch_size` so each batch
+  is one round trip.
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      Instantiated mongo.ClientEncryption instance
+    cursor: mongo.Cursor
+      Cursor, or any iterable, of documents to decrypt
+    batch_size: int
+      Number of documents decrypted together
+    plan: list
+      Decryption plan from `compile_decryption_plan`, or None to scan every value
+    max_workers: int
+      Number of threads decrypting values
+  Return
+  -----------
+    decrypted_doc: dict
+      The next decrypted document
+  """
+
+  cursor = iter(cursor)
+  with ThreadPoolExecutor(max_workers=1) as batch_executor, ThreadPoolExecutor(max_workers=max_workers) as decrypt_executor:
+    pending = None
+    while True:
+      batch = list(islice(cursor, batch_size))
+      if pending is not None:
+        yield from pending.result()
+      if not batch:
+        return
+      pending = batch_executor.submit(parallel_traverse_bson, client_encryption, batch, decrypt_executor, max_workers, plan)
\ No newline at end of file
@@ -0,0 +1,243 @@
+from collections import OrderedDict
+from pymongo.encryption import Algorithm
+from threading import Lock
+from time import monotonic
+
+def compile_encryption_plan(schema_map, namespace):
+  """ Returns a flat list of the encrypted fields described by a schema map
+
+  Walks the JSON schema for the namespace once, resolving the `encryptMetadata` inherited by
+  each `encrypt` block, so the per-document work in `encrypt_fields` is a straight loop over
+  pre-split paths instead of repeated schema and dict lookups.
+
+  Parameters
+  -----------
+    schema_map: dict
+      Schema map in the form passed to AutoEncryptionOpts, e.g. {"companyData.employee": {...}}
+    namespace: string
+      The "db.collection" namespace to compile
+  Return
+  -----------
+    plan: list
+      One tuple per encrypted field: (parent keys, field name, algorithm, key_id, key_pointer).
+      `key_id` is the DEK UUID, or None when `key_pointer` names the document field holding
+      the keyAltName (e.g. "_id" for a keyId of "/_id")
+  """
+
+  plan = []
+  stack = [((), schema_map[namespace], {})]
+  while stack:
+    path, schema, metadata = stack.pop()
+    metadata = {**metadata, **schema.get("encryptMetadata", {})}
+    for name, field in schema.get("properties", {}).items():
+      if "encrypt" in field:
+        options = {**metadata, **field["encrypt"]}
+        if "algorithm" not in options or "keyId" not in options:
+          raise ValueError(f"No algorithm or keyId for {'.'.join(path + (name,))}")
+        key_id = options["keyId"]
+        key_pointer = None
+        if isinstance(key_id, str):
+          key_pointer, key_id = key_id.lstrip("/"), None
+        elif isinstance(key_id, list):
+          key_id = key_id[0]
+        plan.append((path, name, options["algorithm"], key_id, key_pointer))
+      elif "properties" in field:
+        stack.append((path + (name,), field, metadata))
+  return plan
+
+def encrypt_fields(client_encryption, plan, data):
+  """ Encrypts every field in the encryption plan, for one document or a list of documents
+
+  Fields are encrypted in place with the algorithm and DEK from the plan. Fields that are missing
+  are skipped and fields set to `None` are removed, as `None` cannot be encrypted.
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      Instantiated mongo.ClientEncryption instance
+    plan: list
+      Encryption plan from `compile_encryption_plan`
+    data: dict or list
+      A document, or a list of documents, to encrypt
+  Return
+  -----------
+    data: dict or list
+      The input document(s) with the fields encrypted
+  """
+
+  encrypt = client_encryption.encrypt
+  for doc in (data if isinstance(data, list) else [data]):
+    for path, name, algorithm, key_id, key_pointer in plan:
+      parent = doc
+      for key in path:
+        parent = parent.get(key)
+        if not isinstance(parent, dict):
+          break
+      else:
+        if name not in parent:
+          continue
+        value = parent[name]
+        if value is None:
+          del parent[name]
+        elif key_pointer is None:
+          parent[name] = encrypt(value, algorithm, key_id)
+        else:
+          parent[name] = encrypt(value, algorithm, key_alt_name=doc[key_pointer])
+  return data
+
+class CiphertextCache:
+  """ Bounded LRU cache of deterministic ciphertexts
+
+  Deterministic encryption of the same value with the same DEK always gives the same ciphertext,
+  so query values can be encrypted once and reused. Entries are evicted when the cache is full
+  (least recently used first) or when they are older than `ttl` seconds. Randomly encrypted
+  values are never cached.
+
+  Parameters
+  -----------
+    max_size: int
+      Maximum number of ciphertexts to keep
+    ttl: float
+      Seconds a ciphertext is kept for, or None to keep it until it is evicted
+  """
+
+  def __init__(self, max_size=10000, ttl=3600):
+    self.max_size = max_size
+    self.ttl = ttl
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    self._lock = Lock()
+
+  def encrypt(self, client_encryption, value, algorithm, key_id=None, key_alt_name=None):
+    """ Returns the ciphertext for a value, from the cache if possible
+
+    Parameters
+    -----------
+      client_encryption: mongo.ClientEncryption
+        Instantiated mongo.ClientEncryption instance
+      value: value
+        The value to encrypt
+      algorithm: string
+        The encryption algorithm, only the deterministic algorithm is cached
+      key_id: UUID
+        The UUID of the DEK, or None if `key_alt_name` is used
+      key_alt_name: string
+        The keyAltName of the DEK, or None if `key_id` is used
+    Return
+    -----------
+      encrypted_data: Binary
+        The encrypted value
+    """
+
+    if algorithm != Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic:
+      return client_encryption.encrypt(value, algorithm, key_id, key_alt_name)
+    try:
+      key = (value, type(value), key_id, key_alt_name, algorithm)
+      hash(key)
+    except TypeError:
+      # documents and arrays are not hashable, so they are never cached
+      return client_encryption.encrypt(value, algorithm, key_id, key_alt_name)
+
+    now = monotonic()
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None and (entry[0] is None or entry[0] > now):
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+      self.misses += 1
+
+    encrypted_data = client_encryption.encrypt(value, algorithm, key_id, key_alt_name)
+
+    with self._lock:
+      self._entries[key] = (None if self.ttl is None else now + self.ttl, encrypted_data)
+      self._entries.move_to_end(key)
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+    return encrypted_data
+
+  def clear(self):
+    """ Removes every cached ciphertext """
+
+    with self._lock:
+      self._entries.clear()
+
+  def stats(self):
+    """ Returns the hit and miss counters and the current number of cached ciphertexts """
+
+    with self._lock:
+      return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+# Process-wide cache used when encrypting query values
+QUERY_CIPHERTEXT_CACHE = CiphertextCache()
+
+def encrypt_query(client_encryption, query, plan, cache=QUERY_CIPHERTEXT_CACHE):
+  """ Returns a copy of a query with the values for encrypted fields replaced by their ciphertext
+
+  Does the job of query analysis ahead of time, so encrypted fields can be queried through a
+  plain client, or one built with `bypass_auto_encryption`, without crypt_shared. Supports
+  equality, `$eq`, `$ne`, `$in`, `$nin` and `$exists` on fields encrypted deterministically with
+  a fixed DEK, nested in `$and`, `$or` and `$nor`. The ciphertexts come from `cache`, so
+  repeated query values are only encrypted once.
+
+  Filters that can only be answered by a collection scan, or not at all, raise a ValueError:
+  values for randomly encrypted fields, range and pattern operators on encrypted fields,
+  whole-document matches on an object containing encrypted fields, paths inside an encrypted
+  field, e.g. "address.zipPostcode" when the whole address is encrypted, and `$expr`, `$where`
+  and `$text`, whose comparisons cannot be rewritten, whenever the plan encrypts a field.
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      Instantiated mongo.ClientEncryption instance
+    query: dict
+      The query filter with plaintext values, using dotted paths for nested fields
+    plan: list
+      The encryption plan returned by `compile_encryption_plan`
+    cache: CiphertextCache
+      Where to find and keep the ciphertexts
+  Return
+  -----------
+    query: dict
+      The query filter to send to the server
+  """
+
+  fields = {".".join(path + (name,)): (algorithm, key_id) for path, name, algorithm, key_id, _ in plan}
+  parents = {".".join(path[:i]) for path, _, _, _, _ in plan for i in range(1, len(path) + 1)}
+
+  def encrypt(path, value):
+    algorithm, key_id = fields[path]
+    if algorithm != Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic or key_id is None:
+      raise ValueError(f"{path} is not deterministically encrypted with a fixed DEK and cannot be queried")
+    return cache.encrypt(client_encryption, value, Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, key_id)
+
+  def rewrite(query):
+    rewritten = {}
+    for k, v in query.items():
+      if k in ("$and", "$or", "$nor"):
+        rewritten[k] = [rewrite(clause) for clause in v]
+      elif k in ("$expr", "$where", "$text") and fields:
+        raise ValueError(f"{k} cannot be used on a collection with encrypted fields, the values it compares are not encrypted")
+      elif k in parents:
+        raise ValueError(f"{k} contains encrypted fields, query them by their dotted paths instead")
+      elif any(k.startswith(f"{field}.") for field in fields):
+        raise ValueError(f"{k} is inside an encrypted field and cannot be queried")
+      elif k not in fields:
+        rewritten[k] = v
+      elif isinstance(v, dict) and any(op.startswith("$") for op in v):
+        rewritten[k] = {}
+        for op, operand in v.items():
+          if op in ("$eq", "$ne"):
+            rewritten[k][op] = encrypt(k, operand)
+          elif op in ("$in", "$nin"):
+            rewritten[k][op] = [encrypt(k, value) for value in operand]
+          elif op == "$exists":
+            rewritten[k][op] = operand
+          else:
+            raise ValueError(f"{op} is not supported on the encrypted field {k}")
+      else:
+        rewritten[k] = encrypt(k, v)
+    return rewritten
+
+  return rewrite(query)
\ No newline at end of file
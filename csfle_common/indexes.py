@@ -0,0 +1,148 @@
+from pymongo.encryption import Algorithm
+from pymongo.errors import PyMongoError
+
+def required_indexes(keyvault_db, keyvault_coll, encrypted_db_name, encrypted_coll_name):
+  """ Returns the indexes the encrypted lookups depend on
+
+  Parameters
+  -----------
+    keyvault_db: string
+      Name of the key vault database
+    keyvault_coll: string
+      Name of the key vault collection
+    encrypted_db_name: string
+      Name of the employee database
+    encrypted_coll_name: string
+      Name of the employee collection
+  Return
+  -----------
+    indexes: list
+      (db, collection, keys, options) tuples
+  """
+
+  return [
+    # every DEK lookup by keyAltName, and the uniqueness that stops two DEKs sharing an employee ID
+    (keyvault_db, keyvault_coll, [("keyAltNames", 1)], {
+      "name": "keyAltNames_1",
+      "unique": True,
+      "partialFilterExpression": {"keyAltNames": {"$exists": True}}
+    }),
+    # equality queries on the deterministically encrypted name fields
+    (encrypted_db_name, encrypted_coll_name, [("name.firstName", 1), ("name.lastName", 1)], {
+      "name": "name.firstName_1_name.lastName_1"
+    })
+  ]
+
+def ensure_indexes(client, indexes, create=True):
+  """ Creates the indexes that are missing
+
+  An index counts as present if one with the same keys exists, whatever its name.
+
+  Parameters
+  -----------
+    client: mongo.MongoClient
+      MongoDB client instance, not auto-encrypting
+    indexes: list
+      (db, collection, keys, options) tuples from `required_indexes`
+    create: bool
+      Create the missing indexes, or only report them
+  Return
+  -----------
+    missing: list
+      "db.collection keys" of the indexes that were missing
+    err: error
+      Error message or None of successful
+  """
+
+  missing = []
+  try:
+    for db_name, coll_name, keys, options in indexes:
+      collection = client[db_name][coll_name]
+      if any(index["key"] == keys for index in collection.index_information().values()):
+        continue
+      missing.append(f"{db_name}.{coll_name} {dict(keys)}")
+      if create:
+        collection.create_index(keys, **options)
+    return missing, None
+  except PyMongoError as e:
+    return missing, f"Cannot check or create indexes: {e}"
+
+def plan_stages(plan):
+  """ Returns every stage name in an explain plan, including nested input stages """
+
+  stages = []
+  stack = [plan]
+  while stack:
+    node = stack.pop()
+    if isinstance(node, dict):
+      if "stage" in node:
+        stages.append(node["stage"])
+      stack.extend(node.values())
+    elif isinstance(node, list):
+      stack.extend(node)
+  return stages
+
+def audit_queries(queries):
+  """ Explains queries and reports the ones that scan a whole collection
+
+  Parameters
+  -----------
+    queries: list
+      (description, collection, filter) tuples, with filters already encrypted where needed
+  Return
+  -----------
+    collscans: list
+      Descriptions of the queries whose winning plan has a COLLSCAN stage
+    err: error
+      Error message or None of successful
+  """
+
+  collscans = []
+  try:
+    for description, collection, query in queries:
+      explain = collection.find(query).explain()
+      if "COLLSCAN" in plan_stages(explain["queryPlanner"]["winningPlan"]):
+        collscans.append(description)
+    return collscans, None
+  except PyMongoError as e:
+    return collscans, f"Cannot explain queries: {e}"
+
+def lookup_queries(client, client_encryption, keyvault_db, keyvault_coll, encrypted_db_name, encrypted_coll_name, key_alt_name="dataKey1"):
+  """ Returns the lookups the scripts issue, shaped exactly as they reach the server
+
+  The name query is encrypted the way automatic encryption encrypts it, deterministically with
+  the common DEK, so the plan checked is the one the encrypted query gets.
+
+  Parameters
+  -----------
+    client: mongo.MongoClient
+      MongoDB client instance, not auto-encrypting
+    client_encryption: mongo.ClientEncryption
+      An instantiated ClientEncryption instance that has access to the key vault
+    keyvault_db: string
+      Name of the key vault database
+    keyvault_coll: string
+      Name of the key vault collection
+    encrypted_db_name: string
+      Name of the employee database
+    encrypted_coll_name: string
+      Name of the employee collection
+    key_alt_name: string
+      KeyAltName of the DEK the name fields are encrypted with
+  Return
+  -----------
+    queries: list
+      (description, collection, filter) tuples for `audit_queries`
+  """
+
+  def encrypt(value):
+    return client_encryption.encrypt(value, Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, key_alt_name=key_alt_name)
+
+  return [
+    ("keyAltNames lookup", client[keyvault_db][keyvault_coll], {"keyAltNames": "00000"}),
+    ("name.firstName equality", client[encrypted_db_name][encrypted_coll_name], {"name.firstName": encrypt("Audit")}),
+    ("name.firstName and name.lastName equality", client[encrypted_db_name][encrypted_coll_name], {
+      "name.firstName": encrypt("Audit"),
+      "name.lastName": encrypt("Audit")
+    })
+  ]
\ No newline at end of file
@@ -0,0 +1,104 @@
+from bson import json_util
+from threading import Lock
+from time import monotonic, sleep
+import os
+
+class RateLimiter:
+  """ Paces work across threads to an average number of units per second
+
+  Parameters
+  -----------
+    rate: float
+      Units per second, or None for no limit
+  """
+
+  def __init__(self, rate=None):
+    self.rate = rate
+    self._next = monotonic()
+    self._lock = Lock()
+
+  def acquire(self, units=1):
+    """ Blocks until `units` more units fit in the rate """
+
+    if not self.rate:
+      return
+    with self._lock:
+      now = monotonic()
+      start = max(now, self._next)
+      self._next = start + units / self.rate
+    if start > now:
+      sleep(start - now)
+
+def split_id_ranges(collection, partitions):
+  """ Splits a collection into `_id` ranges of roughly equal size
+
+  A range filter only matches `_id`s of the BSON type of its bounds, so a range spanning two
+  types, e.g. from an ObjectId to a string, would match nothing. Each `_id` type present is
+  therefore split on its own, into a share of the ranges proportional to its documents.
+
+  Parameters
+  -----------
+    collection: mongo.Collection
+      The collection to split
+    partitions: int
+      Number of ranges wanted
+  Return
+  -----------
+    ranges: list
+      (bson_type, min, max, is_last) tuples, each range includes `min` and excludes `max`
+      except the last range of its type, see `id_range_filter`
+  """
+
+  types = list(collection.aggregate([
+    {"$group": {"_id": {"$type": "$_id"}, "count": {"$sum": 1}}},
+    {"$sort": {"_id": 1}}
+  ], allowDiskUse=True))
+  total = sum(t["count"] for t in types)
+  ranges = []
+  for t in types:
+    buckets = list(collection.aggregate([
+      {"$match": {"_id": {"$type": t["_id"]}}},
+      {"$project": {"_id": 1}},
+      {"$bucketAuto": {"groupBy": "$_id", "buckets": max(1, round(partitions * t["count"] / total))}}
+    ], allowDiskUse=True))
+    ranges += [(t["_id"], b["_id"]["min"], b["_id"]["max"], i == len(buckets) - 1) for i, b in enumerate(buckets)]
+  return ranges
+
+def id_range_filter(id_range, after=None):
+  """ Returns the query for the documents of a range from `split_id_ranges`
+
+  Parameters
+  -----------
+    id_range: tuple
+      (bson_type, min, max, is_last) range
+    after: value
+      Last `_id` already processed in the range, to resume after it, or None
+  Return
+  -----------
+    query: dict
+      `_id` filter guarded by the range's BSON type
+  """
+
+  bson_type, low, high, is_last = id_range
+  id_filter = {"$type": bson_type, "$lte" if is_last else "$lt": high}
+  if after is None:
+    id_filter["$gte"] = low
+  else:
+    id_filter["$gt"] = after
+  return {"_id": id_filter}
+
+def read_checkpoint(path):
+  """ Returns a saved checkpoint, or None if the job has not written one yet """
+
+  try:
+    with open(path) as f:
+      return json_util.loads(f.read())
+  except FileNotFoundError:
+    return None
+
+def save_checkpoint(path, checkpoint):
+  """ Writes a checkpoint atomically, so an interruption never leaves a truncated file """
+
+  with open(f"{path}.tmp", "w") as f:
+    f.write(json_util.dumps(checkpoint))
+  os.replace(f"{path}.tmp", path)
\ No newline at end of file
@@ -0,0 +1,303 @@
+from bson.binary import STANDARD
+from bson.codec_options import CodecOptions
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from pymongo.errors import DuplicateKeyError, EncryptionError, PyMongoError
+from threading import Event, Lock, Thread
+from time import monotonic
+from uuid import uuid4
+
+class DekCache:
+  """ Process-wide cache of keyAltName to DEK UUID
+
+  Saves a key vault round trip for every DEK lookup. Names that were not found are cached too,
+  for the shorter `negative_ttl`, so repeated lookups of a missing name do not hit the key vault
+  either. Entries are evicted least recently used first once `max_size` is reached. Call
+  `invalidate` or `clear` whenever a DEK is deleted or its keyAltNames change.
+
+  Parameters
+  -----------
+    max_size: int
+      Maximum number of keyAltNames to keep
+    ttl: float
+      Seconds a found DEK UUID is kept for
+    negative_ttl: float
+      Seconds a keyAltName that was not found is remembered for
+  """
+
+  def __init__(self, max_size=100000, ttl=300, negative_ttl=10):
+    self.max_size = max_size
+    self.ttl = ttl
+    self.negative_ttl = negative_ttl
+    self._entries = OrderedDict()
+    self._lock = Lock()
+
+  def get(self, alt_name):
+    """ Returns (found, UUID) for a keyAltName, UUID is None for a cached miss """
+
+    with self._lock:
+      entry = self._entries.get(alt_name)
+      if entry is None:
+        return False, None
+      if entry[0] <= monotonic():
+        del self._entries[alt_name]
+        return False, None
+      self._entries.move_to_end(alt_name)
+      return True, entry[1]
+
+  def put(self, alt_name, key_id):
+    """ Caches the DEK UUID for a keyAltName, or None if the keyAltName does not exist """
+
+    ttl = self.negative_ttl if key_id is None else self.ttl
+    with self._lock:
+      self._entries[alt_name] = (monotonic() + ttl, key_id)
+      self._entries.move_to_end(alt_name)
+      while len(self._entries) > self.max_size:
+        self._entries.popitem(last=False)
+
+  def invalidate(self, alt_name):
+    """ Removes a keyAltName, e.g. after its DEK was deleted """
+
+    with self._lock:
+      self._entries.pop(alt_name, None)
+
+  def clear(self):
+    """ Removes every cached keyAltName """
+
+    with self._lock:
+      self._entries.clear()
+
+DEK_CACHE = DekCache()
+
+def lookup_dek_id(client, altName):
+  """ Return a DEK's UUID for a given KeyAltName, or None if there is no such DEK
+
+  Answers from `DEK_CACHE` when possible and only queries the key vault on a cache miss.
+
+  Parameters
+  -----------
+    client: mongo.ClientEncryption
+      An instantiated ClientEncryption instance that has access to the key vault
+    altName: string
+      The KeyAltName of the UUID to find
+  Return
+  -----------
+    key_id: UUID
+      The UUID of the DEK, or None if not found
+  """
+
+  found, key_id = DEK_CACHE.get(altName)
+  if not found:
+    key = client.get_key_by_alt_name(altName)
+    key_id = None if key is None else key["_id"]
+    DEK_CACHE.put(altName, key_id)
+  return key_id
+
+def get_employee_key(client, altName, provider_name, master_key, pool=None):
+  """ Return a DEK's UUID for a give KeyAltName. Creates a new DEK if the DEK is not found.
+  
+  Queries a key vault for a particular KeyAltName and returns the UUID of the DEK, if found.
+  If not found, the UUID and Key Provider object and CMK ID are used to create a new DEK.
+  Lookups and newly created DEKs go through `DEK_CACHE`. If a `DekPool` is given, a
+  pre-provisioned DEK is claimed from it before falling back to creating one
+
+  Parameters
+  -----------
+    client: mongo.ClientEncryption
+      An instantiated ClientEncryption instance that has access to the key vault
+    altName: string
+      The KeyAltName of the UUID to find
+    provider_name: string
+      The name of the key provider. "aws", "gcp", "azure", "kmip", or "local"
+    master_key: dict
+      The Customer Master Key (CMK) to wrap a new DEK with, None for the "local" provider
+    pool: DekPool
+      Pool of pre-provisioned DEKs to claim from, or None to always create the DEK inline
+  Return
+  -----------
+    employee_key_id: UUID
+      The UUID of the DEK
+    error: error
+      Error message or None of successful
+  """
+  
+  employee_key_id = lookup_dek_id(client, str(altName))
+  if employee_key_id == None and pool is not None:
+    employee_key_id = pool.claim(str(altName))
+    if employee_key_id is not None:
+      DEK_CACHE.put(str(altName), employee_key_id)
+  if employee_key_id == None:
+    try:
+      employee_key_id = client.create_data_key(kms_provider=provider_name, master_key=master_key, key_alt_names=[str(altName)])
+    except EncryptionError as e:
+      DEK_CACHE.invalidate(str(altName))
+      return None, f"ClientEncryption error: {e}"
+    DEK_CACHE.put(str(altName), employee_key_id)
+  return employee_key_id, None
+
+# keyAltName prefix that marks a pre-provisioned DEK as not yet assigned to an employee
+POOL_ALT_NAME_PREFIX = "unassigned-"
+
+# _id of the lease document that lets one process at a time refill the pool
+POOL_LEASE_ID = "dekPoolRefill"
+
+class DekPool:
+  """ Warm pool of pre-provisioned, unassigned DEKs
+
+  A background thread keeps at least `low_water` unassigned DEKs in the key vault, topping the
+  pool up to `target` at no more than `refill_rate` DEKs per second, so onboarding an employee
+  does not wait on the KMS. Unassigned DEKs carry a keyAltName starting with
+  `POOL_ALT_NAME_PREFIX`, and `claim` binds one to an employee by swapping that keyAltName for
+  the employee's in a single atomic update, so several processes can share the pool.
+  Claiming requires the `update` action on the key vault collection.
+
+  Only the process holding the lease document in `lease` refills, and it counts the pool after
+  taking the lease, so processes refilling at the same time cannot overshoot `target`. A lease
+  left by a process that died expires after `lease_seconds`.
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      An instantiated ClientEncryption instance that has access to the key vault
+    key_vault: mongo.Collection
+      The key vault collection
+    provider_name: string
+      The name of the key provider. "aws", "gcp", "azure", "kmip", or "local"
+    master_key: dict
+      The Customer Master Key (CMK) to wrap the new DEKs with
+    low_water: int
+      Refill the pool when fewer unassigned DEKs than this are left
+    target: int
+      Number of unassigned DEKs to refill the pool to
+    refill_rate: float
+      Maximum number of DEKs created per second
+    check_interval: float
+      Seconds between checks of the pool size
+    lease: mongo.Collection
+      Collection holding the refill lease, "__dekPoolLease" in the key vault database if None
+    lease_seconds: float
+      How long a refill lease lasts unless it is renewed
+  """
+
+  def __init__(self, client_encryption, key_vault, provider_name, master_key, low_water=100, target=500, refill_rate=20, check_interval=5, lease=None, lease_seconds=60):
+    self.client_encryption = client_encryption
+    self.key_vault = key_vault.with_options(codec_options=CodecOptions(uuid_representation=STANDARD))
+    self.provider_name = provider_name
+    self.master_key = master_key
+    self.low_water = low_water
+    self.target = target
+    self.refill_rate = refill_rate
+    self.check_interval = check_interval
+    self.lease = key_vault.database["__dekPoolLease"] if lease is None else lease
+    self.lease_seconds = lease_seconds
+    self.last_error = None
+    self._owner = uuid4().hex
+    self._filter = {"keyAltNames": {"$regex": f"^{POOL_ALT_NAME_PREFIX}"}}
+    self._stop = Event()
+    self._wake = Event()
+    self._thread = None
+
+  def start(self):
+    """ Starts refilling the pool in a background thread """
+
+    if self._thread is None:
+      self._stop.clear()
+      self._thread = Thread(target=self._run, name="dek-pool", daemon=True)
+      self._thread.start()
+
+  def stop(self, timeout=None):
+    """ Stops the background thread, waiting up to `timeout` seconds for it to finish """
+
+    self._stop.set()
+    self._wake.set()
+    if self._thread is not None:
+      self._thread.join(timeout)
+      self._thread = None
+
+  def available(self):
+    """ Returns the number of unassigned DEKs in the pool """
+
+    return self.key_vault.count_documents(self._filter)
+
+  def refill(self):
+    """ Creates DEKs until the pool is back at `target`, if it is below `low_water`
+
+    Does nothing while another process holds the refill lease.
+
+    Return
+    -----------
+      created: int
+        Number of DEKs created
+    """
+
+    if not self._take_lease():
+      return 0
+    try:
+      available = self.available()
+      if available >= self.low_water:
+        return 0
+      created = 0
+      interval = 1 / self.refill_rate
+      for _ in range(self.target - available):
+        # a lease that ran out may have passed to another process, which counts the pool again
+        if self._stop.is_set() or not self._take_lease():
+          break
+        started = monotonic()
+        self.client_encryption.create_data_key(
+          kms_provider=self.provider_name,
+          master_key=self.master_key,
+          key_alt_names=[f"{POOL_ALT_NAME_PREFIX}{uuid4().hex}"]
+        )
+        created += 1
+        self._stop.wait(max(0, interval - (monotonic() - started)))
+      return created
+    finally:
+      self.lease.delete_one({"_id": POOL_LEASE_ID, "owner": self._owner})
+
+  def _take_lease(self):
+    now = datetime.now(timezone.utc)
+    try:
+      self.lease.update_one(
+        {"_id": POOL_LEASE_ID, "$or": [{"owner": self._owner}, {"expiresAt": {"$lt": now}}]},
+        {"$set": {"owner": self._owner, "expiresAt": now + timedelta(seconds=self.lease_seconds)}},
+        upsert=True
+      )
+    except DuplicateKeyError:
+      # the lease exists and belongs to another process
+      return False
+    return True
+
+  def claim(self, altName):
+    """ Return the UUID of an unassigned DEK after binding it to a KeyAltName
+
+    Parameters
+    -----------
+      altName: string
+        The KeyAltName to give the DEK, e.g. the employee ID
+    Return
+    -----------
+      key_id: UUID
+        The UUID of the DEK, or None if the pool is empty
+    """
+
+    try:
+      key = self.key_vault.find_one_and_update(
+        self._filter,
+        {"$set": {"keyAltNames": [altName]}, "$currentDate": {"updateDate": True}},
+        projection={"_id": 1}
+      )
+    except DuplicateKeyError:
+      # another process bound a DEK to this KeyAltName first
+      key = self.key_vault.find_one({"keyAltNames": altName}, {"_id": 1})
+    self._wake.set()
+    return None if key is None else key["_id"]
+
+  def _run(self):
+    while not self._stop.is_set():
+      try:
+        self.refill()
+        self.last_error = None
+      except (EncryptionError, PyMongoError) as e:
+        self.last_error = f"DEK pool refill error: {e}"
+      self._wake.wait(self.check_interval)
+      self._wake.clear()
\ No newline at end of file
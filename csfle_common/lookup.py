@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+from pymongo.encryption import Algorithm
+
+from csfle_common.decryption import decrypt_document
+from csfle_common.encryption import QUERY_CIPHERTEXT_CACHE
+
+def batch_lookup(client_encryption, collection, plan, keys, chunk_size=1000, max_workers=8, decryption_plan=None, cache=QUERY_CIPHERTEXT_CACHE):
+  """ Looks up many documents by deterministically encrypted fields with a few `$in` queries
+
+  Every distinct query value is encrypted once, on `max_workers` threads with the values for
+  each DEK kept together, instead of once per lookup. The keys are then sent in chunks of
+  `chunk_size` as one `$in` query per chunk, the documents found are matched back to the keys
+  by their ciphertexts and decrypted on the same threads.
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      Instantiated mongo.ClientEncryption instance
+    collection: mongo.Collection
+      The collection to query, not auto-encrypting
+    plan: list
+      The encryption plan returned by `compile_encryption_plan`
+    keys: list
+      The lookups, each a dict of dotted path to plaintext value, all with the same paths,
+      e.g. [{"name.firstName": "Kuber", "name.lastName": "Engineer"}, ...]
+    chunk_size: int
+      Number of keys per `$in` query
+    max_workers: int
+      Number of threads encrypting values and decrypting documents
+    decryption_plan: list
+      Decryption plan from `compile_decryption_plan`, or None to scan every value
+    cache: CiphertextCache
+      Where to find and keep the ciphertexts
+  Return
+  -----------
+    key, documents: tuple
+      Yielded for every key in input order, with the list of decrypted documents that match it
+  """
+
+  keys = list(keys)
+  if not keys:
+    return
+  paths = list(keys[0])
+  fields = {".".join(path + (name,)): (algorithm, key_id) for path, name, algorithm, key_id, _ in plan}
+  for path in paths:
+    algorithm, key_id = fields.get(path, (None, None))
+    if algorithm != Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic or key_id is None:
+      raise ValueError(f"{path} is not deterministically encrypted with a fixed DEK and cannot be looked up")
+
+  # one task per DEK, so each thread keeps using a DEK libmongocrypt already has in its cache
+  by_key_id = {}
+  for path in paths:
+    values = by_key_id.setdefault(fields[path][1], {})
+    for key in keys:
+      values[key[path]] = None
+
+  def encrypt_all(key_id, values):
+    return key_id, [(value, cache.encrypt(client_encryption, value, Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, key_id)) for value in values]
+
+  def field_value(doc, path):
+    for part in path.split("."):
+      if not isinstance(doc, dict):
+        return None
+      doc = doc.get(part)
+    return doc
+
+  with ThreadPoolExecutor(max_workers=max_workers) as executor:
+    ciphertexts = {}
+    tasks = []
+    for key_id, values in by_key_id.items():
+      values = list(values)
+      step = max(1, -(-len(values) // max_workers))
+      tasks.extend(executor.submit(encrypt_all, key_id, values[i:i + step]) for i in range(0, len(values), step))
+    for task in tasks:
+      key_id, pairs = task.result()
+      for value, ciphertext in pairs:
+        ciphertexts[(key_id, value)] = ciphertext
+
+    def encrypted_key(key):
+      return tuple(ciphertexts[(fields[path][1], key[path])] for path in paths)
+
+    for i in range(0, len(keys), chunk_size):
+      chunk = keys[i:i + chunk_size]
+      query = {path: {"$in": list({ciphertexts[(fields[path][1], key[path])] for key in chunk})} for path in paths}
+      found = {}
+      for doc in collection.find(query):
+        found.setdefault(tuple(field_value(doc, path) for path in paths), []).append(doc)
+
+      matched = [found.get(encrypted_key(key), []) for key in chunk]
+      decrypted = iter(executor.map(lambda doc: decrypt_document(client_encryption, doc, decryption_plan), [doc for docs in matched for doc in docs]))
+      for key, docs in zip(chunk, matched):
+        yield key, [next(decrypted) for _ in docs]
\ No newline at end of file
@@ -0,0 +1,268 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pymongo import monitoring
+from pymongo.encryption import Algorithm
+from threading import Lock, Thread
+from time import perf_counter
+
+from csfle_common.keys import POOL_ALT_NAME_PREFIX
+
+# Latency histogram buckets, in seconds
+METRIC_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class Metrics:
+  """ Thread-safe counters, gauges and latency histograms, rendered in the Prometheus text format
+
+  Parameters
+  -----------
+    buckets: tuple
+      Upper bounds of the histogram buckets, in seconds
+  """
+
+  def __init__(self, buckets=METRIC_BUCKETS):
+    self.buckets = buckets
+    self._counters = {}
+    self._gauges = {}
+    self._histograms = {}
+    self._lock = Lock()
+
+  def inc(self, name, labels, value=1):
+    """ Adds `value` to the counter `name` with the given labels """
+
+    key = (name, tuple(sorted(labels.items())))
+    with self._lock:
+      self._counters[key] = self._counters.get(key, 0) + value
+
+  def set(self, name, labels, value):
+    """ Sets the gauge `name` with the given labels to `value` """
+
+    key = (name, tuple(sorted(labels.items())))
+    with self._lock:
+      self._gauges[key] = value
+
+  def observe(self, name, labels, seconds):
+    """ Records a latency, in seconds, in the histogram `name` with the given labels """
+
+    key = (name, tuple(sorted(labels.items())))
+    with self._lock:
+      histogram = self._histograms.get(key)
+      if histogram is None:
+        histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+      histogram[0][bisect_left(self.buckets, seconds)] += 1
+      histogram[1] += seconds
+      histogram[2] += 1
+
+  @contextmanager
+  def timed(self, operation, **labels):
+    """ Times the enclosed block as `csfle_operation_seconds` and counts it as an error if it raises """
+
+    labels = {"operation": operation, **labels}
+    start = perf_counter()
+    try:
+      yield
+    except Exception:
+      self.inc("csfle_operation_errors_total", labels)
+      raise
+    finally:
+      self.observe("csfle_operation_seconds", labels, perf_counter() - start)
+
+  def render(self):
+    """ Returns every metric in the Prometheus text exposition format """
+
+    def format_labels(labels):
+      return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+
+    lines = []
+    with self._lock:
+      for name in sorted({name for name, _ in self._counters}):
+        lines.append(f"# TYPE {name} counter")
+        for (n, labels), value in sorted(self._counters.items()):
+          if n == name:
+            lines.append(f"{name}{format_labels(labels)} {value}")
+      for name in sorted({name for name, _ in self._gauges}):
+        lines.append(f"# TYPE {name} gauge")
+        for (n, labels), value in sorted(self._gauges.items()):
+          if n == name:
+            lines.append(f"{name}{format_labels(labels)} {value}")
+      for name in sorted({name for name, _ in self._histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (n, labels), (counts, total, count) in sorted(self._histograms.items()):
+          if n != name:
+            continue
+          cumulative = 0
+          for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+            cumulative += bucket_count
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+          lines.append(f"{name}_sum{format_labels(labels)} {total}")
+          lines.append(f"{name}_count{format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
+
+METRICS = Metrics()
+
+def dump_metrics(path=None):
+  """ Writes the process-wide metrics to a file, or prints them if no path is given """
+
+  if path is None:
+    print(METRICS.render())
+  else:
+    with open(path, "w") as f:
+      f.write(METRICS.render())
+
+def start_metrics_server(port, metrics=METRICS):
+  """ Serves the metrics for scraping at http://<host>:<port>/metrics from a background thread
+
+  Parameters
+  -----------
+    port: int
+      Port to listen on
+    metrics: Metrics
+      The metrics to serve
+  Return
+  -----------
+    server: http.server.ThreadingHTTPServer
+      The running server, call `shutdown()` to stop it
+  """
+
+  class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      if self.path != "/metrics":
+        self.send_error(404)
+        return
+      body = metrics.render().encode()
+      self.send_response(200)
+      self.send_header("Content-Type", "text/plain; version=0.0.4")
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, format, *args):
+      pass
+
+  server = ThreadingHTTPServer(("", port), MetricsHandler)
+  Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+  return server
+
+# keyAltNames shared by every employee, anything else is an employee's own DEK
+COMMON_KEY_ALT_NAMES = {"dataKey1"}
+
+def key_alt_name_class(altName):
+  """ Returns the label used for a keyAltName, so per-employee names do not explode the label set """
+
+  if altName is None:
+    return "none"
+  if altName in COMMON_KEY_ALT_NAMES:
+    return "common"
+  if str(altName).startswith(POOL_ALT_NAME_PREFIX):
+    return "pool"
+  return "employee"
+
+def algorithm_label(algorithm):
+  """ Returns "deterministic" or "random" for an encryption algorithm """
+
+  return "deterministic" if algorithm == Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic else "random"
+
+class InstrumentedClientEncryption:
+  """ Wraps a ClientEncryption to record the latency and errors of its key vault, KMS and crypto calls
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      Instantiated mongo.ClientEncryption instance
+    metrics: Metrics
+      Where to record the measurements
+  """
+
+  def __init__(self, client_encryption, metrics=METRICS):
+    self._client_encryption = client_encryption
+    self._metrics = metrics
+
+  def get_key_by_alt_name(self, key_alt_name):
+    with self._metrics.timed("get_key_by_alt_name", algorithm="none", key_class=key_alt_name_class(key_alt_name)):
+      return self._client_encryption.get_key_by_alt_name(key_alt_name)
+
+  def create_data_key(self, kms_provider, master_key=None, key_alt_names=None, **kwargs):
+    key_class = key_alt_name_class(key_alt_names[0] if key_alt_names else None)
+    with self._metrics.timed("create_data_key", algorithm="none", key_class=key_class):
+      return self._client_encryption.create_data_key(kms_provider, master_key=master_key, key_alt_names=key_alt_names, **kwargs)
+
+  def encrypt(self, value, algorithm, key_id=None, key_alt_name=None, **kwargs):
+    key_class = "id" if key_alt_name is None else key_alt_name_class(key_alt_name)
+    with self._metrics.timed("encrypt", algorithm=algorithm_label(algorithm), key_class=key_class):
+      return self._client_encryption.encrypt(value, algorithm, key_id, key_alt_name, **kwargs)
+
+  def decrypt(self, value):
+    # the algorithm is the first byte of the ciphertext, 1 for deterministic and 2 for random
+    algorithm = "deterministic" if value[0] == 1 else "random"
+    with self._metrics.timed("decrypt", algorithm=algorithm, key_class="id"):
+      return self._client_encryption.decrypt(value)
+
+  def __getattr__(self, name):
+    return getattr(self._client_encryption, name)
+
+class InstrumentedCollection:
+  """ Wraps a collection of an auto-encrypting client to time `insert_one` and `find_one`
+
+  The time includes automatic encryption and decryption, while `CommandMetricsListener`
+  records the server round trips on their own.
+
+  Parameters
+  -----------
+    collection: mongo.Collection
+      The collection to wrap
+    metrics: Metrics
+      Where to record the measurements
+  """
+
+  def __init__(self, collection, metrics=METRICS):
+    self._collection = collection
+    self._metrics = metrics
+
+  def insert_one(self, document, *args, **kwargs):
+    with self._metrics.timed("insert_one", algorithm="auto", key_class="none"):
+      return self._collection.insert_one(document, *args, **kwargs)
+
+  def find_one(self, *args, **kwargs):
+    with self._metrics.timed("find_one", algorithm="auto", key_class="none"):
+      return self._collection.find_one(*args, **kwargs)
+
+  def __getattr__(self, name):
+    return getattr(self._collection, name)
+
+class CommandMetricsListener(monitoring.CommandListener):
+  """ Records every server command, labelled as key vault or data traffic
+
+  Register it with `pymongo.monitoring.register` before the clients are created, so it also
+  sees the key vault queries libmongocrypt issues during automatic encryption.
+
+  Parameters
+  -----------
+    metrics: Metrics
+      Where to record the measurements
+    keyvault_db: string
+      Name of the key vault database
+  """
+
+  def __init__(self, metrics, keyvault_db):
+    self._metrics = metrics
+    self._keyvault_db = keyvault_db
+    self._targets = {}
+    self._lock = Lock()
+
+  def _labels(self, event):
+    with self._lock:
+      target = self._targets.pop((event.connection_id, event.request_id), "data")
+    return {"command": event.command_name, "target": target}
+
+  def started(self, event):
+    target = "key_vault" if event.database_name == self._keyvault_db else "data"
+    with self._lock:
+      self._targets[(event.connection_id, event.request_id)] = target
+
+  def succeeded(self, event):
+    self._metrics.observe("mongodb_command_seconds", self._labels(event), event.duration_micros / 1e6)
+
+  def failed(self, event):
+    labels = self._labels(event)
+    self._metrics.inc("mongodb_command_failures_total", labels)
+    self._metrics.observe("mongodb_command_seconds", labels, event.duration_micros / 1e6)
\ No newline at end of file
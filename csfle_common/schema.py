@@ -0,0 +1,182 @@
+from bson import json_util
+from hashlib import sha256
+from pymongo.errors import PyMongoError
+import json
+import os
+
+from csfle_common.keys import lookup_dek_id
+
+# The single source definition of the employee schema and where its compiled artifacts are kept
+SCHEMA_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Schema_Maps", "employee.json")
+SCHEMA_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Schema_Maps", "compiled")
+
+def resolve_key_alt_names(schema, lookup):
+  """ Returns a copy of a schema with every `keyAltName` replaced by the DEK's UUID
+
+  The source definition names DEKs by keyAltName, e.g. `"keyAltName": "dataKey1"`, because
+  the UUIDs differ between environments. Each name is looked up once.
+
+  Parameters
+  -----------
+    schema: dict
+      The JSON schema from the source definition
+    lookup: function
+      Returns the UUID of the DEK for a keyAltName, or None if there is no such DEK
+  Return
+  -----------
+    schema: dict
+      The schema with `keyId: [UUID]` in place of each `keyAltName`
+    err: error
+      Error message or None of successful
+  """
+
+  resolved = {}
+  missing = []
+
+  def resolve(node):
+    if isinstance(node, list):
+      return [resolve(item) for item in node]
+    if not isinstance(node, dict):
+      return node
+    node = {k: resolve(v) for k, v in node.items()}
+    if "keyAltName" in node:
+      name = node.pop("keyAltName")
+      if name not in resolved:
+        resolved[name] = lookup(name)
+        if resolved[name] is None:
+          missing.append(name)
+      node["keyId"] = [resolved[name]]
+    return node
+
+  schema = resolve(schema)
+  if missing:
+    return None, f"No DEK for keyAltName {', '.join(missing)}"
+  return schema, None
+
+def load_schema_map(client_encryption, source_path=SCHEMA_SOURCE, namespace=None, key_alt_name=None):
+  """ Returns the schema map for AutoEncryptionOpts built from a schema source definition
+
+  The source encrypts most fields with each employee's own DEK through the "/_id" keyId
+  pointer. Scripts that encrypt every field with one shared DEK name it with `key_alt_name`.
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      An instantiated ClientEncryption instance that has access to the key vault
+    source_path: string
+      Path of the schema source definition
+    namespace: string
+      The "db.collection" namespace to map the schema to, the source's namespace if None
+    key_alt_name: string
+      keyAltName of the DEK for the fields without their own, or None to keep the "/_id" pointer
+  Return
+  -----------
+    schema_map: dict
+      Schema map in the form passed to AutoEncryptionOpts, e.g. {"companyData.employee": {...}}
+    err: error
+      Error message or None of successful
+  """
+
+  with open(source_path) as f:
+    source = json.load(f)
+  schema = source["schema"]
+  if key_alt_name is not None:
+    schema["encryptMetadata"].pop("keyId", None)
+    schema["encryptMetadata"]["keyAltName"] = key_alt_name
+  try:
+    schema, err = resolve_key_alt_names(schema, lambda altName: lookup_dek_id(client_encryption, altName))
+  except PyMongoError as e:
+    return None, f"Key vault error: {e}"
+  if err is not None:
+    return None, err
+  return {namespace or source["namespace"]: schema}, None
+
+def schema_artifact_path(source_path, cache_dir, keyvault_namespace):
+  """ Returns the path of the compiled artifact for a schema source
+
+  The file name is a hash of the source and the key vault namespace the keyAltNames are
+  resolved against, so editing the source never picks up a stale artifact.
+
+  Parameters
+  -----------
+    source_path: string
+      Path of the schema source definition
+    cache_dir: string
+      Directory holding the compiled artifacts
+    keyvault_namespace: string
+      The "db.collection" namespace of the key vault
+  Return
+  -----------
+    path: string
+      Path of the artifact, which may not exist yet
+  """
+
+  digest = sha256()
+  with open(source_path, "rb") as f:
+    digest.update(f.read())
+  digest.update(keyvault_namespace.encode())
+  return os.path.join(cache_dir, f"{digest.hexdigest()}.json")
+
+def check_compiled_schema(artifact, client_encryption):
+  """ Checks the DEK UUIDs a compiled artifact holds against the key vault
+
+  Parameters
+  -----------
+    artifact: dict
+      The compiled artifact, see `load_compiled_schema`
+    client_encryption: mongo.ClientEncryption
+      An instantiated ClientEncryption instance that has access to the key vault
+  Return
+  -----------
+    err: error
+      Error message if the artifact is out of date or cannot be checked, or None if it is current
+  """
+
+  if "keys" not in artifact:
+    return "The compiled schema does not record its DEKs, recompile it with schema_compiler/main.py --refresh"
+  try:
+    changed = [name for name, key_id in artifact["keys"].items() if lookup_dek_id(client_encryption, name) != key_id]
+  except PyMongoError as e:
+    return f"Cannot check the compiled schema's DEKs: {e}"
+  if changed:
+    return f"DEK {', '.join(changed)} changed since the schema was compiled, recompile it with schema_compiler/main.py --refresh"
+  return None
+
+def load_compiled_schema(source_path, cache_dir, keyvault_namespace, client_encryption=None, verify=False):
+  """ Returns the compiled artifact for a schema source, or None if it has not been compiled
+
+  Loading only reads the artifact. With `verify`, the DEK UUIDs it holds are also checked
+  against the key vault, see `check_compiled_schema`, which costs a key vault lookup per
+  keyAltName; `schema_compiler/main.py --check` does the same check on demand.
+
+  Parameters
+  -----------
+    source_path: string
+      Path of the schema source definition
+    cache_dir: string
+      Directory holding the compiled artifacts
+    keyvault_namespace: string
+      The "db.collection" namespace of the key vault
+    client_encryption: mongo.ClientEncryption
+      An instantiated ClientEncryption instance that has access to the key vault, needed to verify
+    verify: bool
+      Report an artifact compiled before one of its DEKs was recreated as out of date
+  Return
+  -----------
+    artifact: dict
+      "namespace", "schemaMap", "validator", "encryptedPaths" and "keys", or None
+    err: error
+      Error message or None of successful
+  """
+
+  try:
+    with open(schema_artifact_path(source_path, cache_dir, keyvault_namespace)) as f:
+      artifact = json_util.loads(f.read())
+  except FileNotFoundError:
+    return None, None
+
+  if verify:
+    err = check_compiled_schema(artifact, client_encryption)
+    if err is not None:
+      return None, err
+  return artifact, None
\ No newline at end of file
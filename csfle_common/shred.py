@@ -0,0 +1,122 @@
+from bson.binary import Binary
+from datetime import datetime, timezone
+from pymongo.errors import EncryptionError, PyMongoError
+from pymongo.read_concern import ReadConcern
+from pymongo.write_concern import WriteConcern
+
+# Encrypted fields removed from a tombstoned employee document. `name` is encrypted with the
+# common DEK, so it does not become unreadable when the employee's DEK is deleted
+TOMBSTONE_FIELDS = ["name", "address", "dob", "phoneNumber", "salary", "taxIdentifier"]
+
+# libmongocrypt error raised when a ciphertext's DEK is not in the key vault
+SHREDDED_KEY_ERROR = "not all keys requested were satisfied"
+
+def shred_employees(key_vault, collection, employee_ids, documents="keep", caches=()):
+  """ Crypto-shreds a batch of employees by deleting their DEKs
+
+  One `$in` query finds the DEKs of the batch and one `delete_many` removes them, both with
+  majority concern so the shredding is durable before the documents are touched. The
+  documents are then deleted, tombstoned or left as unreadable ciphertext.
+
+  Parameters
+  -----------
+    key_vault: mongo.Collection
+      The key vault collection
+    collection: mongo.Collection
+      The employee collection, not auto-encrypting. Only used if `documents` is not "keep"
+    employee_ids: list
+      The employee IDs, which are both the KeyAltNames of the DEKs and the document `_id`s
+    documents: string
+      "keep", "delete" or "tombstone" the employee documents
+    caches: list
+      Local DEK caches, anything with an `invalidate(altName)` method, to drop the employees from
+  Return
+  -----------
+    summary: dict
+      Number of DEKs deleted, employees without a DEK and documents deleted or tombstoned
+    err: error
+      Error message or None of successful
+  """
+
+  key_vault = key_vault.with_options(write_concern=WriteConcern("majority"), read_concern=ReadConcern("majority"))
+  summary = {"keys_deleted": 0, "keys_missing": 0, "documents": 0}
+  try:
+    keys = list(key_vault.find({"keyAltNames": {"$in": employee_ids}}, {"_id": 1, "keyAltNames": 1}))
+    if keys:
+      summary["keys_deleted"] = key_vault.delete_many({"_id": {"$in": [key["_id"] for key in keys]}}).deleted_count
+    found = {name for key in keys for name in key["keyAltNames"]}
+    summary["keys_missing"] = sum(1 for employee_id in employee_ids if employee_id not in found)
+
+    for cache in caches:
+      for employee_id in employee_ids:
+        cache.invalidate(employee_id)
+
+    if documents == "delete":
+      summary["documents"] = collection.delete_many({"_id": {"$in": employee_ids}}).deleted_count
+    elif documents == "tombstone":
+      summary["documents"] = collection.update_many(
+        {"_id": {"$in": employee_ids}},
+        {"$unset": {field: "" for field in TOMBSTONE_FIELDS}, "$set": {"shreddedAt": datetime.now(timezone.utc)}}
+      ).modified_count
+    return summary, None
+  except PyMongoError as e:
+    return summary, f"Cannot shred {employee_ids[0]}..{employee_ids[-1]}: {e}"
+
+def confirm_shredded(key_vault, employee_ids, client_encryption=None, collection=None, probe_field="salary"):
+  """ Returns the employees whose data can still be decrypted
+
+  Confirms shredding without waiting for the driver's DEK cache to expire: the key vault is
+  read with majority read concern, and if a ClientEncryption is given, one field of each
+  remaining document is decrypted with it. The ClientEncryption must not have decrypted these
+  employees before, so that its own DEK cache cannot mask the deletion.
+
+  Parameters
+  -----------
+    key_vault: mongo.Collection
+      The key vault collection
+    employee_ids: list
+      The shredded employee IDs
+    client_encryption: mongo.ClientEncryption
+      A fresh ClientEncryption instance, or None to only check the key vault
+    collection: mongo.Collection
+      The employee collection, not auto-encrypting, used with `client_encryption`
+    probe_field: string
+      A field encrypted with the employee's own DEK
+  Return
+  -----------
+    remaining: list
+      Employee IDs that still have a DEK or a decryptable document, empty if the key vault
+      could not be read
+    err: error
+      Error message for the documents that could not be checked, e.g. because the KMS or the
+      key vault was unreachable, or None if every employee was checked
+  """
+
+  key_vault = key_vault.with_options(read_concern=ReadConcern("majority"))
+  remaining = set()
+  unchecked = []
+  try:
+    for key in key_vault.find({"keyAltNames": {"$in": employee_ids}}, {"keyAltNames": 1}):
+      remaining.update(name for name in key["keyAltNames"] if name in employee_ids)
+  except PyMongoError as e:
+    return [], f"Key vault error: {e}"
+
+  if client_encryption is not None and collection is not None:
+    try:
+      for document in collection.find({"_id": {"$in": employee_ids}}, {probe_field: 1}):
+        value = document.get(probe_field)
+        if not isinstance(value, Binary) or value.subtype != 6:
+          continue
+        try:
+          client_encryption.decrypt(value)
+          remaining.add(document["_id"])
+        except EncryptionError as e:
+          # only a DEK missing from the key vault proves the shredding, a KMS or TLS outage or a
+          # failed key vault read says nothing about whether the data is still recoverable
+          if SHREDDED_KEY_ERROR not in str(e):
+            unchecked.append((document["_id"], e))
+    except PyMongoError as e:
+      return sorted(remaining), f"Cannot read the shredded employees' documents: {e}"
+  if unchecked:
+    return sorted(remaining), f"Cannot confirm {len(unchecked)} employees, e.g. {unchecked[0][0]}: {unchecked[0][1]}"
+  return sorted(remaining), None
\ No newline at end of file
@@ -0,0 +1 @@
+# Unit tests for the shared helpers, run with `python -m pytest csfle_common/tests` from the repository root
\ No newline at end of file
@@ -0,0 +1,60 @@
+from datetime import datetime
+import unittest
+
+from csfle_common.blind_index import BlindIndex, TOKEN_FIELD
+
+class FakeCollection:
+  """ Answers `find` for the token filters `BlindIndex` builds """
+
+  def __init__(self, documents):
+    self.documents = documents
+
+  def find(self, query):
+    (path, condition), = query.items()
+    field = path.split(".", 1)[1]
+    wanted = condition["$in"] if isinstance(condition, dict) else [condition]
+    for doc in self.documents:
+      tokens = doc[TOKEN_FIELD].get(field)
+      tokens = tokens if isinstance(tokens, list) else [tokens]
+      if any(token in wanted for token in tokens):
+        yield doc
+
+def employee(index, first, salary, dob):
+  return index.add_tokens({"name": {"firstName": first, "lastName": "Engineer"}, "salary": salary, "dob": dob})
+
+class BlindIndexTest(unittest.TestCase):
+
+  def setUp(self):
+    self.index = BlindIndex(b"k" * 32)
+    self.collection = FakeCollection([
+      employee(self.index, "Kuber", 120000.0, datetime(1981, 11, 11)),
+      employee(self.index, "Kurt", 80000.0, datetime(1981, 12, 1)),
+      employee(self.index, "Poorna", 125000.0, datetime(1990, 1, 1))
+    ])
+
+  def test_prefix_search_filters_candidates_exactly(self):
+    found = [doc["name"]["firstName"] for doc in self.index.search(self.collection, "name.firstName", prefix="kub")]
+    self.assertEqual(found, ["Kuber"])
+    found = [doc["name"]["firstName"] for doc in self.index.search(self.collection, "name.firstName", prefix="Ku")]
+    self.assertEqual(found, ["Kuber", "Kurt"])
+
+  def test_range_search_covers_every_bucket(self):
+    found = [doc["salary"] for doc in self.index.search(self.collection, "salary", low=100000.0, high=125000.0)]
+    self.assertEqual(found, [120000.0, 125000.0])
+    found = [doc["name"]["firstName"] for doc in self.index.search(self.collection, "dob", low=datetime(1981, 11, 1), high=datetime(1981, 12, 31))]
+    self.assertEqual(found, ["Kuber", "Kurt"])
+
+  def test_tokens_depend_on_the_key(self):
+    other = BlindIndex(b"o" * 32)
+    self.assertNotEqual(self.index.prefix_filter("name.firstName", "ku"), other.prefix_filter("name.firstName", "ku"))
+
+  def test_update_tokens_follows_changed_fields(self):
+    update = self.index.update_tokens({"name": {"firstName": "Ana"}})
+    self.assertEqual(set(update["$set"]), {f"{TOKEN_FIELD}.name_firstName"})
+    self.assertEqual(set(update["$unset"]), {f"{TOKEN_FIELD}.name_lastName"})
+
+  def test_open_ranges_and_empty_prefixes_are_rejected(self):
+    with self.assertRaises(ValueError):
+      self.index.range_filter("salary", None, 100000.0)
+    with self.assertRaises(ValueError):
+      self.index.prefix_filter("name.firstName", "")
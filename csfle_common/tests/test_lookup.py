@@ -0,0 +1,101 @@
+from bson.binary import Binary
+from pymongo.encryption import Algorithm
+from threading import Lock
+import unittest
+
+from csfle_common.encryption import CiphertextCache
+from csfle_common.lookup import batch_lookup
+
+DETERMINISTIC = Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic
+RANDOM = Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Random
+
+class FakeClientEncryption:
+  """ Deterministic stand-in for a ClientEncryption that counts its encrypt calls """
+
+  def __init__(self):
+    self.encrypted = []
+    self._lock = Lock()
+
+  def encrypt(self, value, algorithm, key_id=None, key_alt_name=None):
+    with self._lock:
+      self.encrypted.append((key_id, value))
+    return Binary(f"{key_id}:{value}".encode(), 6)
+
+  def decrypt(self, value):
+    return bytes(value).decode().split(":", 1)[1]
+
+class FakeCollection:
+  """ Answers `find` for the `$in` queries `batch_lookup` sends and records them """
+
+  def __init__(self, documents):
+    self.documents = documents
+    self.queries = []
+
+  def find(self, query):
+    self.queries.append(query)
+    for doc in self.documents:
+      if all(self._value(doc, path) in condition["$in"] for path, condition in query.items()):
+        yield doc
+
+  @staticmethod
+  def _value(doc, path):
+    for part in path.split("."):
+      doc = doc.get(part, {})
+    return doc
+
+def employee(client_encryption, _id, first, last):
+  return {
+    "_id": _id,
+    "name": {
+      "firstName": client_encryption.encrypt(first, DETERMINISTIC, "k1"),
+      "lastName": client_encryption.encrypt(last, DETERMINISTIC, "k2")
+    }
+  }
+
+class BatchLookupTest(unittest.TestCase):
+
+  def setUp(self):
+    self.client_encryption = FakeClientEncryption()
+    self.plan = [
+      (("name",), "firstName", DETERMINISTIC, "k1", None),
+      (("name",), "lastName", DETERMINISTIC, "k2", None),
+      ((), "salary", RANDOM, None, "/_id")
+    ]
+    self.collection = FakeCollection([
+      employee(self.client_encryption, 1, "Kuber", "Engineer"),
+      employee(self.client_encryption, 2, "Poorna", "Muggle"),
+      employee(self.client_encryption, 3, "Kuber", "Engineer")
+    ])
+    self.client_encryption.encrypted.clear()
+
+  def lookup(self, keys, **kwargs):
+    return list(batch_lookup(self.client_encryption, self.collection, self.plan, keys, cache=CiphertextCache(), **kwargs))
+
+  def test_matches_documents_to_keys_in_input_order(self):
+    keys = [
+      {"name.firstName": "Poorna", "name.lastName": "Muggle"},
+      {"name.firstName": "Nobody", "name.lastName": "Engineer"},
+      {"name.firstName": "Kuber", "name.lastName": "Engineer"}
+    ]
+    results = self.lookup(keys)
+
+    self.assertEqual([key for key, _ in results], keys)
+    self.assertEqual([[doc["_id"] for doc in docs] for _, docs in results], [[2], [], [1, 3]])
+    self.assertEqual(results[0][1][0]["name"], {"firstName": "Poorna", "lastName": "Muggle"})
+
+  def test_encrypts_each_value_once_and_queries_per_chunk(self):
+    keys = [{"name.firstName": "Kuber", "name.lastName": "Engineer"}] * 3 + [{"name.firstName": "Poorna", "name.lastName": "Muggle"}]
+    results = self.lookup(keys, chunk_size=2, max_workers=2)
+
+    self.assertEqual(sorted(self.client_encryption.encrypted), [("k1", "Kuber"), ("k1", "Poorna"), ("k2", "Engineer"), ("k2", "Muggle")])
+    self.assertEqual(len(self.collection.queries), 2)
+    self.assertEqual([len(docs) for _, docs in results], [2, 2, 2, 1])
+
+  def test_rejects_fields_that_cannot_be_looked_up(self):
+    for path in ("salary", "role"):
+      with self.assertRaises(ValueError):
+        self.lookup([{path: 1}])
+
+  def test_no_keys_sends_no_query(self):
+    self.assertEqual(self.lookup([]), [])
+    self.assertEqual(self.collection.queries, [])
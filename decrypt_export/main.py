@@ -0,0 +1,301 @@
+from argparse import ArgumentParser
+from bson import json_util
+from datetime import datetime
+from itertools import islice
+from multiprocessing import get_context
+from pymongo.errors import EncryptionError, PyMongoError
+from time import perf_counter
+from urllib.parse import quote_plus
+import os
+import sys
+
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import get_client_manager, close_client_managers
+from csfle_common.decryption import compile_decryption_plan, decrypt_cursor
+from csfle_common.jobs import split_id_ranges, id_range_filter
+
+try:
+  import pyarrow
+  import pyarrow.parquet
+  from pyarrow.lib import ArrowException
+except ImportError:
+  pyarrow = None
+  ArrowException = ValueError
+
+
+# IN VALUES HERE!
+PETNAME = 
+MDB_PASSWORD = 
+APP_USER = "app_user"
+CA_PATH = "/etc/pki/tls/certs/ca.cert"
+
+def flatten(doc, prefix=""):
+  """ Flattens a decrypted document into dotted column names with columnar friendly values
+
+  Nested documents become dotted columns, arrays become JSON strings, and BSON types such as
+  ObjectId become strings. Dates, numbers, strings and booleans are kept as they are.
+
+  Parameters
+  -----------
+    doc: dict
+      The document to flatten
+    prefix: string
+      Column name prefix, used for nested documents
+  Return
+  -----------
+    row: dict
+      The flattened row
+  """
+
+  row = {}
+  for k, v in doc.items():
+    if isinstance(v, dict):
+      row.update(flatten(v, f"{prefix}{k}."))
+    elif isinstance(v, list):
+      row[f"{prefix}{k}"] = json_util.dumps(v)
+    elif v is None or isinstance(v, (str, int, float, bool, datetime)):
+      row[f"{prefix}{k}"] = v
+    else:
+      row[f"{prefix}{k}"] = str(v)
+  return row
+
+def export_range(task):
+  """ Decrypts one `_id` range of the collection to an NDJSON or Parquet file, in a worker process
+
+  The worker builds its own clients and ClientEncryption, so every process keeps its own
+  libmongocrypt DEK cache. The file is written under a temporary name and renamed once
+  complete, so an interrupted export can be resumed by skipping the files that exist.
+
+  Parameters
+  -----------
+    task: dict
+      The range, output path and connection settings, see `main`
+  Return
+  -----------
+    part: int
+      The range number
+    exported: int
+      Number of documents exported
+    err: error
+      Error message or None of successful
+  """
+
+  manager = get_client_manager(task["connection_string"], task["kms_provider"], task["keyvault_namespace"], task["kms_tls_options"])
+  client, err = manager.get_client()
+  if err is not None:
+    return task["part"], 0, err
+  client_encryption, err = manager.get_client_encryption()
+  if err is not None:
+    return task["part"], 0, err
+
+  cursor = client[task["db"]][task["coll"]].find(id_range_filter(task["range"])).sort("_id", 1).batch_size(task["batch_size"])
+  decrypted_docs = decrypt_cursor(client_encryption, cursor, task["batch_size"], task["plan"], task["threads"])
+
+  tmp_path = task["path"] + ".tmp"
+  exported = 0
+  try:
+    if task["format"] == "ndjson":
+      with open(tmp_path, "w") as f:
+        for doc in decrypted_docs:
+          f.write(json_util.dumps(doc) + "\n")
+          exported += 1
+    else:
+      writer = None
+      try:
+        while True:
+          rows = [flatten(doc) for doc in islice(decrypted_docs, task["batch_size"])]
+          if not rows:
+            break
+          table = pyarrow.Table.from_pylist(rows)
+          if writer is None:
+            # the first batch fixes the file schema, a column that is null throughout it is
+            # assumed to hold strings, as every value flatten() does not recognise does
+            schema = pyarrow.schema([f.with_type(pyarrow.string()) if pyarrow.types.is_null(f.type) else f for f in table.schema])
+            writer = pyarrow.parquet.ParquetWriter(tmp_path, schema)
+          extra = [name for name in table.schema.names if writer.schema.get_field_index(name) == -1]
+          if extra:
+            raise ValueError(f"columns {extra} are not in the first batch and cannot be added to the Parquet schema")
+          # missing columns are written as null, a value of another type raises ArrowException
+          writer.write_table(pyarrow.Table.from_pylist(rows, schema=writer.schema))
+          exported += len(rows)
+      finally:
+        if writer is not None:
+          writer.close()
+      if writer is None:
+        pyarrow.parquet.write_table(pyarrow.table({}), tmp_path)
+    os.replace(tmp_path, task["path"])
+  except (EncryptionError, PyMongoError, OSError, ValueError, ArrowException) as e:
+    return task["part"], exported, f"Range {task['part']} failed: {e}"
+  return task["part"], exported, None
+
+def count_exported(path, format):
+  """ Returns the number of documents in an exported part file """
+
+  if format == "ndjson":
+    with open(path) as f:
+      return sum(1 for _ in f)
+  return pyarrow.parquet.ParquetFile(path).metadata.num_rows
+
+def main():
+
+  parser = ArgumentParser(description="Export the decrypted employee collection using several processes")
+  parser.add_argument("--out", required=True, help="output directory")
+  parser.add_argument("--format", choices=["ndjson", "parquet"], default="ndjson", help="output file format")
+  parser.add_argument("--processes", type=int, default=os.cpu_count(), help="number of worker processes")
+  parser.add_argument("--partitions", type=int, help="number of _id ranges, default 4 per process")
+  parser.add_argument("--batch-size", type=int, default=500, help="documents per cursor batch")
+  parser.add_argument("--threads", type=int, default=4, help="decryption threads per process")
+  parser.add_argument("--resume", action="store_true", help="continue an interrupted export in --out")
+  args = parser.parse_args()
+
+  # Obviously this should not be hardcoded
+  connection_string = "mongodb://%s:%s@csfle-mongodb-%s.mdbtraining.net/?serverSelectionTimeoutMS=5000&tls=true&tlsCAFile=%s" % (
+    quote_plus(APP_USER),
+    quote_plus(MDB_PASSWORD),
+    PETNAME,
+    quote_plus(CA_PATH)
+  )
+
+  # Declare or key vault namespce
+  keyvault_db = "__encryption"
+  keyvault_coll = "__keyVault"
+  keyvault_namespace = f"{keyvault_db}.{keyvault_coll}"
+
+  # declare our key provider type
+  provider = "kmip"
+
+  # declare our key provider attributes
+  kms_provider = {
+    provider: {
+      "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"
+    }
+  }
+  kms_tls_options = {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  }
+
+  # declare our database and collection
+  encrypted_db_name = "companyData"
+  encrypted_coll_name = "employee"
+
+  # Decryption only needs to know which fields are encrypted, so no keyIds are required here
+  schema_map = {
+    "companyData.employee": {
+      "bsonType": "object",
+      "properties": {
+        "name": {
+          "bsonType": "object",
+          "properties": {
+            "firstName": {"encrypt": {"bsonType": "string"}},
+            "lastName": {"encrypt": {"bsonType": "string"}},
+            "otherNames": {"encrypt": {"bsonType": "string"}}
+          }
+        },
+        "address": {"encrypt": {"bsonType": "object"}},
+        "dob": {"encrypt": {"bsonType": "date"}},
+        "phoneNumber": {"encrypt": {"bsonType": "string"}},
+        "salary": {"encrypt": {"bsonType": "double"}},
+        "taxIdentifier": {"encrypt": {"bsonType": "string"}}
+      }
+    }
+  }
+  plan = compile_decryption_plan(schema_map, f"{encrypted_db_name}.{encrypted_coll_name}")
+
+  # The manifest records the ranges, so a resumed export uses exactly the same split. Parts
+  # are only reused under --resume, as parts from another split would silently replace ranges
+  os.makedirs(args.out, exist_ok=True)
+  manifest_path = os.path.join(args.out, "manifest.json")
+  namespace = f"{encrypted_db_name}.{encrypted_coll_name}"
+  if args.resume:
+    if not os.path.exists(manifest_path):
+      print(f"No export to resume in {args.out}")
+      sys.exit(1)
+    with open(manifest_path) as f:
+      manifest = json_util.loads(f.read())
+    if manifest.get("namespace") != namespace:
+      print(f"The export in {args.out} is of {manifest.get('namespace')}, not {namespace}")
+      sys.exit(1)
+  else:
+    if any(name == "manifest.json" or name.startswith("part-") for name in os.listdir(args.out)):
+      print(f"{args.out} already holds an export, use --resume to continue it or choose an empty directory")
+      sys.exit(1)
+    client, err = get_client_manager(connection_string, kms_provider, keyvault_namespace, kms_tls_options).get_client()
+    if err is not None:
+      print(err)
+      sys.exit(1)
+    ranges = split_id_ranges(client[encrypted_db_name][encrypted_coll_name], args.partitions or args.processes * 4)
+    manifest = {"namespace": namespace, "format": args.format, "ranges": ranges}
+    with open(manifest_path, "w") as f:
+      f.write(json_util.dumps(manifest))
+    close_client_managers()
+
+  if manifest["format"] == "parquet" and pyarrow is None:
+    print("Parquet export needs the pyarrow package")
+    sys.exit(1)
+
+  extension = "ndjson" if manifest["format"] == "ndjson" else "parquet"
+  tasks = []
+  resumed = 0
+  for part, id_range in enumerate(manifest["ranges"]):
+    path = os.path.join(args.out, f"part-{part:05d}.{extension}")
+    if args.resume and os.path.exists(path):
+      resumed += count_exported(path, manifest["format"])
+      continue
+    tasks.append({
+      "part": part,
+      "range": tuple(id_range),
+      "path": path,
+      "format": manifest["format"],
+      "db": encrypted_db_name,
+      "coll": encrypted_coll_name,
+      "plan": plan,
+      "batch_size": args.batch_size,
+      "threads": args.threads,
+      "connection_string": connection_string,
+      "kms_provider": kms_provider,
+      "keyvault_namespace": keyvault_namespace,
+      "kms_tls_options": kms_tls_options
+    })
+  print(f"{len(manifest['ranges']) - len(tasks)} of {len(manifest['ranges'])} ranges already exported")
+
+  # spawn rather than fork, so no worker inherits the parent's MongoDB sockets
+  failed = 0
+  exported = 0
+  start = perf_counter()
+  with get_context("spawn").Pool(args.processes) as pool:
+    for done, (part, count, err) in enumerate(pool.imap_unordered(export_range, tasks), 1):
+      exported += count
+      if err is not None:
+        failed += 1
+        print(err)
+      elapsed = perf_counter() - start
+      print(f"[{done}/{len(tasks)}] range {part}: {count} documents, {exported} total, {exported / elapsed:.0f} docs/s")
+
+  if failed:
+    print(f"{failed} ranges failed, rerun with --resume to retry them")
+    sys.exit(1)
+
+  # every document must be in exactly one range, a difference means documents were missed or
+  # the collection changed during the export
+  client, err = get_client_manager(connection_string, kms_provider, keyvault_namespace, kms_tls_options).get_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  try:
+    expected = client[encrypted_db_name][encrypted_coll_name].count_documents({})
+  except PyMongoError as e:
+    print(f"Cannot count {namespace}: {e}")
+    sys.exit(1)
+  close_client_managers()
+  if resumed + exported != expected:
+    print(f"Exported {resumed + exported} documents but {namespace} holds {expected}")
+    sys.exit(1)
+  print(f"Exported all {expected} documents of {namespace}")
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
@@ -0,0 +1,103 @@
+from argparse import ArgumentParser
+from pymongo.errors import EncryptionError, PyMongoError
+from time import sleep
+from urllib.parse import quote_plus
+import os
+import sys
+
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import get_client_manager
+from csfle_common.keys import DekPool
+
+# IN VALUES HERE!
+PETNAME = 
+MDB_PASSWORD = 
+APP_USER = "app_user"
+CA_PATH = "/etc/pki/tls/certs/ca.cert"
+
+def main():
+
+  parser = ArgumentParser(description="Keep a pool of unassigned DEKs in the key vault, so onboarding does not wait on the KMS")
+  parser.add_argument("--low-water", type=int, default=100, help="refill when fewer unassigned DEKs than this are left")
+  parser.add_argument("--target", type=int, default=500, help="number of unassigned DEKs to refill to")
+  parser.add_argument("--refill-rate", type=float, default=20, help="maximum DEKs created per second")
+  parser.add_argument("--check-interval", type=float, default=5, help="seconds between checks of the pool size")
+  parser.add_argument("--once", action="store_true", help="refill once and exit, e.g. from cron")
+  args = parser.parse_args()
+
+  # Obviously this should not be hardcoded
+  connection_string = "mongodb://%s:%s@csfle-mongodb-%s.mdbtraining.net/?serverSelectionTimeoutMS=5000&tls=true&tlsCAFile=%s" % (
+    quote_plus(APP_USER),
+    quote_plus(MDB_PASSWORD),
+    PETNAME,
+    quote_plus(CA_PATH)
+  )
+
+  # Declare or key vault namespce
+  keyvault_db = "__encryption"
+  keyvault_coll = "__keyVault"
+  keyvault_namespace = f"{keyvault_db}.{keyvault_coll}"
+
+  # declare our key provider type
+  provider = "kmip"
+
+  # declare our key provider attributes
+  kms_provider = {
+    provider: {
+      "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"
+    }
+  }
+
+  clients = get_client_manager(connection_string, kms_provider, keyvault_namespace, {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  })
+  client, err = clients.get_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  client_encryption, err = clients.get_client_encryption()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  pool = DekPool(
+    client_encryption,
+    client[keyvault_db][keyvault_coll],
+    provider,
+    {"keyId": "1", "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"},
+    low_water=args.low_water,
+    target=args.target,
+    refill_rate=args.refill_rate,
+    check_interval=args.check_interval
+  )
+
+  if args.once:
+    try:
+      created = pool.refill()
+      print(f"Created {created} DEKs, {pool.available()} unassigned")
+    except (EncryptionError, PyMongoError) as e:
+      print(f"DEK pool refill error: {e}")
+      sys.exit(1)
+    return
+
+  # refill in the background until interrupted, reporting the pool size at every check
+  pool.start()
+  try:
+    while True:
+      sleep(args.check_interval)
+      try:
+        print(f"{pool.available()} unassigned DEKs" if pool.last_error is None else pool.last_error)
+      except PyMongoError as e:
+        print(f"Cannot count the DEK pool: {e}")
+  except KeyboardInterrupt:
+    pass
+  finally:
+    pool.stop()
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
@@ -0,0 +1,315 @@
+# Only the standard library is imported up front. pymongo, bson and the csfle_common helpers
+# that use them are imported by the functions that first need them, so a worker that is started
+# and stopped quickly, or that only needs part of the stack, does not pay for the rest
+from time import perf_counter
+
+PROCESS_START = perf_counter()
+
+from argparse import ArgumentParser
+from urllib.parse import quote_plus
+import os
+import sys
+
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# IN VALUES HERE!
+PETNAME = 
+MDB_PASSWORD = 
+APP_USER = "app_user"
+CA_PATH = "/etc/pki/tls/certs/ca.cert"
+
+class FastStart:
+  """ Connects a short-lived worker lazily, or all at once with `warm()`
+
+  Creating an instance does no I/O and imports nothing. The driver is imported, the compiled
+  schema read and each client built through a `ClientManager` on first use, unless `warm()` is
+  called first to pay the start-up costs in one go: importing the driver, opening the
+  connection pools, loading crypt_shared, fetching and decrypting the hot DEKs and running the
+  warm-up queries, so the first real operation runs at full speed. The time of each step is
+  kept in `startup` and recorded with `record_startup_metrics`.
+
+  Parameters
+  -----------
+    connection_string: string
+      MongoDB connection string URI containing username, password, host, port, tls, etc
+    kms_provider: dict
+      The KMS provider configuration
+    keyvault_namespace: string
+      The "db.collection" namespace of the key vault
+    kms_tls_options: dict
+      TLS options for the KMS provider, or None
+    crypt_shared_lib_path: string
+      Path to the crypt_shared library used by the auto-encrypting client
+    hot_key_alt_names: list
+      KeyAltNames of the DEKs to fetch and decrypt for explicit encryption in `warm()`
+    min_pool_size: int
+      Connections each client opens in the background once created
+  """
+
+  def __init__(self, connection_string, kms_provider, keyvault_namespace, kms_tls_options=None, crypt_shared_lib_path='/lib/mongo_crypt_v1.so', hot_key_alt_names=("dataKey1",), min_pool_size=4):
+    self.connection_string = connection_string
+    self.kms_provider = kms_provider
+    self.keyvault_namespace = keyvault_namespace
+    self.kms_tls_options = kms_tls_options
+    self.crypt_shared_lib_path = crypt_shared_lib_path
+    self.hot_key_alt_names = list(hot_key_alt_names)
+    self.min_pool_size = min_pool_size
+    self.startup = {}
+    self._clients = None
+    self._schema_map = None
+    self._schema_loaded = False
+
+  def _timed(self, phase, start):
+    self.startup[phase] = self.startup.get(phase, 0.0) + perf_counter() - start
+
+  def _manager(self):
+    """ Returns the ClientManager, importing the driver and creating the manager on first use """
+
+    if self._clients is None:
+      start = perf_counter()
+      from csfle_common.clients import ClientManager
+      self._timed("import", start)
+      self._clients = ClientManager(
+        f"{self.connection_string}&minPoolSize={self.min_pool_size}",
+        self.kms_provider,
+        self.keyvault_namespace,
+        self.kms_tls_options,
+        crypt_shared_lib_path = self.crypt_shared_lib_path
+      )
+    return self._clients
+
+  def get_client(self):
+    """ Returns the plain client, also used as the key vault client
+
+    Return
+    -----------
+      client: mongo.MongoClient
+        MongoDB client instance
+      err: error
+        Error message or None of successful
+    """
+
+    clients = self._manager()
+    start = perf_counter()
+    client, err = clients.get_client()
+    if err is None and "connect" not in self.startup:
+      self._timed("connect", start)
+    return client, err
+
+  def get_client_encryption(self):
+    """ Returns the ClientEncryption, built on the plain client
+
+    Return
+    -----------
+      client_encryption: mongo.ClientEncryption
+        Instantiated mongo.ClientEncryption instance
+      err: error
+        Error message or None of successful
+    """
+
+    _, err = self.get_client()
+    if err is not None:
+      return None, err
+    start = perf_counter()
+    client_encryption, err = self._clients.get_client_encryption()
+    if err is None and "client_encryption" not in self.startup:
+      self._timed("client_encryption", start)
+    return client_encryption, err
+
+  def get_schema_map(self):
+    """ Returns the schema map compiled by schema_compiler/main.py, read on first use
+
+    Without a compiled schema the auto-encrypting client uses the validator on the collection.
+    The artifact's DEKs are not checked against the key vault here, see `load_compiled_schema`.
+
+    Return
+    -----------
+      schema_map: dict
+        Schema map for automatic encryption, or None if the schema has not been compiled
+      err: error
+        Error message or None of successful
+    """
+
+    if not self._schema_loaded:
+      start = perf_counter()
+      from csfle_common.schema import SCHEMA_SOURCE, SCHEMA_CACHE_DIR, load_compiled_schema
+      compiled_schema, err = load_compiled_schema(SCHEMA_SOURCE, SCHEMA_CACHE_DIR, self.keyvault_namespace)
+      if err is not None:
+        return None, err
+      self._schema_map = None if compiled_schema is None else compiled_schema["schemaMap"]
+      self._schema_loaded = True
+      self._timed("schema", start)
+    return self._schema_map, None
+
+  def get_secure_client(self):
+    """ Returns the auto-encrypting client for the compiled schema, which loads crypt_shared when it is created
+
+    Return
+    -----------
+      client: mongo.MongoClient
+        Auto-encrypting MongoDB client instance
+      err: error
+        Error message or None of successful
+    """
+
+    _, err = self.get_client()
+    if err is not None:
+      return None, err
+    schema_map, err = self.get_schema_map()
+    if err is not None:
+      return None, err
+    start = perf_counter()
+    secure_client, err = self._clients.get_secure_client(schema_map)
+    if err is None and "crypt_shared" not in self.startup:
+      self._timed("crypt_shared", start)
+    return secure_client, err
+
+  def warm(self, warm_queries=None):
+    """ Pays every start-up cost now instead of on the first operation
+
+    The ClientEncryption and the auto-encrypting client each keep their own libmongocrypt DEK
+    cache. The hot DEKs are decrypted into the ClientEncryption's, for explicit encryption and
+    decryption. The auto-encrypting client's is only filled by `warm_queries`, as it fetches
+    and decrypts a DEK when an operation first needs it.
+
+    Parameters
+    -----------
+      warm_queries: dict
+        Namespace to filter, e.g. {"companyData.employee": {"name.firstName": ""}}. Each filter
+        is run once through the auto-encrypting client so that its DEK cache holds the DEKs
+        the filter is encrypted with
+    Return
+    -----------
+      err: error
+        Error message or None of successful
+    """
+
+    client_encryption, err = self.get_client_encryption()
+    if err is not None:
+      return err
+    secure_client, err = self.get_secure_client()
+    if err is not None:
+      return err
+
+    # Fetching a DEK only reads the key vault, encrypting with it also has the KMS decrypt it,
+    # after which the ClientEncryption keeps the plaintext DEK cached
+    from pymongo.encryption import Algorithm
+    from pymongo.errors import EncryptionError, PyMongoError
+    start = perf_counter()
+    for altName in self.hot_key_alt_names:
+      try:
+        if client_encryption.get_key_by_alt_name(altName) is None:
+          return f"Hot DEK {altName} missing"
+        client_encryption.encrypt("warm", Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, key_alt_name=altName)
+      except EncryptionError as e:
+        return f"Cannot decrypt hot DEK {altName}: {e}"
+      except PyMongoError as e:
+        return f"Cannot read hot DEK {altName}: {e}"
+    self._timed("explicit_keys", start)
+
+    # The auto-encrypting client encrypts each filter, so it fetches and decrypts the DEKs too
+    start = perf_counter()
+    for namespace, query in (warm_queries or {}).items():
+      db_name, coll_name = namespace.split(".", 1)
+      try:
+        secure_client[db_name][coll_name].find_one(query)
+      except PyMongoError as e:
+        return f"Cannot warm {namespace}: {e}"
+    self._timed("auto_keys", start)
+    return None
+
+  def record_startup_metrics(self):
+    """ Records the start-up times as the `csfle_startup_seconds` gauge of `METRICS` """
+
+    from csfle_common.metrics import METRICS
+    for phase, seconds in self.startup.items():
+      METRICS.set("csfle_startup_seconds", {"phase": phase}, seconds)
+    METRICS.set("csfle_startup_seconds", {"phase": "total"}, perf_counter() - PROCESS_START)
+
+  def close(self):
+    """ Closes every client created by this instance """
+
+    if self._clients is not None:
+      self._clients.close()
+    self._clients = None
+
+def main():
+
+  parser = ArgumentParser(description="Start a worker that connects lazily, optionally warming everything up front")
+  parser.add_argument("--warm", action="store_true", help="load crypt_shared, open the pools, decrypt the hot DEKs and run a warm-up query before the first operation")
+  parser.add_argument("--hot-key", action="append", default=None, help="keyAltName of a DEK to warm, may be repeated (default dataKey1)")
+  parser.add_argument("--employee-id", default="00001", help="employee to read as the first operation")
+  args = parser.parse_args()
+
+  # Obviously this should not be hardcoded
+  connection_string = "mongodb://%s:%s@csfle-mongodb-%s.mdbtraining.net/?serverSelectionTimeoutMS=5000&tls=true&tlsCAFile=%s" % (
+    quote_plus(APP_USER),
+    quote_plus(MDB_PASSWORD),
+    PETNAME,
+    quote_plus(CA_PATH)
+  )
+
+  # Declare or key vault namespce
+  keyvault_db = "__encryption"
+  keyvault_coll = "__keyVault"
+  keyvault_namespace = f"{keyvault_db}.{keyvault_coll}"
+
+  # declare our key provider type
+  provider = "kmip"
+
+  # declare our key provider attributes
+  kms_provider = {
+    provider: {
+      "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"
+    }
+  }
+
+  # declare our database and collection
+  encrypted_db_name = "companyData"
+  encrypted_coll_name = "employee"
+
+  worker = FastStart(
+    connection_string,
+    kms_provider,
+    keyvault_namespace,
+    {
+      "kmip": {
+        "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+        "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+      }
+    },
+    hot_key_alt_names = args.hot_key or ["dataKey1"]
+  )
+
+  # nothing has been imported, read or connected yet: --warm does it all now, otherwise the first operation does
+  if args.warm:
+    err = worker.warm({f"{encrypted_db_name}.{encrypted_coll_name}": {"name.firstName": ""}})
+    if err is not None:
+      print(err)
+      sys.exit(1)
+  print(f"Ready after {perf_counter() - PROCESS_START:.3f}s")
+
+  # the first operation pays for whatever was not warmed
+  start = perf_counter()
+  secure_client, err = worker.get_secure_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  from csfle_common.metrics import InstrumentedCollection, dump_metrics
+  from pymongo.errors import EncryptionError
+  try:
+    result = InstrumentedCollection(secure_client[encrypted_db_name][encrypted_coll_name]).find_one({"_id": args.employee_id})
+  except EncryptionError as e:
+    print(f"Encryption error: {e}")
+    sys.exit(1)
+  print(f"First operation took {perf_counter() - start:.3f}s, found {'no' if result is None else 'the'} employee")
+
+  worker.record_startup_metrics()
+  dump_metrics()
+  worker.close()
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
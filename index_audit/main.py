@@ -0,0 +1,93 @@
+from argparse import ArgumentParser
+from pymongo.errors import EncryptionError
+from urllib.parse import quote_plus
+import os
+import sys
+
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import get_client_manager
+from csfle_common.indexes import required_indexes, ensure_indexes, audit_queries, lookup_queries
+
+
+# IN VALUES HERE!
+PETNAME = 
+MDB_PASSWORD = 
+APP_USER = "app_user"
+CA_PATH = "/etc/pki/tls/certs/ca.cert"
+
+def main():
+
+  parser = ArgumentParser(description="Create the key vault and employee indexes and check that the lookups use them")
+  parser.add_argument("--check-only", action="store_true", help="report missing indexes instead of creating them")
+  args = parser.parse_args()
+
+  # Obviously this should not be hardcoded
+  connection_string = "mongodb://%s:%s@csfle-mongodb-%s.mdbtraining.net/?serverSelectionTimeoutMS=5000&tls=true&tlsCAFile=%s" % (
+    quote_plus(APP_USER),
+    quote_plus(MDB_PASSWORD),
+    PETNAME,
+    quote_plus(CA_PATH)
+  )
+
+  # Declare or key vault namespce
+  keyvault_db = "__encryption"
+  keyvault_coll = "__keyVault"
+  keyvault_namespace = f"{keyvault_db}.{keyvault_coll}"
+
+  # declare our key provider type
+  provider = "kmip"
+
+  # declare our key provider attributes
+  kms_provider = {
+    provider: {
+      "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"
+    }
+  }
+
+  # declare our database and collection
+  encrypted_db_name = "companyData"
+  encrypted_coll_name = "employee"
+
+  # all clients for this configuration are created once and shared
+  clients = get_client_manager(connection_string, kms_provider, keyvault_namespace, {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  })
+  client, err = clients.get_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  client_encryption, err = clients.get_client_encryption()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  missing, err = ensure_indexes(client, required_indexes(keyvault_db, keyvault_coll, encrypted_db_name, encrypted_coll_name), create=not args.check_only)
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  for index in missing:
+    print(f"{'Missing' if args.check_only else 'Created'} index on {index}")
+
+  try:
+    queries = lookup_queries(client, client_encryption, keyvault_db, keyvault_coll, encrypted_db_name, encrypted_coll_name)
+  except EncryptionError as e:
+    print(f"Encryption error: {e}")
+    sys.exit(1)
+  collscans, err = audit_queries(queries)
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  for description in collscans:
+    print(f"COLLSCAN: {description}")
+
+  if collscans or (args.check_only and missing):
+    sys.exit(1)
+  print("All lookups use an index")
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
@@ -0,0 +1,270 @@
+from argparse import ArgumentParser
+from bson import json_util
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from math import ceil
+from pymongo.errors import EncryptionError, PyMongoError
+from time import perf_counter
+from urllib.parse import quote_plus
+import os
+import sys
+
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import get_client_manager
+from csfle_common.jobs import RateLimiter, save_checkpoint
+
+
+# IN VALUES HERE!
+PETNAME = 
+MDB_PASSWORD = 
+APP_USER = "app_user"
+CA_PATH = "/etc/pki/tls/certs/ca.cert"
+
+def split_key_ranges(key_vault, key_filter, chunk_size):
+  """ Splits the DEKs matching a filter into `_id` ranges of roughly `chunk_size` keys
+
+  Parameters
+  -----------
+    key_vault: mongo.Collection
+      The key vault collection
+    key_filter: dict
+      Selects the DEKs to rotate
+    chunk_size: int
+      Wanted number of DEKs per range
+  Return
+  -----------
+    ranges: list
+      (min, max, is_last, count) tuples, each range includes `min` and excludes `max` except the last
+  """
+
+  total = key_vault.count_documents(key_filter)
+  if total == 0:
+    return []
+  buckets = list(key_vault.aggregate([
+    {"$match": key_filter},
+    {"$project": {"_id": 1}},
+    {"$bucketAuto": {"groupBy": "$_id", "buckets": ceil(total / chunk_size)}}
+  ], allowDiskUse=True))
+  return [(b["_id"]["min"], b["_id"]["max"], i == len(buckets) - 1, b["count"]) for i, b in enumerate(buckets)]
+
+def range_filter(key_filter, id_range, master_key):
+  """ Returns the filter for the DEKs of one range that are not wrapped by `master_key` yet
+
+  Skipping DEKs already on the new CMK means a range that was interrupted half way only
+  rewraps what is left when it is run again.
+
+  Parameters
+  -----------
+    key_filter: dict
+      Selects the DEKs to rotate
+    id_range: tuple
+      (min, max, is_last, count) from `split_key_ranges`
+    master_key: dict
+      The new CMK, or None to rewrap with the current CMK
+  Return
+  -----------
+    filter: dict
+      The filter to pass to `rewrap_many_data_key`
+  """
+
+  low, high, is_last, _ = id_range
+  clauses = [key_filter, {"_id": {"$gte": low, "$lte" if is_last else "$lt": high}}]
+  if master_key and "keyId" in master_key:
+    clauses.append({"masterKey.keyId": {"$ne": master_key["keyId"]}})
+  return {"$and": clauses}
+
+def rewrap_range(client_encryption, key_filter, id_range, provider_name, master_key, limiter):
+  """ Rewraps the DEKs of one `_id` range with the new CMK
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      An instantiated ClientEncryption instance that has access to the key vault
+    key_filter: dict
+      Selects the DEKs to rotate
+    id_range: tuple
+      (min, max, is_last, count) from `split_key_ranges`
+    provider_name: string
+      The name of the new key provider, or None to keep the current one
+    master_key: dict
+      The new CMK, or None to rewrap with the current CMK
+    limiter: RateLimiter
+      Paces the KMS requests, one unit per DEK
+  Return
+  -----------
+    rewrapped: int
+      Number of DEKs rewrapped
+    err: error
+      Error message or None of successful
+  """
+
+  limiter.acquire(id_range[3])
+  try:
+    result = client_encryption.rewrap_many_data_key(range_filter(key_filter, id_range, master_key), provider=provider_name, master_key=master_key)
+    if result.bulk_write_result is None:
+      return 0, None
+    return result.bulk_write_result.modified_count, None
+  except (EncryptionError, PyMongoError) as e:
+    return 0, f"Cannot rewrap keys {id_range[0]}..{id_range[1]}: {e}"
+
+def rotate(client_encryption, key_vault, key_filter, provider_name, master_key, checkpoint_path, chunk_size=1000, concurrency=8, max_keys_per_sec=None, resume=False, report=print):
+  """ Rewraps every DEK matching a filter, several `_id` ranges at a time
+
+  The ranges and the ones already done are kept in a checkpoint file, so an interrupted
+  rotation continues where it stopped when run again with `resume`.
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      An instantiated ClientEncryption instance that has access to the key vault
+    key_vault: mongo.Collection
+      The key vault collection
+    key_filter: dict
+      Selects the DEKs to rotate
+    provider_name: string
+      The name of the new key provider, or None to keep the current one
+    master_key: dict
+      The new CMK, or None to rewrap with the current CMK
+    checkpoint_path: string
+      Path of the checkpoint file
+    chunk_size: int
+      Wanted number of DEKs per range
+    concurrency: int
+      Maximum number of ranges being rewrapped at once
+    max_keys_per_sec: float
+      Limit on the DEKs rewrapped per second, to stay under the KMS quota, or None
+    resume: bool
+      Continue from an existing checkpoint file
+    report: function
+      Called with a progress message after every range and for every failure
+  Return
+  -----------
+    summary: dict
+      Number of DEKs rewrapped, ranges done and failed, and DEKs rewrapped per second
+  """
+
+  if resume and os.path.exists(checkpoint_path):
+    with open(checkpoint_path) as f:
+      checkpoint = json_util.loads(f.read())
+    if checkpoint["filter"] != key_filter or checkpoint["masterKey"] != master_key:
+      raise ValueError(f"{checkpoint_path} belongs to a rotation with a different filter or CMK")
+  else:
+    checkpoint = {
+      "filter": key_filter,
+      "masterKey": master_key,
+      "ranges": split_key_ranges(key_vault, key_filter, chunk_size),
+      "done": []
+    }
+    save_checkpoint(checkpoint_path, checkpoint)
+
+  done = set(checkpoint["done"])
+  todo = [i for i in range(len(checkpoint["ranges"])) if i not in done]
+  report(f"{len(done)} of {len(checkpoint['ranges'])} ranges already rotated")
+
+  summary = {"rewrapped": 0, "ranges": 0, "failed": 0}
+  limiter = RateLimiter(max_keys_per_sec)
+  start = perf_counter()
+  with ThreadPoolExecutor(max_workers=concurrency) as executor:
+    futures = {
+      executor.submit(rewrap_range, client_encryption, key_filter, tuple(checkpoint["ranges"][i]), provider_name, master_key, limiter): i
+      for i in todo
+    }
+    for future in as_completed(futures):
+      rewrapped, err = future.result()
+      summary["rewrapped"] += rewrapped
+      if err is not None:
+        summary["failed"] += 1
+        report(err)
+        continue
+      summary["ranges"] += 1
+      checkpoint["done"].append(futures[future])
+      save_checkpoint(checkpoint_path, checkpoint)
+      elapsed = perf_counter() - start
+      report(f"[{len(checkpoint['done'])}/{len(checkpoint['ranges'])}] {summary['rewrapped']} keys rewrapped, "
+             f"{summary['rewrapped'] / elapsed:.1f} keys/s")
+
+  elapsed = perf_counter() - start
+  summary["keys_per_sec"] = summary["rewrapped"] / elapsed if elapsed > 0 else 0.0
+  return summary
+
+def main():
+
+  parser = ArgumentParser(description="Rewrap DEKs with a new CMK in resumable, concurrent chunks")
+  parser.add_argument("--filter", default="{}", help="extended JSON filter selecting the DEKs to rotate, e.g. '{\"masterKey.keyId\": \"1\"}'")
+  parser.add_argument("--new-key-id", help="keyId of the new KMIP CMK, omit to rewrap with the current CMK")
+  parser.add_argument("--checkpoint", default="rotation.checkpoint.json", help="checkpoint file")
+  parser.add_argument("--resume", action="store_true", help="continue the rotation recorded in --checkpoint")
+  parser.add_argument("--chunk-size", type=int, default=1000, help="DEKs per chunk")
+  parser.add_argument("--concurrency", type=int, default=8, help="chunks rewrapped at once")
+  parser.add_argument("--max-keys-per-sec", type=float, help="limit on DEKs rewrapped per second")
+  args = parser.parse_args()
+
+  # Obviously this should not be hardcoded
+  connection_string = "mongodb://%s:%s@csfle-mongodb-%s.mdbtraining.net/?serverSelectionTimeoutMS=5000&tls=true&tlsCAFile=%s" % (
+    quote_plus(APP_USER),
+    quote_plus(MDB_PASSWORD),
+    PETNAME,
+    quote_plus(CA_PATH)
+  )
+
+  # Declare or key vault namespce
+  keyvault_db = "__encryption"
+  keyvault_coll = "__keyVault"
+  keyvault_namespace = f"{keyvault_db}.{keyvault_coll}"
+
+  # declare our key provider type
+  provider = "kmip"
+
+  # declare our key provider attributes
+  kms_provider = {
+    provider: {
+      "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"
+    }
+  }
+
+  # all clients for this configuration are created once and shared, with enough connections for every worker
+  clients = get_client_manager(f"{connection_string}&maxPoolSize={max(100, args.concurrency * 2)}", kms_provider, keyvault_namespace, {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  })
+  client, err = clients.get_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  client_encryption, err = clients.get_client_encryption()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  master_key = None
+  if args.new_key_id is not None:
+    master_key = {"keyId": args.new_key_id, "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"}
+
+  try:
+    summary = rotate(
+      client_encryption,
+      client[keyvault_db][keyvault_coll],
+      json_util.loads(args.filter),
+      provider if master_key is not None else None,
+      master_key,
+      args.checkpoint,
+      args.chunk_size,
+      args.concurrency,
+      args.max_keys_per_sec,
+      args.resume
+    )
+  except ValueError as e:
+    print(e)
+    sys.exit(1)
+
+  print(f"Rewrapped {summary['rewrapped']} DEKs in {summary['ranges']} chunks ({summary['failed']} failed) "
+        f"at {summary['keys_per_sec']:.1f} keys/s")
+  if summary["failed"]:
+    print("Rerun with --resume to retry the failed chunks")
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
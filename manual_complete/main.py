@@ -1,13 +1,19 @@
-from bson.binary import STANDARD, Binary
-from bson.codec_options import CodecOptions
 from datetime import datetime
-from pymongo import MongoClient
-from pymongo.encryption import Algorithm
-from pymongo.encryption import ClientEncryption
-from pymongo.errors import EncryptionError, ServerSelectionTimeoutError, ConnectionFailure
+from pymongo import monitoring
+from pymongo.errors import EncryptionError
 from urllib.parse import quote_plus
+import os
 import sys
 
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import get_client_manager
+from csfle_common.decryption import compile_decryption_plan, parallel_traverse_bson, decrypt_cursor
+from csfle_common.encryption import compile_encryption_plan, encrypt_fields, encrypt_query
+from csfle_common.lookup import batch_lookup
+from csfle_common.metrics import METRICS, CommandMetricsListener, InstrumentedClientEncryption, InstrumentedCollection, dump_metrics
+
 
 # IN VALUES HERE!
 PETNAME = 
@@ -15,84 +21,6 @@ MDB_PASSWORD =
 APP_USER = "app_user"
 CA_PATH = "/etc/pki/tls/certs/ca.cert"
 
-def mdb_client(connection_string, auto_encryption_opts=None):
-  """ Returns a MongoDB client instance
-  
-  Creates a  MongoDB client instance and tests the client via a `hello` to the server
-  
-  Parameters
-  ------------
-    connection_string: string
-      MongoDB connection string URI containing username, password, host, port, tls, etc
-  Return
-  ------------
-    client: mongo.MongoClient
-      MongoDB client instance
-    err: error
-      Error message or None of successful
-  """
-
-  try:
-    client = MongoClient(connection_string)
-    client.admin.command('hello')
-    return client, None
-  except (ServerSelectionTimeoutError, ConnectionFailure) as e:
-    return None, f"Cannot connect to database, please check settings in config file: {e}"
-
-def decrypt_data(client_encryption, data):
-  """ Returns a decrypted value if the input is encrypted, or returns the input value
-
-  Tests the input value to determine if it is a BSON binary subtype 6 (aka encrypted data).
-  If true, the value is decrypted. If false the input value is returned
-
-  Parameters
-  -----------
-    client_encryption: mongo.ClientEncryption
-      Instantiated mongo.ClientEncryption instancesection
-    data: value
-      A value to be tested, and decrypted if required
-  Return
-  -----------
-    data/unencrypted_data: value
-      unencrypted or input value
-  """
-
-  try:
-    if type(data) == Binary and data.subtype == 6:
-
-      decrypted_data = client_encryption.decrypt(data)
-
-      return decrypted_data
-    else:
-      return data
-  except EncryptionError as e:
-    raise e
-
-def traverse_bson(client_encryption, data):
-  """ Iterates over a object/value and determines if the value is a scalar or document
-  
-  Tests the input value is a list or dictionary, if not calls the `decrypt_data` function, if
-  true it calls itself with the value as the input. 
-
-  Parameters
-  -----------
-    client_encryption: mongo.ClientEncryption
-      Instantiated mongo.ClientEncryption instance
-    data: value
-      A value to be tested, and decrypted if required
-  Return
-  -----------
-    data/unencrypted_data: value
-      unencrypted or input value
-  """
-  
-  if isinstance(data, list):
-    return [traverse_bson(client_encryption, v) for v in data]
-  elif isinstance(data, dict):
-    return {k: traverse_bson(client_encryption, v) for k, v in data.items()}
-  else:
-    return decrypt_data(client_encryption, data)
-
 def main():
 
   # Obviously this should not be hardcoded
@@ -122,26 +50,30 @@ def main():
   encrypted_db_name = "companyData"
   encrypted_coll_name = "employee"
 
+  # record every command, split into key vault and data traffic, for all clients created below
+  monitoring.register(CommandMetricsListener(METRICS, keyvault_db))
+
+  # all clients for this configuration are created once and shared
+  clients = get_client_manager(connection_string, kms_provider, keyvault_namespace, {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  })
+
   # instantiate our MongoDB Client object
-  client, err = mdb_client(connection_string)
+  client, err = clients.get_client()
   if err is not None:
     print(err)
     sys.exit(1)
 
 
   # Instantiate our ClientEncryption object
-  client_encryption = ClientEncryption(
-    kms_provider,
-    keyvault_namespace,
-    client,
-    CodecOptions(uuid_representation=STANDARD),
-    kms_tls_options = {
-      "kmip": {
-        "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
-        "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
-      }
-    }
-  )
+  client_encryption, err = clients.get_client_encryption()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  client_encryption = InstrumentedClientEncryption(client_encryption)
 
   payload = {
     "name": {
@@ -173,30 +105,68 @@ def main():
       print("Failed to find DEK")
       sys.exit()
 
-    # Do deterministic fields
-    payload["name"]["firstName"] = client_encryption.encrypt(payload["name"]["firstName"], Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, data_key_id_1)
-    payload["name"]["lastName"] = client_encryption.encrypt(payload["name"]["lastName"], Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, data_key_id_1)
-
-    # Do random fields
-    if payload["name"]["otherNames"] is None:
-      del(payload["name"]["otherNames"])
-    else:
-      payload["name"]["otherNames"] = client_encryption.encrypt(payload["name"]["otherNames"], Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Random, data_key_id_1)
-    payload["address"] = client_encryption.encrypt(payload["address"], Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Random, data_key_id_1)
-    payload["dob"] = client_encryption.encrypt(payload["dob"], Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Random, data_key_id_1)
-    payload["phoneNumber"] = client_encryption.encrypt(payload["phoneNumber"], Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Random, data_key_id_1)
-    payload["salary"] = client_encryption.encrypt(payload["salary"], Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Random, data_key_id_1)
-    payload["taxIdentifier"] = client_encryption.encrypt(payload["taxIdentifier"], Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Random, data_key_id_1)
-
-    # Test if the data is encrypted
-    for data in [ payload["name"]["firstName"], payload["name"]["lastName"], payload["address"], payload["dob"], payload["phoneNumber"], payload["salary"], payload["taxIdentifier"]]:
-      if type(data) is not Binary or data.subtype != 6:
-        print("Data is not encrypted")
-        sys.exit()
-
-    if "otherNames" in payload["name"] and payload["name"]["otherNames"] is None:
-      print("None cannot be encrypted")
-      sys.exit(-1)
+    schema_map = {
+      "companyData.employee": {
+        "bsonType": "object",
+        "encryptMetadata": {
+          "keyId": [data_key_id_1],
+          "algorithm": "AEAD_AES_256_CBC_HMAC_SHA_512-Random"
+        },
+        "properties": {
+          "name": {
+            "bsonType": "object",
+            "properties": {
+              "firstName": {
+                "encrypt" : {
+                  "bsonType": "string",
+                  "algorithm": "AEAD_AES_256_CBC_HMAC_SHA_512-Deterministic"
+                }
+              },
+              "lastName": {
+                "encrypt" : {
+                  "bsonType": "string",
+                  "algorithm": "AEAD_AES_256_CBC_HMAC_SHA_512-Deterministic"
+                }
+              },
+              "otherNames": {
+                "encrypt" : {
+                  "bsonType": "string"
+                }
+              }
+            }
+          },
+          "address": {
+            "encrypt": {
+              "bsonType": "object"
+            }
+          },
+          "dob": {
+            "encrypt": {
+              "bsonType": "date"
+            }
+          },
+          "phoneNumber": {
+            "encrypt": {
+              "bsonType": "string"
+            }
+          },
+          "salary": {
+            "encrypt": {
+              "bsonType": "double"
+            }
+          },
+          "taxIdentifier": {
+            "encrypt": {
+              "bsonType": "string"
+            }
+          }
+        }
+      }
+    }
+
+    # Compile the schema map once, then encrypt every configured field of the payload in one call
+    encryption_plan = compile_encryption_plan(schema_map, f"{encrypted_db_name}.{encrypted_coll_name}")
+    encrypt_fields(client_encryption, encryption_plan, payload)
 
     result = client[encrypted_db_name][encrypted_coll_name].insert_one(payload)
 
@@ -209,18 +179,49 @@ def main():
 
   try:
 
-    encrypted_name = client_encryption.encrypt("Kuber", Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, data_key_id_1)
-    encrypted_doc = client[encrypted_db_name][encrypted_coll_name].find_one({"name.firstName": encrypted_name})
+    # The schema map tells which query values to encrypt, so the plain client can query encrypted fields
+    query = encrypt_query(client_encryption, {"name.firstName": "Kuber"}, encryption_plan)
+    encrypted_doc = client[encrypted_db_name][encrypted_coll_name].find_one(query)
     print(encrypted_doc)
 
-    decrypted_doc = traverse_bson(client_encryption, encrypted_doc)
+    # Only visit the fields the schema map says can be encrypted
+    decryption_plan = compile_decryption_plan(schema_map, f"{encrypted_db_name}.{encrypted_coll_name}")
+    decrypted_doc = parallel_traverse_bson(client_encryption, encrypted_doc, plan=decryption_plan)
+    print(decrypted_doc)
+
+    # Stream every matching employee, decrypting one batch while the next is fetched
+    cursor = client[encrypted_db_name][encrypted_coll_name].find(query).batch_size(100)
+    for decrypted_doc in decrypt_cursor(client_encryption, cursor, batch_size=100, plan=decryption_plan):
+      print(decrypted_doc)
+
+    # Resolve many employees at once: a few $in queries instead of one find_one per name
+    wanted = [
+      {"name.firstName": "Kuber", "name.lastName": "Engineer"},
+      {"name.firstName": "Poorna", "name.lastName": "Muggle"}
+    ]
+    for key, docs in batch_lookup(client_encryption, client[encrypted_db_name][encrypted_coll_name], encryption_plan, wanted, decryption_plan=decryption_plan):
+      print(key, docs)
+
+    # Read-path profile: the query is encrypted here and the results are decrypted by the driver,
+    # so no query analysis runs on the read path
+    decrypting_client, err = clients.get_decrypting_client()
+    if err is not None:
+      print(err)
+      sys.exit(1)
+    query = encrypt_query(client_encryption, {"name.firstName": "Kuber", "name.lastName": {"$in": ["Engineer"]}}, encryption_plan)
+    decrypted_doc = InstrumentedCollection(decrypting_client[encrypted_db_name][encrypted_coll_name]).find_one(query)
     print(decrypted_doc)
 
+    # the driver must have decrypted the result, a plain client would hand back the ciphertext
+    if decrypted_doc is None or decrypted_doc["name"]["firstName"] != "Kuber":
+      print("Decrypting client did not return the decrypted employee")
+      sys.exit(1)
+
   except EncryptionError as e:
     print(f"Encryption error: {e}")
     sys.exit()
 
-
+  dump_metrics()
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
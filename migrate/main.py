@@ -0,0 +1,236 @@
+from argparse import ArgumentParser
+from bson import json_util
+from itertools import islice
+from multiprocessing import get_context
+from pymongo.errors import BulkWriteError, EncryptionError, PyMongoError
+from time import perf_counter
+from urllib.parse import quote_plus
+import os
+import sys
+
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import get_client_manager, close_client_managers
+from csfle_common.encryption import compile_encryption_plan, encrypt_fields
+from csfle_common.jobs import RateLimiter, split_id_ranges, id_range_filter, read_checkpoint, save_checkpoint
+from csfle_common.schema import SCHEMA_SOURCE, SCHEMA_CACHE_DIR, load_compiled_schema
+
+# IN VALUES HERE!
+PETNAME = 
+MDB_PASSWORD = 
+APP_USER = "app_user"
+CA_PATH = "/etc/pki/tls/certs/ca.cert"
+
+def migrate_range(task):
+  """ Encrypts one `_id` range of the plaintext collection into the target, in a worker process
+
+  Reads the range in `_id` order, encrypts each batch with the schema-driven `encrypt_fields`
+  and writes it with one unordered `insert_many`. The last `_id` written is checkpointed after
+  every batch, so a resumed range starts right after it; the range only holds `_id`s of one
+  BSON type, so resuming after it skips no document of another type. Documents of a batch that was written
+  but not checkpointed are already in the target, so their duplicate key errors are ignored.
+
+  Parameters
+  -----------
+    task: dict
+      The range, checkpoint path, encryption plan and connection settings, see `main`
+  Return
+  -----------
+    part: int
+      The range number
+    migrated: int
+      Number of documents migrated in this run
+    err: error
+      Error message or None of successful
+  """
+
+  manager = get_client_manager(task["connection_string"], task["kms_provider"], task["keyvault_namespace"], task["kms_tls_options"])
+  client, err = manager.get_client()
+  if err is not None:
+    return task["part"], 0, err
+  client_encryption, err = manager.get_client_encryption()
+  if err is not None:
+    return task["part"], 0, err
+
+  source = client[task["source_db"]][task["source_coll"]]
+  target = client[task["target_db"]][task["target_coll"]]
+  limiter = RateLimiter(task["max_docs_per_sec"])
+
+  checkpoint = read_checkpoint(task["checkpoint"]) or {"lastId": None, "migrated": 0, "done": False}
+
+  migrated = 0
+  try:
+    cursor = source.find(id_range_filter(task["range"], checkpoint["lastId"])).sort("_id", 1).batch_size(task["batch_size"])
+    while True:
+      batch = list(islice(cursor, task["batch_size"]))
+      if not batch:
+        break
+      limiter.acquire(len(batch))
+      encrypt_fields(client_encryption, task["plan"], batch)
+      try:
+        target.insert_many(batch, ordered=False)
+      except BulkWriteError as e:
+        if e.details.get("writeConcernErrors") or any(error["code"] != 11000 for error in e.details["writeErrors"]):
+          raise
+      migrated += len(batch)
+      checkpoint["lastId"] = batch[-1]["_id"]
+      checkpoint["migrated"] += len(batch)
+      save_checkpoint(task["checkpoint"], checkpoint)
+    checkpoint["done"] = True
+    save_checkpoint(task["checkpoint"], checkpoint)
+  except (EncryptionError, PyMongoError, OSError) as e:
+    return task["part"], migrated, f"Range {task['part']} failed after {checkpoint['lastId']}: {e}"
+  return task["part"], migrated, None
+
+def main():
+
+  parser = ArgumentParser(description="Migrate a plaintext employee collection into the encrypted one using several processes")
+  parser.add_argument("--source", required=True, help="plaintext namespace, db.collection")
+  parser.add_argument("--target", default="companyData.employee", help="encrypted namespace, db.collection")
+  parser.add_argument("--state-dir", required=True, help="directory for the manifest and checkpoints")
+  parser.add_argument("--processes", type=int, default=os.cpu_count(), help="number of worker processes")
+  parser.add_argument("--partitions", type=int, help="number of _id ranges, default 4 per process")
+  parser.add_argument("--batch-size", type=int, default=1000, help="documents per insert_many")
+  parser.add_argument("--max-docs-per-sec", type=float, help="limit on documents migrated per second, across all processes")
+  parser.add_argument("--resume", action="store_true", help="continue an interrupted migration in --state-dir")
+  args = parser.parse_args()
+
+  # Obviously this should not be hardcoded
+  connection_string = "mongodb://%s:%s@csfle-mongodb-%s.mdbtraining.net/?serverSelectionTimeoutMS=5000&tls=true&tlsCAFile=%s" % (
+    quote_plus(APP_USER),
+    quote_plus(MDB_PASSWORD),
+    PETNAME,
+    quote_plus(CA_PATH)
+  )
+
+  # Declare or key vault namespce
+  keyvault_db = "__encryption"
+  keyvault_coll = "__keyVault"
+  keyvault_namespace = f"{keyvault_db}.{keyvault_coll}"
+
+  # declare our key provider type
+  provider = "kmip"
+
+  # declare our key provider attributes
+  kms_provider = {
+    provider: {
+      "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"
+    }
+  }
+  kms_tls_options = {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  }
+
+  source_db, source_coll = args.source.split(".", 1)
+  target_db, target_coll = args.target.split(".", 1)
+
+  manager = get_client_manager(connection_string, kms_provider, keyvault_namespace, kms_tls_options)
+  client, err = manager.get_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  # The employee schema compiled by schema_compiler/main.py; it encrypts all but the names with
+  # the DEK named by each `_id`, so those DEKs must exist (see bulk_dek_create/main.py)
+  client_encryption, err = manager.get_client_encryption()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  compiled_schema, err = load_compiled_schema(SCHEMA_SOURCE, SCHEMA_CACHE_DIR, keyvault_namespace, client_encryption, verify=True)
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  if compiled_schema is None:
+    print(f"Compile {SCHEMA_SOURCE} with schema_compiler/main.py first")
+    sys.exit(1)
+  plan = compile_encryption_plan(compiled_schema["schemaMap"], compiled_schema["namespace"])
+
+  # The manifest records the ranges, so a resumed migration uses exactly the same split
+  os.makedirs(args.state_dir, exist_ok=True)
+  manifest_path = os.path.join(args.state_dir, "manifest.json")
+  if args.resume:
+    if not os.path.exists(manifest_path):
+      print(f"No migration to resume in {args.state_dir}")
+      sys.exit(1)
+    with open(manifest_path) as f:
+      manifest = json_util.loads(f.read())
+    if manifest["source"] != args.source or manifest["target"] != args.target:
+      print(f"{manifest_path} belongs to a migration from {manifest['source']} to {manifest['target']}")
+      sys.exit(1)
+  else:
+    # checkpoints of an earlier run refer to that run's ranges, which the new split does not match
+    for name in os.listdir(args.state_dir):
+      if name.startswith("part-") and (name.endswith(".checkpoint") or name.endswith(".checkpoint.tmp")):
+        os.remove(os.path.join(args.state_dir, name))
+    ranges = split_id_ranges(client[source_db][source_coll], args.partitions or args.processes * 4)
+    manifest = {"source": args.source, "target": args.target, "ranges": ranges}
+    save_checkpoint(manifest_path, manifest)
+  close_client_managers()
+
+  tasks = []
+  checkpoints = []
+  for part, id_range in enumerate(manifest["ranges"]):
+    checkpoint_path = os.path.join(args.state_dir, f"part-{part:05d}.checkpoint")
+    checkpoints.append(checkpoint_path)
+    checkpoint = read_checkpoint(checkpoint_path)
+    if checkpoint is not None and checkpoint["done"]:
+      continue
+    tasks.append({
+      "part": part,
+      "range": tuple(id_range),
+      "checkpoint": checkpoint_path,
+      "source_db": source_db,
+      "source_coll": source_coll,
+      "target_db": target_db,
+      "target_coll": target_coll,
+      "plan": plan,
+      "batch_size": args.batch_size,
+      "max_docs_per_sec": args.max_docs_per_sec / args.processes if args.max_docs_per_sec else None,
+      "connection_string": connection_string,
+      "kms_provider": kms_provider,
+      "keyvault_namespace": keyvault_namespace,
+      "kms_tls_options": kms_tls_options
+    })
+  print(f"{len(manifest['ranges']) - len(tasks)} of {len(manifest['ranges'])} ranges already migrated")
+
+  # spawn rather than fork, so no worker inherits the parent's MongoDB sockets
+  failed = 0
+  migrated = 0
+  start = perf_counter()
+  with get_context("spawn").Pool(args.processes) as pool:
+    for done, (part, count, err) in enumerate(pool.imap_unordered(migrate_range, tasks), 1):
+      migrated += count
+      if err is not None:
+        failed += 1
+        print(err)
+      elapsed = perf_counter() - start
+      print(f"[{done}/{len(tasks)}] range {part}: {count} documents, {migrated} total, {migrated / elapsed:.0f} docs/s")
+
+  if failed:
+    print(f"{failed} ranges failed, rerun with --resume to continue them")
+    sys.exit(1)
+
+  # every source document must be in exactly one range, a difference means documents were
+  # missed or the source changed during the migration
+  total = sum(read_checkpoint(path)["migrated"] for path in checkpoints)
+  client, err = get_client_manager(connection_string, kms_provider, keyvault_namespace, kms_tls_options).get_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  try:
+    expected = client[source_db][source_coll].count_documents({})
+  except PyMongoError as e:
+    print(f"Cannot count {args.source}: {e}")
+    sys.exit(1)
+  close_client_managers()
+  if total != expected:
+    print(f"Migrated {total} documents but {args.source} holds {expected}")
+    sys.exit(1)
+  print(f"Migrated all {expected} documents of {args.source}")
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
@@ -0,0 +1,247 @@
+from argparse import ArgumentParser
+from bson.binary import Binary
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pymongo import ReplaceOne
+from pymongo.errors import EncryptionError, PyMongoError
+from time import perf_counter
+from urllib.parse import quote_plus
+import os
+import sys
+
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import get_client_manager
+from csfle_common.encryption import compile_encryption_plan
+from csfle_common.jobs import read_checkpoint, save_checkpoint
+from csfle_common.keys import lookup_dek_id, get_employee_key
+from csfle_common.schema import SCHEMA_SOURCE, SCHEMA_CACHE_DIR, load_compiled_schema
+
+
+# IN VALUES HERE!
+PETNAME = 
+MDB_PASSWORD = 
+APP_USER = "app_user"
+CA_PATH = "/etc/pki/tls/certs/ca.cert"
+
+def ciphertext_key_id(value):
+  """ Returns the UUID bytes of the DEK a ciphertext was encrypted with
+
+  Bytes 1 to 16 of a CSFLE ciphertext (BSON binary subtype 6) hold the DEK's UUID.
+  """
+
+  return bytes(value)[1:17]
+
+def rekey_document(client_encryption, doc, plan, old_key_id, provider_name, master_key):
+  """ Re-encrypts the fields of one document from the shared DEK to the employee's own DEK
+
+  Only fields the plan encrypts with a `keyId` pointer, such as "/_id", are moved, and only
+  while their ciphertext is still under `old_key_id`, so a document is never re-keyed twice.
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      An instantiated ClientEncryption instance that has access to the key vault
+    doc: dict
+      The document as stored, read through a plain client
+    plan: list
+      The encryption plan of the target schema, from `compile_encryption_plan`
+    old_key_id: bytes
+      UUID bytes of the shared DEK, e.g. dataKey1
+    provider_name: string
+      The name of the key provider. "aws", "gcp", "azure", "kmip", or "local"
+    master_key: dict
+      The Customer Master Key (CMK) new DEKs are wrapped with
+  Return
+  -----------
+    doc: dict
+      The re-keyed document
+    original: dict
+      Dotted path to the old ciphertext of every field that was re-keyed, empty if none was
+    err: error
+      Error message or None of successful
+  """
+
+  original = {}
+  for path, name, algorithm, _, key_pointer in plan:
+    if key_pointer is None:
+      continue
+    parent = doc
+    for key in path:
+      parent = parent.get(key)
+      if not isinstance(parent, dict):
+        break
+    else:
+      value = parent.get(name)
+      if not isinstance(value, Binary) or value.subtype != 6 or ciphertext_key_id(value) != old_key_id:
+        continue
+      altName = doc.get(key_pointer)
+      if not isinstance(altName, str):
+        return doc, {}, f"Document {doc['_id']}: {key_pointer} is not a string and cannot name a DEK"
+      _, err = get_employee_key(client_encryption, altName, provider_name, master_key)
+      if err is not None:
+        return doc, {}, f"Document {doc['_id']}: {err}"
+      try:
+        parent[name] = client_encryption.encrypt(client_encryption.decrypt(value), algorithm, key_alt_name=altName)
+      except EncryptionError as e:
+        return doc, {}, f"Document {doc['_id']}: {e}"
+      original[".".join(path + (name,))] = value
+  return doc, original, None
+
+def rekey_batch(client_encryption, collection, docs, plan, old_key_id, provider_name, master_key, executor):
+  """ Re-keys a batch of documents and writes them back with one bulk write
+
+  Each replacement only applies if the re-keyed fields still hold the ciphertexts that were
+  read, so a concurrent update is never overwritten. Documents that changed in between keep
+  their old ciphertexts and are picked up by the next run.
+
+  Parameters
+  -----------
+    client_encryption: mongo.ClientEncryption
+      An instantiated ClientEncryption instance that has access to the key vault
+    collection: mongo.Collection
+      The employee collection, not auto-encrypting
+    docs: list
+      The documents as stored
+    plan: list
+      The encryption plan of the target schema
+    old_key_id: bytes
+      UUID bytes of the shared DEK
+    provider_name: string
+      The name of the key provider
+    master_key: dict
+      The CMK new DEKs are wrapped with
+    executor: concurrent.futures.Executor
+      Runs the per-document work in parallel
+  Return
+  -----------
+    summary: dict
+      Number of documents re-keyed, already re-keyed, changed concurrently and failed
+    errors: list
+      Error messages of the failed documents
+  """
+
+  summary = {"rekeyed": 0, "skipped": 0, "conflicts": 0, "failed": 0}
+  errors = []
+  requests = []
+  for doc, original, err in executor.map(lambda doc: rekey_document(client_encryption, doc, plan, old_key_id, provider_name, master_key), docs):
+    if err is not None:
+      summary["failed"] += 1
+      errors.append(err)
+    elif not original:
+      summary["skipped"] += 1
+    else:
+      requests.append(ReplaceOne({"_id": doc["_id"], **original}, doc))
+  if requests:
+    result = collection.bulk_write(requests, ordered=False)
+    summary["rekeyed"] += result.modified_count
+    summary["conflicts"] += len(requests) - result.matched_count
+  return summary, errors
+
+def main():
+
+  parser = ArgumentParser(description="Re-encrypt employee data from the shared dataKey1 to per-employee DEKs")
+  parser.add_argument("--old-key", default="dataKey1", help="keyAltName of the shared DEK to move away from")
+  parser.add_argument("--checkpoint", default="rekey.checkpoint.json", help="checkpoint file")
+  parser.add_argument("--resume", action="store_true", help="continue after the last _id in --checkpoint")
+  parser.add_argument("--batch-size", type=int, default=500, help="documents per bulk write")
+  parser.add_argument("--concurrency", type=int, default=16, help="documents re-keyed at once")
+  args = parser.parse_args()
+
+  # Obviously this should not be hardcoded
+  connection_string = "mongodb://%s:%s@csfle-mongodb-%s.mdbtraining.net/?serverSelectionTimeoutMS=5000&tls=true&tlsCAFile=%s" % (
+    quote_plus(APP_USER),
+    quote_plus(MDB_PASSWORD),
+    PETNAME,
+    quote_plus(CA_PATH)
+  )
+
+  # Declare or key vault namespce
+  keyvault_db = "__encryption"
+  keyvault_coll = "__keyVault"
+  keyvault_namespace = f"{keyvault_db}.{keyvault_coll}"
+
+  # declare our key provider type
+  provider = "kmip"
+
+  # declare our key provider attributes
+  kms_provider = {
+    provider: {
+      "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"
+    }
+  }
+
+  # the CMK that wraps the employees' new DEKs
+  master_key = {"keyId": "1", "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"}
+
+  # all clients for this configuration are created once and shared, with enough connections for every worker
+  clients = get_client_manager(f"{connection_string}&maxPoolSize={max(100, args.concurrency * 2)}", kms_provider, keyvault_namespace, {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  })
+  client, err = clients.get_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  client_encryption, err = clients.get_client_encryption()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  old_key_id = lookup_dek_id(client_encryption, args.old_key)
+  if old_key_id is None:
+    print(f"No DEK named {args.old_key}")
+    sys.exit(1)
+
+  # The target model is the employee schema compiled by schema_compiler/main.py, where the
+  # "/_id" keyId pointer picks each employee's DEK
+  compiled_schema, err = load_compiled_schema(SCHEMA_SOURCE, SCHEMA_CACHE_DIR, keyvault_namespace, client_encryption, verify=True)
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  if compiled_schema is None:
+    print(f"Compile {SCHEMA_SOURCE} with schema_compiler/main.py first")
+    sys.exit(1)
+  plan = compile_encryption_plan(compiled_schema["schemaMap"], compiled_schema["namespace"])
+  db_name, coll_name = compiled_schema["namespace"].split(".", 1)
+  collection = client[db_name][coll_name]
+
+  checkpoint = read_checkpoint(args.checkpoint) if args.resume else None
+  if checkpoint is None:
+    checkpoint = {"lastId": None, "rekeyed": 0}
+  query = {} if checkpoint["lastId"] is None else {"_id": {"$gt": checkpoint["lastId"]}}
+
+  totals = {"rekeyed": 0, "skipped": 0, "conflicts": 0, "failed": 0}
+  start = perf_counter()
+  try:
+    cursor = collection.find(query).sort("_id", 1).batch_size(args.batch_size)
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+      while True:
+        docs = list(islice(cursor, args.batch_size))
+        if not docs:
+          break
+        summary, errors = rekey_batch(client_encryption, collection, docs, plan, bytes(old_key_id), provider, master_key, executor)
+        for err in errors:
+          print(err)
+        for k, v in summary.items():
+          totals[k] += v
+        checkpoint["lastId"] = docs[-1]["_id"]
+        checkpoint["rekeyed"] += summary["rekeyed"]
+        save_checkpoint(args.checkpoint, checkpoint)
+        elapsed = perf_counter() - start
+        print(f"{totals['rekeyed']} re-keyed, {totals['skipped']} already done, {totals['conflicts']} changed meanwhile, "
+              f"{totals['failed']} failed, {totals['rekeyed'] / elapsed:.1f} docs/s")
+  except (EncryptionError, PyMongoError, OSError) as e:
+    print(f"Re-keying stopped after {checkpoint['lastId']}: {e}")
+    sys.exit(1)
+
+  if totals["conflicts"] or totals["failed"]:
+    print("Run again without --resume to retry the documents that were not re-keyed")
+    sys.exit(1)
+  print(f"Re-keyed {totals['rekeyed']} documents")
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
@@ -0,0 +1,198 @@
+from argparse import ArgumentParser
+from bson import json_util
+from pymongo.errors import OperationFailure
+from urllib.parse import quote_plus
+import json
+import os
+import sys
+
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import get_client_manager
+from csfle_common.encryption import compile_encryption_plan
+from csfle_common.schema import SCHEMA_SOURCE, SCHEMA_CACHE_DIR, resolve_key_alt_names, schema_artifact_path, check_compiled_schema, load_compiled_schema
+
+
+# IN VALUES HERE!
+PETNAME = 
+MDB_PASSWORD = 
+APP_USER = "app_user"
+CA_PATH = "/etc/pki/tls/certs/ca.cert"
+
+def compile_schema(source, lookup):
+  """ Compiles a schema source definition into everything the clients and the server need
+
+  Parameters
+  -----------
+    source: dict
+      The source definition: {"namespace": "db.collection", "schema": {...}}
+    lookup: function
+      Returns the UUID of the DEK for a keyAltName, or None if there is no such DEK
+  Return
+  -----------
+    artifact: dict
+      "namespace"; "schemaMap" for AutoEncryptionOpts; "validator" for `collMod`; and
+      "encryptedPaths", one entry per encrypted field with its dotted path, algorithm and
+      either the DEK UUID or the document field holding the keyAltName; and "keys", the DEK UUID
+      each keyAltName resolved to, so `load_compiled_schema` can spot a recreated DEK
+    err: error
+      Error message or None of successful
+  """
+
+  namespace = source["namespace"]
+  keys = {}
+
+  def record(altName):
+    keys[altName] = lookup(altName)
+    return keys[altName]
+
+  schema, err = resolve_key_alt_names(source["schema"], record)
+  if err is not None:
+    return None, err
+  schema_map = {namespace: schema}
+
+  try:
+    plan = compile_encryption_plan(schema_map, namespace)
+  except ValueError as e:
+    return None, str(e)
+  encrypted_paths = [
+    {"path": ".".join(path + (name,)), "algorithm": algorithm, "keyId": key_id, "keyPointer": key_pointer}
+    for path, name, algorithm, key_id, key_pointer in plan
+  ]
+
+  return {
+    "namespace": namespace,
+    "schemaMap": schema_map,
+    "validator": {"$jsonSchema": schema},
+    "encryptedPaths": encrypted_paths,
+    "keys": keys
+  }, None
+
+def compile_cached(source_path, cache_dir, keyvault_namespace, client_encryption, refresh=False):
+  """ Returns the compiled artifact for a schema source, compiling and caching it if needed
+
+  Parameters
+  -----------
+    source_path: string
+      Path of the schema source definition
+    cache_dir: string
+      Directory holding the compiled artifacts
+    keyvault_namespace: string
+      The "db.collection" namespace of the key vault
+    client_encryption: mongo.ClientEncryption
+      An instantiated ClientEncryption instance that has access to the key vault
+    refresh: bool
+      Compile again even if an up to date artifact is cached
+  Return
+  -----------
+    artifact: dict
+      The compiled artifact, see `compile_schema`
+    err: error
+      Error message or None of successful
+  """
+
+  if not refresh:
+    # an artifact whose DEKs changed is compiled again
+    artifact, _ = load_compiled_schema(source_path, cache_dir, keyvault_namespace, client_encryption, verify=True)
+    if artifact is not None:
+      return artifact, None
+
+  with open(source_path) as f:
+    source = json.load(f)
+
+  def lookup(altName):
+    key = client_encryption.get_key_by_alt_name(altName)
+    return None if key is None else key["_id"]
+
+  artifact, err = compile_schema(source, lookup)
+  if err is not None:
+    return None, err
+
+  path = schema_artifact_path(source_path, cache_dir, keyvault_namespace)
+  os.makedirs(cache_dir, exist_ok=True)
+  with open(f"{path}.tmp", "w") as f:
+    f.write(json_util.dumps(artifact, indent=2))
+  os.replace(f"{path}.tmp", path)
+  return artifact, None
+
+def main():
+
+  parser = ArgumentParser(description="Compile the employee schema into a schema map, a server validator and an encrypted path table")
+  parser.add_argument("--source", default=SCHEMA_SOURCE, help="schema source definition")
+  parser.add_argument("--cache-dir", default=SCHEMA_CACHE_DIR, help="directory for the compiled artifacts")
+  mode = parser.add_mutually_exclusive_group()
+  mode.add_argument("--refresh", action="store_true", help="compile again even if the artifact is cached")
+  mode.add_argument("--check", action="store_true", help="only check the cached artifact's DEKs against the key vault")
+  parser.add_argument("--apply", action="store_true", help="also set the validator on the collection with collMod")
+  args = parser.parse_args()
+
+  # Obviously this should not be hardcoded
+  connection_string = "mongodb://%s:%s@csfle-mongodb-%s.mdbtraining.net/?serverSelectionTimeoutMS=5000&tls=true&tlsCAFile=%s" % (
+    quote_plus(APP_USER),
+    quote_plus(MDB_PASSWORD),
+    PETNAME,
+    quote_plus(CA_PATH)
+  )
+
+  # Declare or key vault namespce
+  keyvault_db = "__encryption"
+  keyvault_coll = "__keyVault"
+  keyvault_namespace = f"{keyvault_db}.{keyvault_coll}"
+
+  # declare our key provider type
+  provider = "kmip"
+
+  # declare our key provider attributes
+  kms_provider = {
+    provider: {
+      "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"
+    }
+  }
+
+  clients = get_client_manager(connection_string, kms_provider, keyvault_namespace, {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  })
+  client, err = clients.get_client()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  client_encryption, err = clients.get_client_encryption()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+
+  if args.check:
+    artifact, _ = load_compiled_schema(args.source, args.cache_dir, keyvault_namespace)
+    if artifact is None:
+      print(f"{args.source} has not been compiled")
+      sys.exit(1)
+    err = check_compiled_schema(artifact, client_encryption)
+    if err is not None:
+      print(err)
+      sys.exit(1)
+    print(f"The DEKs of {schema_artifact_path(args.source, args.cache_dir, keyvault_namespace)} match the key vault")
+    return
+
+  artifact, err = compile_cached(args.source, args.cache_dir, keyvault_namespace, client_encryption, refresh=args.refresh)
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  print(schema_artifact_path(args.source, args.cache_dir, keyvault_namespace))
+  for field in artifact["encryptedPaths"]:
+    print(f"  {field['path']}: {field['algorithm']}")
+
+  if args.apply:
+    db_name, coll_name = artifact["namespace"].split(".", 1)
+    try:
+      client[db_name].command("collMod", coll_name, validator=artifact["validator"])
+    except OperationFailure as e:
+      print(f"Cannot set the validator: {e}")
+      sys.exit(1)
+    print(f"Validator set on {artifact['namespace']}")
+
+if __name__ == "__main__":
+  main()
\ No newline at end of file
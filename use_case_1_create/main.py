@@ -9,8 +9,15 @@ from pymongo.errors import EncryptionError, ServerSelectionTimeoutError, Connect
 from random import randint
 from urllib.parse import quote_plus
 import names
+import os
 import sys
 
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.encryption import QUERY_CIPHERTEXT_CACHE
+from csfle_common.keys import DEK_CACHE, lookup_dek_id
+
 # IN VALUES HERE!
 PETNAME = 
 MDB_PASSWORD = 
@@ -45,7 +52,8 @@ def get_employee_key(client, altName, provider_name, keyId):
   """ Return a DEK's UUID for a give KeyAltName. Creates a new DEK if the DEK is not found.
   
   Queries a key vault for a particular KeyAltName and returns the UUID of the DEK, if found.
-  If not found, the UUID and Key Provider object and CMK ID are used to create a new DEK
+  If not found, the UUID and Key Provider object and CMK ID are used to create a new DEK.
+  Lookups and newly created DEKs go through `DEK_CACHE`
 
   Parameters
   -----------
@@ -65,16 +73,16 @@ def get_employee_key(client, altName, provider_name, keyId):
       Error message or None of successful
   """
 
-  employee_key_id = client.get_key_by_alt_name(str(altName))
+  employee_key_id = lookup_dek_id(client, str(altName))
   if employee_key_id == None:
     try:
       #PUT CODE HERE TO CREATE THE NEW DEK
       master_key = 
       employee_key_id = 
     except EncryptionError as e:
+      DEK_CACHE.invalidate(str(altName))
       return None, f"ClientEncryption error: {e}"
-  else:
-    employee_key_id = employee_key_id["_id"]
+    DEK_CACHE.put(str(altName), employee_key_id)
   return employee_key_id, None
 
 def main():
@@ -230,8 +238,8 @@ def main():
   encrypted_db = secure_client[encrypted_db_name]
 
   # ENCRYPT THE name.firstName and name.lastName here
-  payload["name"]["firstName"] = client_encryption.encrypt(firstname, Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, employee_key_id)
-  payload["name"]["lastName"] = client_encryption.encrypt(lastname, Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, employee_key_id)
+  payload["name"]["firstName"] = QUERY_CIPHERTEXT_CACHE.encrypt(client_encryption, firstname, Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, employee_key_id)
+  payload["name"]["lastName"] = QUERY_CIPHERTEXT_CACHE.encrypt(client_encryption, lastname, Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, employee_key_id)
 
   if type(payload["name"]["firstName"]) is not Binary or type(payload["name"]["lastName"]) is not Binary or payload["name"]["firstName"].subtype != 6 or payload["name"]["lastName"].subtype != 6:
     print("Data is not encrypted")
@@ -250,14 +258,15 @@ def main():
 
 
   try:  
-    enc_last_name = client_encryption.encrypt(lastname, Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, employee_key_id)
-    enc_first_name = client_encryption.encrypt(firstname, Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, employee_key_id)
+    enc_last_name = QUERY_CIPHERTEXT_CACHE.encrypt(client_encryption, lastname, Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, employee_key_id)
+    enc_first_name = QUERY_CIPHERTEXT_CACHE.encrypt(client_encryption, firstname, Algorithm.AEAD_AES_256_CBC_HMAC_SHA_512_Deterministic, employee_key_id)
     result = encrypted_db[encrypted_coll_name].find_one({"name.firstName": enc_first_name, "name.lastName": enc_last_name})
   except EncryptionError as e:
     print(f"Encryption error: {e}")
     sys.exit(1)
 
   pprint(result)
+  print(f"Query ciphertext cache: {QUERY_CIPHERTEXT_CACHE.stats()}")
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
@@ -1,53 +1,40 @@
-from bson.binary import STANDARD, Binary, UUID_SUBTYPE
+from bson.binary import STANDARD, UUID_SUBTYPE
 from bson.codec_options import CodecOptions
 from datetime import datetime
 from pprint import pprint
-from pymongo import MongoClient
+from pymongo import monitoring
 from pymongo.encryption import Algorithm
 from pymongo.encryption import ClientEncryption
-from pymongo.encryption_options import AutoEncryptionOpts
-from pymongo.errors import EncryptionError, ServerSelectionTimeoutError, ConnectionFailure
+from pymongo.errors import EncryptionError
 from random import randint
-from time import sleep
 from urllib.parse import quote_plus
 import names
+import os
 import sys
 
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.clients import get_client_manager
+from csfle_common.indexes import required_indexes, ensure_indexes, audit_queries, lookup_queries
+from csfle_common.keys import DEK_CACHE, lookup_dek_id
+from csfle_common.metrics import METRICS, CommandMetricsListener, InstrumentedClientEncryption, InstrumentedCollection, dump_metrics, start_metrics_server
+from csfle_common.schema import SCHEMA_SOURCE, SCHEMA_CACHE_DIR, load_compiled_schema
+from csfle_common.shred import shred_employees, confirm_shredded
+
 # IN VALUES HERE!
 PETNAME = 
 MDB_PASSWORD = 
 APP_USER = "app_user"
 CA_PATH = "/etc/pki/tls/certs/ca.cert"
-
-def mdb_client(connection_string, auto_encryption_opts=None):
-  """ Returns a MongoDB client instance
-  
-  Creates a  MongoDB client instance and tests the client via a `hello` to the server
-  
-  Parameters
-  ------------
-    connection_string: string
-      MongoDB connection string URI containing username, password, host, port, tls, etc
-  Return
-  ------------
-    client: mongo.MongoClient
-      MongoDB client instance
-    err: error
-      Error message or None of successful
-  """
-
-  try:
-    client = MongoClient(connection_string, auto_encryption_opts=auto_encryption_opts)
-    client.admin.command('hello')
-    return client, None
-  except (ServerSelectionTimeoutError, ConnectionFailure) as e:
-    return None, f"Cannot connect to database, please check settings in config file: {e}"
+METRICS_PORT = None # set to a port to serve the metrics at /metrics
 
 def get_employee_key(client, altName, provider_name, keyId):
   """ Return a DEK's UUID for a give KeyAltName. Creates a new DEK if the DEK is not found.
   
   Queries a key vault for a particular KeyAltName and returns the UUID of the DEK, if found.
-  If not found, the UUID and Key Provider object and CMK ID are used to create a new DEK
+  If not found, the UUID and Key Provider object and CMK ID are used to create a new DEK.
+  Lookups and newly created DEKs go through `DEK_CACHE`
 
   Parameters
   -----------
@@ -67,15 +54,15 @@ def get_employee_key(client, altName, provider_name, keyId):
       Error message or None of successful
   """
   
-  employee_key_id = client.get_key_by_alt_name(str(altName))
+  employee_key_id = lookup_dek_id(client, str(altName))
   if employee_key_id == None:
     try:
       master_key = {"keyId": keyId, "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"}
       employee_key_id = client.create_data_key(kms_provider=provider_name, master_key=master_key, key_alt_names=[str(altName)])
     except EncryptionError as e:
+      DEK_CACHE.invalidate(str(altName))
       return None, f"ClientEncryption error: {e}"
-  else:
-    employee_key_id = employee_key_id["_id"]
+    DEK_CACHE.put(str(altName), employee_key_id)
   return employee_key_id, None
 
 def main():
@@ -107,35 +94,67 @@ def main():
   encrypted_db_name = "companyData"
   encrypted_coll_name = "employee"
 
+  # record every command, split into key vault and data traffic, for all clients created below
+  monitoring.register(CommandMetricsListener(METRICS, keyvault_db))
+  if METRICS_PORT is not None:
+    start_metrics_server(METRICS_PORT)
+
+  # all clients for this configuration are created once and shared
+  clients = get_client_manager(connection_string, kms_provider, keyvault_namespace, {
+    "kmip": {
+      "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
+      "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
+    }
+  })
+
   # instantiate our MongoDB Client object
-  client, err = mdb_client(connection_string)
+  client, err = clients.get_client()
   if err is not None:
     print(err)
     sys.exit(1)
 
   # Create ClientEncryption instance for creating DEks and manual encryption
-  client_encryption = ClientEncryption(
-    kms_provider,
-    keyvault_namespace,
-    client,
-    CodecOptions(uuid_representation=STANDARD),
-    kms_tls_options = {
-      "kmip": {
-        "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
-        "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
-      }
-    }
-  )
+  client_encryption, err = clients.get_client_encryption()
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  client_encryption = InstrumentedClientEncryption(client_encryption)
+
+  # fail fast if a DEK or name lookup would scan a whole collection
+  missing, err = ensure_indexes(client, required_indexes(keyvault_db, keyvault_coll, encrypted_db_name, encrypted_coll_name))
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  for index in missing:
+    print(f"Created index on {index}")
+  try:
+    collscans, err = audit_queries(lookup_queries(client, client_encryption, keyvault_db, keyvault_coll, encrypted_db_name, encrypted_coll_name))
+  except EncryptionError as e:
+    print(f"Encryption error: {e}")
+    sys.exit(1)
+  if err is not None:
+    print(err)
+    sys.exit(1)
+  if collscans:
+    print(f"Lookups without an index: {', '.join(collscans)}")
+    sys.exit(1)
 
   employee_id = str("%05d" % randint(0,99999))
   firstname = names.get_first_name()
   lastname = names.get_last_name()
 
+  # a schema compiled by schema_compiler/main.py already holds the DEK UUIDs, so no lookup is needed;
+  # after recreating a DEK, run schema_compiler/main.py --check to find out whether it is out of date
+  compiled_schema, err = load_compiled_schema(SCHEMA_SOURCE, SCHEMA_CACHE_DIR, keyvault_namespace)
+  if err is not None:
+    print(err)
+
   # PUT CODE HERE TO RETRIEVE OUR COMMON (our first) DEK:
-  data_key_id_1 = client[keyvault_db][keyvault_coll].find_one({"keyAltNames": "dataKey1"},{"_id": 1})["_id"]
-  if data_key_id_1 is None:
-    print("Common DEK missing")
-    sys.exit(1)
+  if compiled_schema is None:
+    data_key_id_1 = lookup_dek_id(client_encryption, "dataKey1")
+    if data_key_id_1 is None:
+      print("Common DEK missing")
+      sys.exit(1)
 
   # retrieve the DEK UUID
   _, err = get_employee_key(client_encryption, employee_id, provider, '1')
@@ -168,122 +187,124 @@ def main():
 
   encrypted_db_name = "companyData"
   encrypted_coll_name = "employee"
-  schema_map = {
-    "companyData.employee": {
-      "bsonType": "object",
-      "encryptMetadata": {
-        "keyId": "/_id",
-        "algorithm": "AEAD_AES_256_CBC_HMAC_SHA_512-Random"
-      },
-      "properties": {
-        "name": {
-          "bsonType": "object",
-          "properties": {
-            "firstName": {
-              "encrypt" : {
-                "keyId": [ data_key_id_1 ],
-                "bsonType": "string",
-                "algorithm": "AEAD_AES_256_CBC_HMAC_SHA_512-Deterministic"
-              }
-            },
-            "lastName": {
-              "encrypt" : {
-                "keyId": [ data_key_id_1 ],
-                "bsonType": "string",
-                "algorithm": "AEAD_AES_256_CBC_HMAC_SHA_512-Deterministic"
-              }
-            },
-            "otherNames": {
-              "encrypt" : {
-                "bsonType": "string"
+  if compiled_schema is not None:
+    schema_map = compiled_schema["schemaMap"]
+  else:
+    schema_map = {
+      "companyData.employee": {
+        "bsonType": "object",
+        "encryptMetadata": {
+          "keyId": "/_id",
+          "algorithm": "AEAD_AES_256_CBC_HMAC_SHA_512-Random"
+        },
+        "properties": {
+          "name": {
+            "bsonType": "object",
+            "properties": {
+              "firstName": {
+                "encrypt" : {
+                  "keyId": [ data_key_id_1 ],
+                  "bsonType": "string",
+                  "algorithm": "AEAD_AES_256_CBC_HMAC_SHA_512-Deterministic"
+                }
+              },
+              "lastName": {
+                "encrypt" : {
+                  "keyId": [ data_key_id_1 ],
+                  "bsonType": "string",
+                  "algorithm": "AEAD_AES_256_CBC_HMAC_SHA_512-Deterministic"
+                }
+              },
+              "otherNames": {
+                "encrypt" : {
+                  "bsonType": "string"
+                }
               }
             }
-          }
-        },
-        "address": {
-          "encrypt": {
-            "bsonType": "object"
-          }
-        },
-        "dob": {
-          "encrypt": {
-            "bsonType": "date"
-          }
-        },
-        "phoneNumber": {
-          "encrypt": {
-            "bsonType": "string"
-          }
-        },
-        "salary": {
-          "encrypt": {
-            "bsonType": "double"
-          }
-        },
-        "taxIdentifier": {
-          "encrypt": {
-            "bsonType": "string"
+          },
+          "address": {
+            "encrypt": {
+              "bsonType": "object"
+            }
+          },
+          "dob": {
+            "encrypt": {
+              "bsonType": "date"
+            }
+          },
+          "phoneNumber": {
+            "encrypt": {
+              "bsonType": "string"
+            }
+          },
+          "salary": {
+            "encrypt": {
+              "bsonType": "double"
+            }
+          },
+          "taxIdentifier": {
+            "encrypt": {
+              "bsonType": "string"
+            }
           }
         }
       }
     }
-  }
-
-  auto_encryption = AutoEncryptionOpts(
-    kms_provider,
-    keyvault_namespace,
-    schema_map = schema_map,
-    kms_tls_options = {
-      "kmip": {
-        "tlsCAFile": "/etc/pki/tls/certs/ca.cert",
-        "tlsCertificateKeyFile": "/home/ec2-user/server.pem"
-      }
-    },
-    crypt_shared_lib_required = True,
-    mongocryptd_bypass_spawn = True,
-    crypt_shared_lib_path = '/lib/mongo_crypt_v1.so'
-  )
 
-  secure_client, err = mdb_client(connection_string, auto_encryption_opts=auto_encryption)
+  secure_client, err = clients.get_secure_client(schema_map)
   if err is not None:
     print(err)
     sys.exit(1)
-  encrypted_db = secure_client[encrypted_db_name]
+  employees = InstrumentedCollection(secure_client[encrypted_db_name][encrypted_coll_name])
 
   # remove `name.otherNames` if None because wwe cannot encrypt none
   if payload["name"]["otherNames"] is None:
     del(payload["name"]["otherNames"])
 
   try:
-    result = encrypted_db[encrypted_coll_name].insert_one(payload)
+    result = employees.insert_one(payload)
     print(result.inserted_id)
   except EncryptionError as e:
     print(f"Encryption error: {e}")
     sys.exit(1)
 
   try: 
-    result = encrypted_db[encrypted_coll_name].find_one({"name.firstName": firstname, "name.lastName": lastname})
+    result = employees.find_one({"name.firstName": firstname, "name.lastName": lastname})
 
     pprint(result)
   except EncryptionError as e:
     print(f"Encryption error: {e}")
     sys.exit(1)
 
-  client[keyvault_db][keyvault_coll].delete_one({"keyAltNames": employee_id})
-  result = encrypted_db[encrypted_coll_name].find_one({"name.firstName": firstname, "name.lastName": lastname})
-  pprint(result)
+  # crypto-shred the employee: delete their DEK and drop it from our own DEK cache
+  _, err = shred_employees(client[keyvault_db][keyvault_coll], None, [employee_id], caches=[DEK_CACHE])
+  if err is not None:
+    print(err)
+    sys.exit(1)
 
-  sleep(60)
+  # the secure client keeps the DEK cached for up to a minute, so this still decrypts
+  result = employees.find_one({"name.firstName": firstname, "name.lastName": lastname})
+  pprint(result)
 
-  try: 
-    result = encrypted_db[encrypted_coll_name].find_one({"name.firstName": firstname, "name.lastName": lastname})
-    
-    pprint(result)
-  except EncryptionError as e:
-    print(f"Encryption error: {e}")
+  # a ClientEncryption that has never used the DEK confirms the shredding without waiting for that cache
+  verifier = ClientEncryption(
+    kms_provider,
+    keyvault_namespace,
+    client,
+    CodecOptions(uuid_representation=STANDARD),
+    kms_tls_options = clients.kms_tls_options
+  )
+  remaining, err = confirm_shredded(client[keyvault_db][keyvault_coll], [employee_id], verifier, client[encrypted_db_name][encrypted_coll_name])
+  verifier.close()
+  if err is not None:
+    print(err)
     sys.exit(1)
+  if remaining:
+    print(f"Employee {employee_id} can still be decrypted")
+    sys.exit(1)
+  print(f"Employee {employee_id} has been shredded")
 
-
+  dump_metrics()
 
 if __name__ == "__main__":
   main()
\ No newline at end of file
@@ -11,8 +11,14 @@ from random import randint
 from time import sleep
 from urllib.parse import quote_plus
 import names
+import os
 import sys
 
+# The helpers shared by these scripts live in csfle_common/ at the root of the repository
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from csfle_common.keys import DEK_CACHE, lookup_dek_id
+
 # IN VALUES HERE!
 PETNAME = 
 MDB_PASSWORD = 
@@ -47,7 +53,8 @@ def get_employee_key(client, altName, provider_name, keyId):
   """ Return a DEK's UUID for a give KeyAltName. Creates a new DEK if the DEK is not found.
   
   Queries a key vault for a particular KeyAltName and returns the UUID of the DEK, if found.
-  If not found, the UUID and Key Provider object and CMK ID are used to create a new DEK
+  If not found, the UUID and Key Provider object and CMK ID are used to create a new DEK.
+  Lookups and newly created DEKs go through `DEK_CACHE`
 
   Parameters
   -----------
@@ -67,15 +74,15 @@ def get_employee_key(client, altName, provider_name, keyId):
       Error message or None of successful
   """
   
-  employee_key_id = client.get_key_by_alt_name(str(altName))
+  employee_key_id = lookup_dek_id(client, str(altName))
   if employee_key_id == None:
     try:
       master_key = {"keyId": keyId, "endpoint": f"csfle-kmip-{PETNAME}.mdbtraining.net"}
       employee_key_id = client.create_data_key(kms_provider=provider_name, master_key=master_key, key_alt_names=[str(altName)])
     except EncryptionError as e:
+      DEK_CACHE.invalidate(str(altName))
       return None, f"ClientEncryption error: {e}"
-  else:
-    employee_key_id = employee_key_id["_id"]
+    DEK_CACHE.put(str(altName), employee_key_id)
   return employee_key_id, None
 
 def main():
@@ -132,7 +139,7 @@ def main():
   lastname = names.get_last_name()
 
   # PUT CODE HERE TO RETRIEVE OUR COMMON (our first) DEK:
-  data_key_id_1 = client[keyvault_db][keyvault_coll].find_one({"keyAltNames": "dataKey1"},{"_id": 1})["_id"]
+  data_key_id_1 = lookup_dek_id(client_encryption, "dataKey1")
   if data_key_id_1 is None:
     print("Common DEK missing")
     sys.exit(1)